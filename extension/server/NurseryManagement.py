@@ -20,6 +20,19 @@ except ImportError:
     from pylabs import q
 
 import ArakoonManagement
+import logging
+import pipes
+import time
+from NurseryRebalancer import NurseryRebalancer
+
+def _checkSeparator(separator):
+    """
+    Refuse a separator that can not be passed on the command line
+
+    @raise ValueError: if the separator contains a NUL byte
+    """
+    if "\x00" in separator:
+        raise ValueError( "Separator %r can not be passed on the command line" % separator )
 
 class NurseryManagement:
     def getNursery(self, clusterId ):
@@ -43,6 +56,7 @@ class NurseryManagement:
 
 class NurseryManager:
     def __init__(self,clusterId):
+        self._keeperId = clusterId
         self._keeperCfg = NurseryManagement.getConfigLocation(clusterId)
 
     def migrate(self, leftClusterId, separator, rightClusterId):
@@ -64,8 +78,9 @@ class NurseryManager:
         @type rightClusterId:   string
         @rtype:                 void
         """
-        cmd = "%s -config %s --nursery-migrate %s %s %s" % (self.__which(), self._keeperCfg, leftClusterId, separator, rightClusterId)
-        self.__runCmd ( cmd )
+        _checkSeparator( separator )
+        self.__runCmd ( [ self.__which(), "-config", self._keeperCfg, "--nursery-migrate",
+                          leftClusterId, separator, rightClusterId ] )
 
     def initialize(self, firstClusterId):
         """
@@ -78,8 +93,7 @@ class NurseryManager:
 
         @rtype void
         """
-        cmd = "%s -config %s --nursery-init %s" % (self.__which(), self._keeperCfg, firstClusterId)
-        self.__runCmd ( cmd )
+        self.__runCmd ( [ self.__which(), "-config", self._keeperCfg, "--nursery-init", firstClusterId ] )
 
     def delete(self, clusterId, separator = None):
         """
@@ -93,16 +107,74 @@ class NurseryManager:
 
         @rtype void
         """
-        sep_string = None
         if separator is None:
-            sep_string = '""'
-        else:
-            sep_string = separator
+            separator = ""
+        _checkSeparator( separator )
+        self.__runCmd( [ self.__which(), "-config", self._keeperCfg, "--nursery-delete", clusterId, separator ] )
 
-        cmd = "%s -config %s --nursery-delete %s %s" % (self.__which(), self._keeperCfg, clusterId, sep_string)
-        self.__runCmd( cmd )
-
-    def __runCmd(self, cmd):
+    def rebalance(self, metric = 'keys', newClusterIds = None, execute = False,
+                  tolerance = 0.1, maxStep = None, maxRate = None, pageSize = 1000, samples = 1000,
+                  maxPages = 10):
+        """
+        Move the boundaries between the clusters of the nursery so they all hold an equal share
+
+        The keys around the new boundaries are scanned to estimate where they
+        should go. New clusters are added to the right end of the nursery. A
+        boundary far from where it should be can take more than one call to
+        get there, see NurseryRebalancer.
+
+        @param metric:          What to balance: 'keys' or 'bytes' (keys and values)
+        @type metric:           string
+        @param newClusterIds:   Clusters to add to the nursery
+        @type newClusterIds:    list of strings
+        @param execute:         Whether to run the migrations, or only return them
+        @type execute:          bool
+        @param tolerance:       Leave boundaries that are off by less than this fraction of a share
+        @type tolerance:        float
+        @param maxStep:         The most a single migration moves, in units of the metric
+        @type maxStep:          int
+        @param maxRate:         The most the migrations move per second, in units of the metric
+        @type maxRate:          float
+        @param pageSize:        The number of keys fetched per range query while scanning
+        @type pageSize:         int
+        @param samples:         The number of keys remembered per cluster to place the boundaries
+        @type samples:          int
+        @param maxPages:        The most range queries made from either end of a cluster while scanning
+        @type maxPages:         int
+
+        @rtype:                 list of (string, string, string) tuples
+        @return:                The migrations (leftClusterId, separator, rightClusterId), in order
+        """
+        keeper = q.clients.arakoon.getClient( self._keeperId )
+        try:
+            (routing, cfgs) = keeper.getNurseryConfig()
+        finally:
+            keeper.dropConnections()
+
+        clients = dict()
+        for clusterId in cfgs.iterkeys():
+            clients[clusterId] = q.clients.arakoon.getClient( clusterId )
+        try:
+            rebalancer = NurseryRebalancer( routing.getIntervals(), clients, metric, pageSize, samples,
+                                            maxPages )
+            steps = rebalancer.plan( newClusterIds, tolerance, maxStep )
+        finally:
+            for client in clients.itervalues():
+                client.dropConnections()
+
+        if execute:
+            for (left, separator, right, moved) in steps:
+                start = time.time()
+                logging.info( "Rebalancing nursery: moving %d %s (%s %s %s)" % (moved, metric, left, separator, right) )
+                self.migrate( left, separator, right )
+                if maxRate is not None:
+                    time.sleep( max(0.0, float(moved) / maxRate - (time.time() - start)) )
+
+        return [ (left, separator, right) for (left, separator, right, moved) in steps ]
+
+    def __runCmd(self, args):
+        # the command line goes through a shell, and separators are user keys
+        cmd = " ".join( [ pipes.quote(arg) for arg in args ] )
         (exit, stdout, stderr) = q.system.process.run( commandline = cmd, stopOnError=False)
         if exit :
             raise RuntimeError( stderr )
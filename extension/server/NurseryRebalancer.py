@@ -0,0 +1,238 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+
+class NurseryRebalancer:
+    """
+    Plans the migrations that give the clusters of a nursery an equal share
+
+    The share of every cluster follows from its key count (and, for bytes,
+    the size of its first keys). Only the keys around the new boundaries are
+    scanned, with paged range queries from the start of a cluster or reverse
+    ones from its end, and at most maxPages pages each way. Every so many keys,
+    the key and the total weight of the nursery's keys before it are
+    remembered; boundaries are placed on those keys. A boundary that lies
+    past the scanned keys moves as far as they go, and further on a next pass.
+    """
+    def __init__(self, intervals, clients, metric = 'keys', pageSize = 1000, samples = 1000,
+                 maxPages = 10):
+        """
+        @param intervals:  The key ranges of the clusters, in key order, as returned by RoutingInfo.getIntervals
+        @param clients:    An ArakoonClient per cluster
+        @type clients:     dict
+        """
+        if metric not in ('keys', 'bytes'):
+            raise ValueError( "Unknown metric '%s', expected 'keys' or 'bytes'" % metric )
+        self._intervals = intervals
+        self._clients = clients
+        self._metric = metric
+        self._pageSize = pageSize
+        self._samples = samples
+        self._maxPages = maxPages
+        self._keys = []
+        self._weights = []
+        # indices i of _keys whose keys between i - 1 and i were not scanned
+        self._gaps = set()
+        self._total = 0
+
+    def _sample(self, clusterCount):
+        counts = [ self._clients[clusterId].getKeyCount() for (lower, upper, clusterId) in self._intervals ]
+        estimates = [ self._estimate( self._clients[clusterId], lower, upper, count )
+                      for ((lower, upper, clusterId), count) in zip(self._intervals, counts) ]
+        share = float(sum(estimates)) / clusterCount
+        goals = [ share * i for i in range(1, clusterCount) ]
+
+        total = 0
+        for ((lower, upper, clusterId), count, estimate) in zip(self._intervals, counts, estimates):
+            if lower is not None:
+                self._keys.append( lower )
+                self._weights.append( total )
+            inside = [ goal - total for goal in goals if total <= goal <= total + estimate ]
+            clusterTotal = self._scan( self._clients[clusterId], lower, upper, total,
+                                       count, estimate, inside )
+            logging.info( "Cluster %s holds %d %s" % (clusterId, clusterTotal, self._metric) )
+            total += clusterTotal
+        self._total = total
+
+    def _estimate(self, client, lower, upper, count):
+        if self._metric == 'keys' or count == 0:
+            return count
+        page = client.range_entries( lower, True, upper, False, self._pageSize )
+        if len(page) < self._pageSize:
+            return sum( [ len(key) + len(value) for (key, value) in page ] )
+        return count * sum( [ len(key) + len(value) for (key, value) in page ] ) / len(page)
+
+    def _page(self, client, begin, beginIncluded, end, endIncluded, reverse):
+        if self._metric == 'keys' and not reverse:
+            page = client.range( begin, beginIncluded, end, endIncluded, self._pageSize )
+            return page, [1] * len(page)
+        if reverse:
+            # there is no reverse query for keys only
+            page = client.rev_range_entries( begin, beginIncluded, end, endIncluded, self._pageSize )
+        else:
+            page = client.range_entries( begin, beginIncluded, end, endIncluded, self._pageSize )
+        if self._metric == 'keys':
+            sizes = [1] * len(page)
+        else:
+            sizes = [ len(key) + len(value) for (key, value) in page ]
+        return [ key for (key, value) in page ], sizes
+
+    def _scan(self, client, lower, upper, offset, count, estimate, goals):
+        """
+        Sample the keys of a cluster around the goals, weights relative to its start
+
+        @return: the weight of the cluster, exact if it was scanned completely
+        """
+        if len(goals) == 0:
+            if estimate > 0:
+                self._gaps.add( len(self._keys) )
+            return estimate
+        stride = max( 1, count / self._samples )
+        half = estimate / 2.0
+        forward = [ goal for goal in goals if goal <= half ]
+        backward = [ goal for goal in goals if goal > half ]
+
+        # from the start, until past the last goal in the first half
+        weight = 0
+        n = 0
+        begin = lower
+        beginIncluded = True
+        pages = 0
+        while len(forward) > 0 and weight <= max(forward) and pages < self._maxPages:
+            page, sizes = self._page( client, begin, beginIncluded, upper, False, False )
+            pages += 1
+            for (key, size) in zip(page, sizes):
+                if n % stride == 0 and key != lower and "\x00" not in key:
+                    self._keys.append( key )
+                    self._weights.append( offset + weight )
+                weight += size
+                n += 1
+            if len(page) < self._pageSize:
+                return weight
+            begin = page[-1]
+            beginIncluded = False
+        front = weight
+
+        # from the end, down to where the forward scan stopped, until past
+        # the first goal in the second half
+        tail = []
+        weight = 0
+        n = 0
+        end = begin
+        endIncluded = beginIncluded
+        begin = upper
+        beginIncluded = False
+        pages = 0
+        met = False
+        while len(backward) > 0 and weight < estimate - min(backward) and pages < self._maxPages:
+            page, sizes = self._page( client, begin, beginIncluded, end, endIncluded, True )
+            pages += 1
+            for (key, size) in zip(page, sizes):
+                weight += size
+                if n % stride == 0 and key != lower and "\x00" not in key:
+                    tail.append( (key, weight) )
+                n += 1
+            if len(page) < self._pageSize:
+                met = True
+                break
+            begin = page[-1]
+            beginIncluded = False
+
+        if met:
+            estimate = front + weight
+        else:
+            self._gaps.add( len(self._keys) )
+        low = 0
+        if len(self._weights) > 0:
+            low = self._weights[-1]
+        for (key, after) in reversed( tail ):
+            # the cluster's weight may only be estimated, its keys must stay in order
+            self._keys.append( key )
+            self._weights.append( max( low, offset + estimate - after ) )
+        return estimate
+
+    def _target(self, goal, position):
+        # the sample at goal's weight; in a part that was not scanned, the one
+        # on the side of position
+        end = len(self._keys)
+        target = min( bisect_left(self._weights, goal), end )
+        if target in self._gaps and target < end and self._weights[target] != goal:
+            if position < target:
+                target -= 1
+        return target
+
+    def plan(self, newClusterIds = None, tolerance = 0.1, maxStep = None):
+        """
+        @return: the migrations as (leftClusterId, separator, rightClusterId, moved) tuples,
+            where moved is the estimated weight that changes cluster
+        """
+        clusterIds = [ clusterId for (lower, upper, clusterId) in self._intervals ]
+        if newClusterIds is not None:
+            clusterIds.extend( newClusterIds )
+        self._sample( len(clusterIds) )
+        share = float(self._total) / len(clusterIds)
+        if share == 0:
+            return []
+
+        # Boundaries are indices in _keys; the new clusters start out empty,
+        # with their boundaries past the last key.
+        end = len(self._keys)
+        current = [ bisect_left(self._keys, lower) for (lower, upper, clusterId) in self._intervals[1:] ]
+        current.extend( [end] * (len(clusterIds) - len(self._intervals)) )
+        target = [ self._target( share * i, c ) for (i, c) in zip( range(1, len(clusterIds)), current ) ]
+
+        weights = self._weights + [self._total]
+        pending = [ abs( weights[c] - share * i ) > tolerance * share
+                    for (i, c) in zip( range(1, len(clusterIds)), current ) ]
+        steps = []
+        moving = True
+        while moving:
+            moving = False
+            for i in range( len(current) ):
+                if not pending[i] or current[i] == target[i]:
+                    continue
+                if current[i] == end and i > 0 and current[i - 1] == end:
+                    # the cluster to the left is not part of the nursery yet
+                    continue
+                lowest = 0
+                if i > 0:
+                    lowest = current[i - 1] + 1
+                highest = end - 1
+                if i + 1 < len(current):
+                    highest = current[i + 1] - 1
+                position = self._step( current[i], max(lowest, min(target[i], highest)), maxStep )
+                if position == current[i]:
+                    continue
+                moved = abs( weights[position] - weights[current[i]] )
+                steps.append( (clusterIds[i], self._keys[position], clusterIds[i + 1], moved) )
+                current[i] = position
+                moving = True
+        return steps
+
+    def _step(self, position, goal, maxStep):
+        if maxStep is None or position == goal:
+            return goal
+        weights = self._weights + [self._total]
+        if goal < position:
+            step = bisect_left( weights, weights[position] - maxStep, goal, position )
+        else:
+            step = bisect_right( weights, weights[position] + maxStep, position, goal + 1 ) - 1
+        # move at least one key, even if it weighs more than maxStep
+        if step == position:
+            step += cmp(goal, position)
+        return step
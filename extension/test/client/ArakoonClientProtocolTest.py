@@ -15,8 +15,15 @@ limitations under the License.
 """
 
 from nose.tools import *
+from nose.plugins.skip import SkipTest
 
 from arakoon import *
+from arakoon.ArakoonProtocol import *
+from arakoon.ArakoonClientConnection import ArakoonClientConnection
+
+import new
+import struct
+import sys
 
 UT_ENCODED_GET_REQUEST = "0800EDFE030000006B6579"
 UT_ENCODED_SET_REQUEST = "0900EDFE030000006B65790500000076616C7565"
@@ -26,6 +33,8 @@ UT_ENCODED_DELETE_REQUEST = "0A00EDFE030000006B6579"
 UT_ENCODED_RANGE_REQUEST = "0B00EDFE0105000000737461727401010400000073746F700070000000"
 UT_ENCODED_PREFIX_KEYS_REQUEST = "0C00EDFE0600000070726566697870000000"
 UT_ENCODED_TEST_AND_SET_REQUEST = "0D00EDFE030000006B657901060000006F6C6456616C060000006E657756616C"
+UT_ENCODED_MULTI_GET_REQUEST = "1100FFB100020000000100000061020000006263"
+UT_ENCODED_SEQUENCE_REQUEST = "1000FFB11F000000050000000200000001000000010000006B0100000076020000000100000064"
 
 
 UT_ENCODED_STRING_RESPONSE = "000000000500000076616C7565"
@@ -79,6 +88,17 @@ def test_encode_test_and_set ():
     encodedTestAndSetReq = _binStringToHex( ArakoonProtocol.encodeTestAndSet( "key", "oldVal", "newVal" ) )
     assert_equals( encodedTestAndSetReq, UT_ENCODED_TEST_AND_SET_REQUEST )
 
+def test_encode_multi_get():
+    encodedMultiGetReq = _binStringToHex( ArakoonProtocol.encodeMultiGet( ["a", "bc"], Consistent() ) )
+    assert_equals( encodedMultiGetReq, UT_ENCODED_MULTI_GET_REQUEST )
+
+def test_encode_sequence():
+    seq = Sequence()
+    seq.addSet( "k", "v" )
+    seq.addDelete( "d" )
+    encodedSequenceReq = _binStringToHex( ArakoonProtocol.encodeSequence( seq, False ) )
+    assert_equals( encodedSequenceReq, UT_ENCODED_SEQUENCE_REQUEST )
+
 def test_decode_string_response():
     value = ArakoonProtocol.decodeStringResult( _hexStringToBinary( UT_ENCODED_STRING_RESPONSE ) )
     assert_equals( value, "value" )
@@ -89,6 +109,94 @@ def test_decode_void_response ():
 def test_decode_error_response() :
     assert_raises( ArakoonException, ArakoonProtocol.decodeVoidResult, ( _hexStringToBinary( UT_ENCODED_ERROR_RESPONSE ) ) )
 
+def _bufferedConnection( response ):
+    con = new.instance( ArakoonClientConnection )
+    con._rbuf = bytearray( response )
+    con._rview = memoryview( con._rbuf )
+    con._rstart = 0
+    con._rend = len( response )
+    con._connected = True
+    return con
+
+def _withAndWithoutCodec( f ):
+    protocolModule = sys.modules[ ArakoonProtocol.__module__ ]
+    codec = protocolModule._codec
+    if codec is None:
+        raise SkipTest( "compiled codec not built" )
+    compiled = f()
+    protocolModule._codec = None
+    try:
+        python = f()
+    finally:
+        protocolModule._codec = codec
+    assert_equals( compiled, python )
+    return compiled
+
+def _packString( s ):
+    return struct.pack( "I", len(s) ) + s
+
+def _namedField( type, name, value ):
+    return struct.pack( "I", type ) + _packString( name ) + value
+
+def test_compiled_codec_encode():
+    keys = [ "a", "bc", "", "\x00\xff" * 100 ]
+    _withAndWithoutCodec( lambda: ArakoonProtocol.encodeMultiGet( keys, Consistent() ) )
+
+    seq = Sequence()
+    seq.addSet( "k", "v" )
+    seq.addDelete( "d" )
+    seq.addAssert( "a", None )
+    seq.addAssert( "a", "v" )
+    seq.addAssertExists( "e" )
+    inner = Sequence()
+    inner.addSet( "x", "y" )
+    seq.addUpdate( inner )
+    _withAndWithoutCodec( lambda: ArakoonProtocol.encodeSequence( seq, True ) )
+
+def test_compiled_codec_decode_lists():
+    strings = [ "k%d" % i for i in range( 1000 ) ]
+    response = struct.pack( "II", 0, len(strings) ) + "".join( map( _packString, strings ) )
+    result = _withAndWithoutCodec(
+        lambda: ArakoonProtocol.decodeStringListResult( _bufferedConnection( response ) ) )
+    assert_equals( result, list( reversed( strings ) ) )
+    result = _withAndWithoutCodec(
+        lambda: ArakoonProtocol.decodeStringArrayResult( _bufferedConnection( response ) ) )
+    assert_equals( result, strings )
+
+    response = struct.pack( "II", 0, 3 ) + "\x01" + _packString( "a" ) + "\x00" + "\x01" + _packString( "" )
+    result = _withAndWithoutCodec(
+        lambda: ArakoonProtocol.decodeStringOptionArrayResult( _bufferedConnection( response ) ) )
+    assert_equals( result, [ "a", None, "" ] )
+
+    response = struct.pack( "II", 0, 2 ) + "".join( map( _packString, [ "k2", "v2", "k1", "v1" ] ) )
+    result = _withAndWithoutCodec(
+        lambda: ArakoonProtocol.decodeStringPairListResult( _bufferedConnection( response ) ) )
+    assert_equals( result, [ ("k1", "v1"), ("k2", "v2") ] )
+
+def test_compiled_codec_decode_statistics():
+    fields = [ _namedField( NAMED_FIELD_TYPE_INT, "i", struct.pack( "I", 7 ) ),
+               _namedField( NAMED_FIELD_TYPE_INT64, "q", struct.pack( "q", -5 ) ),
+               _namedField( NAMED_FIELD_TYPE_FLOAT, "f", struct.pack( "d", 1.5 ) ),
+               _namedField( NAMED_FIELD_TYPE_STRING, "s", _packString( "v" ) ) ]
+    stats = _namedField( NAMED_FIELD_TYPE_LIST, "arakoon_stats",
+                         struct.pack( "I", len(fields) ) + "".join( fields ) )
+    response = struct.pack( "I", 0 ) + _packString( stats )
+    result = _withAndWithoutCodec(
+        lambda: ArakoonProtocol.decodeStatistics( _bufferedConnection( response ) ) )
+    assert_equals( result, { "i" : 7, "q" : -5, "f" : 1.5, "s" : "v" } )
+
+def test_decode_entry_list():
+    response = struct.pack( "II", 0, 3 ) + "".join( map( _packString, [ "k3", "", "k2", "v2", "k1", "v1" ] ) )
+    entries = ArakoonProtocol.decodeEntryListResult( _bufferedConnection( response ) )
+    assert_equals( len(entries), 3 )
+    assert_equals( list(entries), [ ("k1", "v1"), ("k2", "v2"), ("k3", "") ] )
+    assert_equals( entries[-1], ("k3", "") )
+    assert_equals( entries[1:], [ ("k2", "v2"), ("k3", "") ] )
+    assert_equals( entries.keys(), [ "k1", "k2", "k3" ] )
+    assert_equals( entries.get( "k2" ), "v2" )
+    assert_equals( entries.get( "k0" ), None )
+    assert_equals( entries.get( "k4", "x" ), "x" )
+
 if __name__ == "__main__" :
 
     test_encode_get_request ()
@@ -99,7 +207,14 @@ if __name__ == "__main__" :
     test_encode_range()
     test_encode_prefix_keys()
     test_encode_test_and_set()
+    test_encode_multi_get()
+    test_encode_sequence()
 
     test_decode_void_response()
     test_decode_string_response()
     test_decode_error_response()
+
+    test_compiled_codec_encode()
+    test_compiled_codec_decode_lists()
+    test_compiled_codec_decode_statistics()
+    test_decode_entry_list()
@@ -0,0 +1,801 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Tests of the client against the in-process nodes of ArakoonFakeNode
+
+from nose.tools import *
+
+from arakoon import Arakoon
+from arakoon import ArakoonRetry
+from arakoon.ArakoonMasterCache import ArakoonMasterCache
+from arakoon.ArakoonReadBalancer import ArakoonReadBalancer
+from arakoon import ArakoonAsync
+from arakoon.ArakoonAsync import AsyncArakoonClient
+from arakoon.ArakoonProtocol import *
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonClientConnection import *
+from arakoon.ArakoonValidators import SignatureValidator
+
+from ArakoonFakeNode import FakeCluster
+
+import new
+import os
+import sys
+import socket
+import ssl
+import struct
+import tempfile
+import threading
+import time
+import warnings
+
+_clusters = []
+
+def _cluster( nodeCount = 1 ):
+    cluster = FakeCluster( nodeCount )
+    _clusters.append( cluster )
+    return cluster
+
+def teardown():
+    while _clusters:
+        _clusters.pop().stop()
+
+def _silentNode():
+    # accepts connections but never reads from them
+    listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    listener.bind( ("127.0.0.1", 0) )
+    listener.listen( 1 )
+    return listener
+
+def test_connect_deadline_does_not_outlive_call():
+    cluster = _cluster()
+    node = cluster.node(0)
+    with callDeadline( time.time() + 0.5 ):
+        con = ArakoonClientConnection( ([ "127.0.0.1" ], node.port), cluster.clusterId, cluster.config() )
+    try:
+        assert_equals( con._socket.gettimeout(), ArakoonClientConfig.getConnectionTimeout() )
+    finally:
+        con.close()
+
+def test_send_timeout_under_deadline():
+    listener = _silentNode()
+    try:
+        con = ArakoonClientConnection( ([ "127.0.0.1" ], listener.getsockname()[1]), "fake",
+                                       ArakoonClientConfig( "fake", {} ) )
+        with callDeadline( time.time() + 0.2 ):
+            assert_raises( ArakoonTimeout, con.send, "x" * (64 * 1024 * 1024) )
+        assert_false( con._connected )
+    finally:
+        listener.close()
+
+def test_async_large_requests_and_responses():
+    # both directions carry more than the socket buffers hold at once
+    cluster = _cluster()
+    big = "v" * (16 * 1024 * 1024)
+    cluster.store["big"] = big
+    client = AsyncArakoonClient( cluster.config() )
+    try:
+        futures = []
+        for i in range( 4 ):
+            futures.append( client.get( "big" ) )
+            futures.append( client.set( "k%d" % i, big ) )
+        for i, future in enumerate( futures ):
+            assert_equals( future.result( 30 ), big if i % 2 == 0 else None )
+        assert_equals( cluster.store["k3"], big )
+    finally:
+        client.dropConnections()
+
+def test_async_connection_lost():
+    cluster = _cluster()
+    node = cluster.node(0)
+    client = AsyncArakoonClient( cluster.config() )
+    try:
+        cluster.store["k"] = "v"
+        node.failures.append( (ARA_CMD_GET, 'close') )
+        # a read is retried on a new connection after losing the first
+        assert_equals( client.get( "k" ).result( 30 ), "v" )
+        assert_equals( node.count( ARA_CMD_GET ), 2 )
+        # an update may have been applied, so it is not
+        node.failures.append( (ARA_CMD_SET, 'close') )
+        assert_raises( ArakoonSockReadNoBytes, client.set( "k", "w" ).result, 30 )
+        node.failures.append( (ARA_CMD_GET, ARA_ERR_NOT_FOUND) )
+        assert_raises( ArakoonNotFound, client.get( "k" ).result, 30 )
+    finally:
+        client.dropConnections()
+
+def test_async_retries_share_a_thread():
+    cluster = _cluster()
+    node = cluster.node(0)
+    cluster.store["k"] = "v"
+    client = AsyncArakoonClient( cluster.config() )
+    shared = ArakoonRetry.ARA_RETRY_BUDGET
+    ArakoonRetry.ARA_RETRY_BUDGET = ArakoonRetry.ArakoonRetryBudget()
+    try:
+        assert_equals( client.get( "k" ).result( 30 ), "v" )
+        threads = threading.activeCount()
+        for i in range( 20 ):
+            node.failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+        futures = [ client.get( "k" ) for i in range( 20 ) ]
+        # every call failed once and waits for its retry
+        time.sleep( 0.3 )
+        assert_equals( len( client._scheduler ), 20 )
+        assert_true( threading.activeCount() <= threads + 1 )
+        assert_equals( [ f.result( 30 ) for f in futures ], [ "v" ] * 20 )
+    finally:
+        ArakoonRetry.ARA_RETRY_BUDGET = shared
+        client.dropConnections()
+
+def test_async_pending_retries_capped():
+    cluster = _cluster()
+    node = cluster.node(0)
+    cluster.store["k"] = "v"
+    client = AsyncArakoonClient( cluster.config() )
+    limit = ArakoonAsync.ARA_ASYNC_MAX_PENDING_RETRIES
+    ArakoonAsync.ARA_ASYNC_MAX_PENDING_RETRIES = 1
+    try:
+        node.failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+        node.failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+        first = client.get( "k" )
+        # no room left to wait for a retry
+        assert_raises( ArakoonGoingDown, client.get( "k" ).result, 30 )
+        assert_equals( first.result( 30 ), "v" )
+    finally:
+        ArakoonAsync.ARA_ASYNC_MAX_PENDING_RETRIES = limit
+        client.dropConnections()
+
+def test_async_calls_do_not_wait_for_discovery():
+    cluster = _cluster( 2 )
+    cluster.store["k"] = "v"
+    for i in range( 2 ):
+        cluster.node(i).delay = 0.5
+    client = AsyncArakoonClient( cluster.config() )
+    try:
+        start = time.time()
+        futures = [ client.get( "k" ) for i in range( 10 ) ]
+        assert_true( time.time() - start < 0.4 )
+        assert_equals( [ f.result( 30 ) for f in futures ], [ "v" ] * 10 )
+        # the waiting calls shared one connection, next to the one used for the lookup
+        assert_equals( cluster.node(0).accepted, 2 )
+    finally:
+        client.dropConnections()
+
+def test_async_discovery_failure():
+    cluster = _cluster( 2 )
+    cluster.master = None
+    client = AsyncArakoonClient( cluster.config() )
+    limit = ArakoonAsync.ARA_ASYNC_MAX_PENDING_RETRIES
+    ArakoonAsync.ARA_ASYNC_MAX_PENDING_RETRIES = 0
+    try:
+        futures = [ client.set( "k", "v" ) for i in range( 3 ) ]
+        for future in futures:
+            assert_raises( ArakoonNoMaster, future.result, 30 )
+    finally:
+        ArakoonAsync.ARA_ASYNC_MAX_PENDING_RETRIES = limit
+        client.dropConnections()
+
+def test_pipeline_larger_than_socket_buffers():
+    cluster = _cluster()
+    big = "v" * (512 * 1024)
+    cluster.store["big"] = big
+    client = Arakoon.ArakoonClient( cluster.config() )
+    p = client.pipeline()
+    for i in range( 40 ):
+        p.set( "k%d" % i, big )
+        p.get( "big" )
+    results = p.execute( timeout = 30 )
+    assert_equals( results, [ None, big ] * 40 )
+    assert_equals( cluster.store["k39"], big )
+
+def test_pipeline_errors():
+    cluster = _cluster()
+    cluster.store["a"] = "1"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    p = client.pipeline()
+    p.get( "a" )
+    p.get( "missing" )
+    p.exists( "a" )
+    results = p.execute( raiseOnError = False )
+    assert_equals( results[0], "1" )
+    assert_true( isinstance( results[1], ArakoonNotFound ) )
+    assert_equals( results[2], True )
+
+    p.get( "missing" )
+    p.set( "b", "2" )
+    assert_raises( ArakoonNotFound, p.execute )
+    assert_equals( cluster.store["b"], "2" )
+
+    # losing the connection aborts the whole exchange
+    cluster.node(0).failures.append( (ARA_CMD_GET, 'close') )
+    p.get( "a" )
+    p.get( "a" )
+    assert_raises( ArakoonSocketException, p.execute )
+
+def test_bulk_load_retries_in_order():
+    cluster = _cluster()
+    node = cluster.node(0)
+    client = Arakoon.ArakoonClient( cluster.config() )
+    # one pair per sequence, the second of a window of four is refused
+    entries = [ ("k", "1"), ("k", "2"), ("j", "3"), ("k", "4") ]
+    node.failures.append( (ARA_CMD_SEQ, ARA_ERR_NOT_MASTER, 1) )
+    report = client.bulk_load( entries, batch_bytes = 1, inflight = 4 )
+    assert_equals( cluster.store, { "k" : "4", "j" : "3" } )
+    assert_equals( report["keys"], 4 )
+    assert_equals( report["batches"], 4 )
+    assert_equals( report["retried"], 3 )
+    applied = [ updates[0][2] for updates in cluster.sequences ]
+    assert_equals( applied, [ "1", "3", "4", "2", "3", "4" ] )
+
+    # a sequence that fails again when it is sent on its own aborts the load
+    node.failures.append( (ARA_CMD_SEQ, ARA_ERR_BAD_INPUT) )
+    node.failures.append( (ARA_CMD_SEQ, ARA_ERR_BAD_INPUT, 3) )
+    assert_raises( ArakoonException, client.bulk_load, entries, 1, 4 )
+
+def _concurrently( calls ):
+    # run the callables in threads, returning their results or exceptions
+    results = [ None ] * len(calls)
+    def run( i ):
+        try:
+            results[i] = calls[i]()
+        except Exception, ex:
+            results[i] = ex
+    threads = [ threading.Thread( target = run, args = (i, ) ) for i in range( len(calls) ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_coalescing():
+    cluster = _cluster()
+    node = cluster.node(0)
+    for i in range( 8 ):
+        cluster.store["k%d" % i] = "v%d" % i
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.enableCoalescing( window = 0.2, maxKeys = 9 )
+    calls = [ lambda i = i: client.get( "k%d" % i ) for i in range( 8 ) ]
+    calls.append( lambda: client.get( "missing" ) )
+    results = _concurrently( calls )
+    assert_equals( results[:8], [ "v%d" % i for i in range( 8 ) ] )
+    assert_true( isinstance( results[8], ArakoonNotFound ) )
+    assert_equals( node.count( ARA_CMD_MULTI_GET_OPTION ), 1 )
+    assert_equals( node.count( ARA_CMD_GET ), 0 )
+
+def test_coalescing_follower_deadline():
+    cluster = _cluster()
+    cluster.store["a"] = "1"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.whoMaster()
+    client.enableCoalescing( window = 0.1 )
+    cluster.node(0).delay = 1.0
+    leader = threading.Thread( target = client.get, args = ( "a", ) )
+    leader.start()
+    time.sleep( 0.02 )
+    # joins the leader's batch, but does not wait for it beyond its own timeout
+    start = time.time()
+    assert_raises( ArakoonTimeout, client.get, "a", timeout = 0.3 )
+    assert_true( time.time() - start < 0.9 )
+    leader.join()
+
+def _hedgingClient( cluster ):
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.setConsistency( NoGuarantee() )
+    client.setDirtyReadNode( cluster.node(1).name )
+    client.enableHedging( percentile = 90, initialDelay = 0.05 )
+    return client
+
+def test_hedging():
+    cluster = _cluster( 3 )
+    cluster.store["a"] = "1"
+    client = _hedgingClient( cluster )
+    slow = cluster.node(1)
+    # a fast node answers on its own
+    assert_equals( client.get( "a" ), "1" )
+    assert_equals( slow.count( ARA_CMD_GET ), 1 )
+    assert_equals( cluster.node(0).count( ARA_CMD_GET ) + cluster.node(2).count( ARA_CMD_GET ), 0 )
+
+    slow.delay = 1.0
+    start = time.time()
+    assert_equals( client.get( "a" ), "1" )
+    assert_true( time.time() - start < 0.5 )
+    assert_equals( cluster.node(0).count( ARA_CMD_GET ) + cluster.node(2).count( ARA_CMD_GET ), 1 )
+
+def test_hedging_failover():
+    cluster = _cluster( 3 )
+    cluster.store["a"] = "1"
+    client = _hedgingClient( cluster )
+    node = cluster.node(1)
+    node.failures.append( (ARA_CMD_GET, 'close') )
+    assert_equals( client.get( "a" ), "1" )
+    assert_equals( cluster.node(0).count( ARA_CMD_GET ) + cluster.node(2).count( ARA_CMD_GET ), 1 )
+    # an answer from the server is not sent elsewhere
+    assert_raises( ArakoonNotFound, client.get, "missing" )
+    assert_equals( cluster.node(0).count( ARA_CMD_GET ) + cluster.node(2).count( ARA_CMD_GET ), 1 )
+
+def test_range_entries_compact():
+    # more than the receive buffer holds, so the pairs arrive in several reads
+    cluster = _cluster()
+    expected = [ ("k%04d" % i, "v" * (i % 2000)) for i in range( 1000 ) ]
+    cluster.store.update( expected )
+    client = Arakoon.ArakoonClient( cluster.config() )
+    entries = client.range_entries( None, True, None, True, -1, compact = True )
+    assert_equals( len(entries), 1000 )
+    assert_equals( list( entries ), expected )
+    assert_equals( entries.get( "k0999" ), expected[-1][1] )
+    assert_equals( client.range_entries( "x", True, None, True, compact = True ).keys(), [] )
+
+def test_retry_after_master_change():
+    cluster = _cluster( 2 )
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.set( "a", "1" )
+    cluster.master = cluster.node(1).name
+    client.set( "b", "2" )
+    assert_equals( cluster.store, { "a" : "1", "b" : "2" } )
+    assert_equals( client.whoMaster(), cluster.node(1).name )
+
+def test_retry_policies():
+    cluster = _cluster()
+    node = cluster.node(0)
+    cluster.store["a"] = "1"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    node.failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+    assert_equals( client.get( "a" ), "1" )
+    # the update may have been applied before the node went down
+    node.failures.append( (ARA_CMD_SET, ARA_ERR_GOING_DOWN) )
+    assert_raises( ArakoonGoingDown, client.set, "a", "2" )
+    assert_equals( node.count( ARA_CMD_SET ), 1 )
+
+def test_retry_budget():
+    budget = ArakoonRetry.ArakoonRetryBudget( ratio = 0.5, minPerSecond = 0, maxTokens = 2 )
+    assert_true( budget.withdraw() )
+    assert_true( budget.withdraw() )
+    assert_false( budget.withdraw() )
+    budget.deposit()
+    budget.deposit()
+    assert_true( budget.withdraw() )
+
+    cluster = _cluster()
+    node = cluster.node(0)
+    cluster.store["a"] = "1"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    shared = ArakoonRetry.ARA_RETRY_BUDGET
+    ArakoonRetry.ARA_RETRY_BUDGET = ArakoonRetry.ArakoonRetryBudget( ratio = 0, minPerSecond = 0, maxTokens = 1 )
+    try:
+        node.failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+        assert_equals( client.get( "a" ), "1" )
+        node.failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+        assert_raises( ArakoonGoingDown, client.get, "a" )
+    finally:
+        ArakoonRetry.ARA_RETRY_BUDGET = shared
+
+def test_deprecated_retry_settings():
+    config = ArakoonClientConfig( "fake", {} )
+    with warnings.catch_warnings( record = True ) as caught:
+        warnings.simplefilter( "always" )
+        config.getTryCount()
+        ArakoonClientConfig.getBackoffInterval()
+    assert_equals( [ w.category for w in caught ], [ DeprecationWarning ] * 2 )
+
+def _socketConnection():
+    # a connection reading from a local socket, and the peer writing to it
+    ours, theirs = socket.socketpair()
+    con = new.instance( ArakoonClientConnection )
+    con._socket = ours
+    con._socketInfo = "socketpair"
+    con._connected = True
+    con._resetBuffer()
+    return con, theirs
+
+def _stringResponse( value ):
+    return struct.pack( "II", ARA_ERR_SUCCESS, len(value) ) + value
+
+def test_buffered_reader():
+    con, peer = _socketConnection()
+    big = "".join( chr( i % 256 ) for i in range( 200 * 1024 ) )
+    def write():
+        # a few bytes at a time first, then more than the receive buffer holds
+        response = _stringResponse( big ) + _stringResponse( "small" )
+        for i in range( 6 ):
+            peer.sendall( response[i:i + 1] )
+            time.sleep( 0.01 )
+        peer.sendall( response[6:] )
+    writer = threading.Thread( target = write )
+    writer.start()
+    try:
+        assert_equals( ArakoonProtocol.decodeStringResult( con ), big )
+        assert_equals( ArakoonProtocol.decodeStringResult( con ), "small" )
+        assert_equals( len( con._rbuf ), ARA_RECV_BUFFER_SIZE )
+    finally:
+        writer.join()
+        peer.close()
+        con.close()
+
+def test_buffered_reader_truncated_response():
+    con, peer = _socketConnection()
+    peer.sendall( _stringResponse( "value" )[:-2] )
+    peer.close()
+    assert_raises( ArakoonSockReadNoBytes, ArakoonProtocol.decodeStringResult, con )
+    assert_false( con._connected )
+
+def test_iterators():
+    cluster = _cluster()
+    node = cluster.node(0)
+    keys = [ "k%02d" % i for i in range( 25 ) ]
+    for key in keys:
+        cluster.store[key] = key.upper()
+    cluster.store["other"] = "x"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    entries = list( client.iter_range_entries( "k00", True, "k20", False, batchSize = 10 ) )
+    assert_equals( entries, [ (key, key.upper()) for key in keys[:20] ] )
+    # a full last page can only be told apart from the end by asking again
+    assert_equals( node.count( ARA_CMD_RAN_E ), 3 )
+    assert_equals( list( client.iter_prefix( "k", batchSize = 10 ) ), keys )
+    assert_equals( node.count( ARA_CMD_RAN ), 3 )
+    assert_equals( list( client.iter_prefix( "z" ) ), [] )
+
+def test_iterator_errors():
+    cluster = _cluster()
+    node = cluster.node(0)
+    for i in range( 25 ):
+        cluster.store["k%02d" % i] = "v"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    # bad arguments are refused before the iterator is returned
+    assert_raises( ValueError, client.iter_prefix, "k", batchSize = 0 )
+    assert_raises( ArakoonInvalidArguments, client.iter_range_entries, 1, True, None, True )
+    # the first page is retried like other reads, later pages fail the iteration
+    node.failures.append( (ARA_CMD_RAN_E, ARA_ERR_GOING_DOWN) )
+    node.failures.append( (ARA_CMD_RAN_E, ARA_ERR_GOING_DOWN, 1) )
+    entries = client.iter_range_entries( None, True, None, True, batchSize = 10 )
+    assert_equals( len( [ entries.next() for i in range( 10 ) ] ), 10 )
+    assert_raises( ArakoonGoingDown, list, entries )
+    assert_equals( node.count( ARA_CMD_RAN_E ), 3 )
+
+def test_iterator_timeout():
+    cluster = _cluster()
+    node = cluster.node(0)
+    for i in range( 25 ):
+        cluster.store["k%02d" % i] = "v"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.whoMaster()
+    node.delay = 0.5
+    start = time.time()
+    assert_raises( ArakoonTimeout, client.iter_prefix, "k", batchSize = 10, timeout = 0.2 )
+    assert_true( time.time() - start < 0.45 )
+    node.delay = 0.0
+    keys = client.iter_prefix( "k", batchSize = 10, timeout = 5.0 )
+    assert_equals( keys.next(), "k00" )
+    # closing it early gives back the connection
+    accepted = node.accepted
+    keys.close()
+    assert_raises( StopIteration, keys.next )
+    assert_equals( list( client.iter_prefix( "k", batchSize = 10 ) ), sorted( cluster.store ) )
+    assert_equals( node.accepted, accepted + 1 )
+
+def test_connection_pool_shared_by_threads():
+    cluster = _cluster()
+    node = cluster.node(0)
+    node.delay = 0.005
+    for i in range( 16 ):
+        cluster.store["k%d" % i] = "v%d" % i
+    config = cluster.config()
+    client = Arakoon.ArakoonClient( config )
+    def reads( i ):
+        return [ client.get( "k%d" % i ) for j in range( 10 ) ]
+    results = _concurrently( [ lambda i = i: reads( i ) for i in range( 16 ) ] )
+    assert_equals( results, [ [ "v%d" % i ] * 10 for i in range( 16 ) ] )
+    # connections are reused, and no more are opened than the pool holds
+    assert_true( node.accepted <= config.getPoolSize(), node.accepted )
+
+def test_connection_pool():
+    cluster = _cluster()
+    node = cluster.node(0)
+    pool = ArakoonConnectionPool( ([ "127.0.0.1" ], node.port), cluster.clusterId, cluster.config() )
+    pool._maxSize = 1
+    conn = pool.get()
+    with callDeadline( time.time() + 0.1 ):
+        assert_raises( ArakoonPoolExhausted, pool.get )
+    conn.release()
+    assert_true( pool.get() is conn )
+    conn.release()
+    # a connection the node closed is not handed out again
+    node.dropConnections()
+    time.sleep( 0.05 )
+    fresh = pool.get()
+    assert_false( fresh is conn )
+    fresh.discard()
+    assert_equals( pool._size, 0 )
+
+def _whoCount( cluster ):
+    return sum( [ node.count( ARA_CMD_WHO ) for node in cluster.nodes.itervalues() ] )
+
+def test_master_cache_shared_by_clients():
+    cluster = _cluster( 3 )
+    first = Arakoon.ArakoonClient( cluster.config() )
+    first.set( "a", "1" )
+    asked = _whoCount( cluster )
+    assert_true( asked > 0 )
+    second = Arakoon.ArakoonClient( cluster.config() )
+    second.set( "b", "2" )
+    assert_equals( _whoCount( cluster ), asked )
+
+    # a client that finds out the master moved looks it up for all of them
+    cluster.master = cluster.node(2).name
+    first.set( "c", "3" )
+    asked = _whoCount( cluster )
+    second.set( "d", "4" )
+    assert_equals( _whoCount( cluster ), asked )
+    assert_equals( second.whoMaster(), cluster.node(2).name )
+
+def test_master_cache():
+    cache = ArakoonMasterCache()
+    found = []
+    def discover():
+        found.append( "n%d" % len(found) )
+        return found[-1]
+    assert_equals( cache.lookup( discover ), "n0" )
+    assert_equals( cache.lookup( discover ), "n0" )
+    # invalidating another node leaves the master alone
+    cache.invalidate( "n1" )
+    assert_equals( cache.lookup( discover ), "n0" )
+    cache.invalidate( "n0" )
+    assert_equals( cache.lookup( discover ), "n1" )
+    # the lease ran out
+    cache._expiry = 0
+    assert_equals( cache.lookup( discover ), "n2" )
+
+    def fail():
+        raise ArakoonNoMaster()
+    cache.invalidate( "n2" )
+    assert_raises( ArakoonNoMaster, cache.lookup, fail )
+    assert_equals( cache.lookup( discover ), "n3" )
+
+def test_forget_master():
+    cluster = _cluster( 2 )
+    first = Arakoon.ArakoonClient( cluster.config() )
+    second = Arakoon.ArakoonClient( cluster.config() )
+    assert_equals( first.whoMaster(), "fake_0" )
+    assert_equals( second.whoMaster(), "fake_0" )
+    cluster.master = "fake_1"
+    # clearing the client's own master leaves the shared one
+    first._masterId = None
+    assert_equals( first.whoMaster(), "fake_0" )
+    first._masterId = None
+    first.forgetMaster()
+    assert_equals( first.whoMaster(), "fake_1" )
+    second._masterId = None
+    assert_equals( second.whoMaster(), "fake_1" )
+
+def _parallelDiscovery( f ):
+    def withParallelDiscovery():
+        protocolModule = sys.modules[ ArakoonClientConfig.__module__ ]
+        protocolModule.ARA_CFG_PARALLEL_DISCOVERY = True
+        try:
+            f()
+        finally:
+            protocolModule.ARA_CFG_PARALLEL_DISCOVERY = False
+    withParallelDiscovery.__name__ = f.__name__
+    return withParallelDiscovery
+
+@_parallelDiscovery
+def test_parallel_master_discovery():
+    cluster = _cluster( 3 )
+    # a majority answers without waiting for the slow node
+    cluster.node(2).delay = 2.0
+    client = Arakoon.ArakoonClient( cluster.config() )
+    start = time.time()
+    assert_equals( client.whoMaster(), cluster.node(0).name )
+    assert_true( time.time() - start < 1.0 )
+
+    cluster.node(1).stop()
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.set( "a", "1" )
+    assert_equals( cluster.store, { "a" : "1" } )
+
+@_parallelDiscovery
+def test_parallel_master_discovery_no_master():
+    cluster = _cluster( 3 )
+    cluster.master = None
+    client = Arakoon.ArakoonClient( cluster.config() )
+    assert_raises( ArakoonNoMaster, client._discoverMaster )
+
+def test_read_cache():
+    cluster = _cluster()
+    node = cluster.node(0)
+    cluster.store.update( { "a" : "1", "b" : "2" } )
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.enableReadCache()
+    client.setConsistency( NoGuarantee() )
+    assert_equals( client.get( "a" ), "1" )
+    assert_equals( client.get( "a" ), "1" )
+    assert_equals( node.count( ARA_CMD_GET ), 1 )
+    assert_equals( client.multiGet( [ "a", "b" ] ), [ "1", "2" ] )
+    assert_equals( client.multiGet( [ "b", "a" ] ), [ "2", "1" ] )
+    assert_equals( node.count( ARA_CMD_MULTI_GET ), 1 )
+    # updates through the client drop what they touch
+    client.set( "a", "3" )
+    assert_equals( client.get( "a" ), "3" )
+    assert_equals( node.count( ARA_CMD_GET ), 2 )
+
+    # a consistent read is cached as recent as the last known transaction id
+    client.setConsistency( Consistent() )
+    txid = client.get_txid()._i
+    assert_equals( client.get( "b" ), "2" )
+    client.setConsistency( AtLeast( txid ) )
+    assert_equals( client.get( "b" ), "2" )
+    assert_equals( node.count( ARA_CMD_GET ), 3 )
+    cluster.store["b"] = "4"
+    client.setConsistency( AtLeast( txid + 1 ) )
+    assert_equals( client.get( "b" ), "4" )
+    assert_equals( node.count( ARA_CMD_GET ), 4 )
+
+def test_read_cache_misses():
+    cluster = _cluster()
+    node = cluster.node(0)
+    cluster.store.update( { "a" : "1", "b" : "2", "c" : "3" } )
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.enableReadCache( maxEntries = 2 )
+    client.setConsistency( NoGuarantee() )
+    # a missing key is asked for every time
+    assert_raises( ArakoonNotFound, client.get, "missing" )
+    assert_raises( ArakoonNotFound, client.get, "missing" )
+    assert_equals( node.count( ARA_CMD_GET ), 2 )
+    # the least recently used value makes room
+    for key in [ "a", "b", "c", "b", "a" ]:
+        client.get( key )
+    assert_equals( node.count( ARA_CMD_GET ), 6 )
+
+def test_read_balancing():
+    cluster = _cluster( 3 )
+    cluster.store["a"] = "1"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.setConsistency( NoGuarantee() )
+    client.setReadBalancing( ArakoonReadBalancer.ROUND_ROBIN )
+    for i in range( 6 ):
+        assert_equals( client.get( "a" ), "1" )
+    for i in range( 3 ):
+        assert_equals( cluster.node(i).count( ARA_CMD_GET ), 2 )
+    for strategy in [ ArakoonReadBalancer.LEAST_OUTSTANDING, ArakoonReadBalancer.EWMA ]:
+        for i in range( 3 ):
+            cluster.node(i).calls.clear()
+        client.setReadBalancing( strategy )
+        for i in range( 30 ):
+            assert_equals( client.get( "a" ), "1" )
+        for i in range( 3 ):
+            assert_true( cluster.node(i).count( ARA_CMD_GET ) > 0 )
+    assert_raises( ValueError, client.setReadBalancing, "fastest" )
+
+def test_read_balancing_failover():
+    cluster = _cluster( 3 )
+    cluster.store["a"] = "1"
+    client = Arakoon.ArakoonClient( cluster.config() )
+    client.setConsistency( NoGuarantee() )
+    client.setReadBalancing( ArakoonReadBalancer.ROUND_ROBIN )
+    # a node going down is left alone after its first failure
+    cluster.node(1).failures.append( (ARA_CMD_GET, ARA_ERR_GOING_DOWN) )
+    for i in range( 6 ):
+        assert_equals( client.get( "a" ), "1" )
+    assert_equals( cluster.node(1).count( ARA_CMD_GET ), 1 )
+    assert_equals( cluster.node(0).count( ARA_CMD_GET ) +
+                   cluster.node(2).count( ARA_CMD_GET ), 6 )
+    # without a node left to read from, the error comes through
+    cluster.stop()
+    assert_raises( ArakoonNotConnected, client.get, "a", timeout = 0.5 )
+
+def test_tls_context_shared():
+    config = ArakoonClientConfig( "fake", {}, tls = True )
+    created = []
+    create = config._createTLSContext
+    def counting():
+        created.append( None )
+        return create()
+    config._createTLSContext = counting
+    contexts = _concurrently( [ config.getTLSContext ] * 8 )
+    assert_true( isinstance( contexts[0], ssl.SSLContext ) )
+    for context in contexts:
+        assert_true( context is contexts[0] )
+    assert_equals( len( created ), 1 )
+
+def test_tls_context_bad_certificate():
+    (fd, path) = tempfile.mkstemp( suffix = ".pem" )
+    try:
+        os.write( fd, "not a certificate" )
+        os.close( fd )
+        config = ArakoonClientConfig( "fake", {}, tls = True, tls_ca_cert = path )
+        # a failure is not remembered, the next connection reads the file again
+        assert_raises( ssl.SSLError, config.getTLSContext )
+        assert_raises( ssl.SSLError, config.getTLSContext )
+    finally:
+        os.remove( path )
+    assert_raises( ValueError, ArakoonClientConfig, "fake", {}, tls = True, tls_ca_cert = path )
+
+class _Validated:
+    @SignatureValidator( 'string', 'int', 'bool' )
+    def call( self, key, count = 10, flag = False ):
+        return (key, count, flag)
+
+def test_signature_validator():
+    validated = _Validated()
+    assert_equals( validated.call( "a", 3, True ), ("a", 3, True) )
+    assert_equals( validated.call( key = "a", count = 3, flag = True ), ("a", 3, True) )
+    assert_equals( validated.call( "a" ), ("a", 10, False) )
+    # arguments left out in between take their default
+    assert_equals( validated.call( "a", flag = True ), ("a", 10, True) )
+    assert_equals( validated.call( key = "a", flag = True ), ("a", 10, True) )
+
+    cluster = _cluster()
+    cluster.store.update( { "a" : "1", "b" : "2" } )
+    client = Arakoon.ArakoonClient( cluster.config() )
+    assert_equals( client.get( key = "a" ), "1" )
+    assert_equals( client.range( "a", True, None, True ), [ "a", "b" ] )
+    assert_equals( client.range_entries( "a", True, None, True, compact = True ).keys(), [ "a", "b" ] )
+
+def test_signature_validator_errors():
+    validated = _Validated()
+    assert_raises( TypeError, validated.call, count = 3 )
+    assert_raises( TypeError, validated.call, flag = True )
+    assert_raises( ArakoonInvalidArguments, validated.call, "a", "3" )
+    assert_raises( ArakoonInvalidArguments, validated.call, key = 1 )
+    assert_raises( ArakoonInvalidArguments, validated.call, "a", other = 1 )
+
+    cluster = _cluster()
+    client = Arakoon.ArakoonClient( cluster.config() )
+    assert_raises( ArakoonInvalidArguments, client.get, 1 )
+    assert_raises( ArakoonInvalidArguments, client.range, "a", True, None, True, "10" )
+
+if __name__ == "__main__" :
+
+    try:
+        test_connect_deadline_does_not_outlive_call()
+        test_send_timeout_under_deadline()
+        test_async_large_requests_and_responses()
+        test_async_connection_lost()
+        test_async_retries_share_a_thread()
+        test_async_pending_retries_capped()
+        test_async_calls_do_not_wait_for_discovery()
+        test_async_discovery_failure()
+        test_pipeline_larger_than_socket_buffers()
+        test_pipeline_errors()
+        test_bulk_load_retries_in_order()
+        test_coalescing()
+        test_coalescing_follower_deadline()
+        test_hedging()
+        test_hedging_failover()
+        test_range_entries_compact()
+        test_retry_after_master_change()
+        test_retry_policies()
+        test_retry_budget()
+        test_deprecated_retry_settings()
+        test_buffered_reader()
+        test_buffered_reader_truncated_response()
+        test_iterators()
+        test_iterator_errors()
+        test_iterator_timeout()
+        test_connection_pool_shared_by_threads()
+        test_connection_pool()
+        test_master_cache_shared_by_clients()
+        test_master_cache()
+        test_forget_master()
+        test_parallel_master_discovery()
+        test_parallel_master_discovery_no_master()
+        test_read_cache()
+        test_read_cache_misses()
+        test_read_balancing()
+        test_read_balancing_failover()
+        test_tls_context_shared()
+        test_tls_context_bad_certificate()
+        test_signature_validator()
+        test_signature_validator_errors()
+    finally:
+        teardown()
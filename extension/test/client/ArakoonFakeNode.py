@@ -0,0 +1,399 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# In-process stand-in for the nodes of an Arakoon cluster, speaking enough of
+# the client protocol to test the client's network paths without servers.
+
+import socket
+import struct
+import threading
+import time
+
+from arakoon.ArakoonProtocol import *
+
+class _Disconnect(Exception):
+    pass
+
+def _packString( s ):
+    return struct.pack( "I", len(s) ) + s
+
+def _packStringOption( s ):
+    if s is None:
+        return "\x00"
+    return "\x01" + _packString( s )
+
+def _ok( payload = "" ):
+    return struct.pack( "I", ARA_ERR_SUCCESS ) + payload
+
+def _error( code, msg = "" ):
+    return struct.pack( "I", code ) + _packString( msg )
+
+def _inRange( key, beginKey, beginKeyIncluded, endKey, endKeyIncluded ):
+    if beginKey is not None and (key < beginKey or (key == beginKey and not beginKeyIncluded)):
+        return False
+    if endKey is not None and (key > endKey or (key == endKey and not endKeyIncluded)):
+        return False
+    return True
+
+class _Request:
+    def __init__( self, sock ):
+        self._sock = sock
+
+    def bytes( self, n ):
+        parts = []
+        while n > 0:
+            chunk = self._sock.recv( min(n, 1024 * 1024) )
+            if not chunk:
+                raise _Disconnect()
+            parts.append( chunk )
+            n -= len(chunk)
+        return "".join( parts )
+
+    def int( self ):
+        return struct.unpack( "I", self.bytes(4) )[0]
+
+    def signedInt( self ):
+        return struct.unpack( "i", self.bytes(4) )[0]
+
+    def bool( self ):
+        return self.bytes(1) != "\x00"
+
+    def string( self ):
+        return self.bytes( self.int() )
+
+    def stringOption( self ):
+        if self.bool():
+            return self.string()
+        return None
+
+    def consistency( self ):
+        kind = self.bytes(1)
+        if kind == "\x02":
+            self.bytes(8)
+        return kind
+
+class _AssertionFailed(Exception):
+    def __init__( self, code, key ):
+        Exception.__init__( self, key )
+        self.code = code
+
+def _parseUpdates( buf, offset, updates ):
+    kind, = struct.unpack_from( "I", buf, offset )
+    offset += 4
+    def string( offset ):
+        n, = struct.unpack_from( "I", buf, offset )
+        return buf[offset + 4:offset + 4 + n], offset + 4 + n
+    if kind == 1:
+        key, offset = string( offset )
+        value, offset = string( offset )
+        updates.append( ("set", key, value) )
+    elif kind == 2:
+        key, offset = string( offset )
+        updates.append( ("delete", key, None) )
+    elif kind == 5:
+        count, = struct.unpack_from( "I", buf, offset )
+        offset += 4
+        for i in xrange( count ):
+            offset = _parseUpdates( buf, offset, updates )
+    elif kind == 8:
+        key, offset = string( offset )
+        value = None
+        if buf[offset] != "\x00":
+            value, offset = string( offset + 1 )
+        else:
+            offset += 1
+        updates.append( ("assert", key, value) )
+    elif kind == 15:
+        key, offset = string( offset )
+        updates.append( ("assert_exists", key, None) )
+    else:
+        raise ValueError( "unsupported update %d" % kind )
+    return offset
+
+class FakeNode:
+    """
+    A node of a L{FakeCluster}
+
+    Requests are answered in order, after waiting delay seconds. Queue
+    (command, action) pairs in failures to make the next request with that
+    command (or any command, for None) fail: an integer action is returned as
+    error code, 'close' drops the connection and 'hang' stops answering. A
+    (command, action, skip) triple lets skip such requests through first.
+    """
+    def __init__( self, name, cluster ):
+        self.name = name
+        self.delay = 0.0
+        self.failures = []
+        self.calls = dict()
+        self.accepted = 0
+        self._cluster = cluster
+        self._listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        self._listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        self._listener.bind( ("127.0.0.1", 0) )
+        self._listener.listen( 16 )
+        self.port = self._listener.getsockname()[1]
+        self._connections = []
+        self._threads = []
+        self._stopped = threading.Event()
+        thread = threading.Thread( target = self._accept )
+        thread.daemon = True
+        thread.start()
+
+    def count( self, command ):
+        return self.calls.get( command, 0 )
+
+    def stop( self ):
+        self._stopped.set()
+        # closing alone leaves a pending accept running
+        try:
+            self._listener.shutdown( socket.SHUT_RDWR )
+        except socket.error:
+            pass
+        self._listener.close()
+        self.dropConnections()
+        for thread in self._threads:
+            thread.join( 1.0 )
+
+    def dropConnections( self ):
+        for sock in list( self._connections ):
+            try:
+                sock.shutdown( socket.SHUT_RDWR )
+                sock.close()
+            except socket.error:
+                pass
+
+    def _accept( self ):
+        while not self._stopped.isSet():
+            try:
+                sock, address = self._listener.accept()
+            except socket.error:
+                return
+            if self._stopped.isSet():
+                sock.close()
+                return
+            self._connections.append( sock )
+            self.accepted += 1
+            thread = threading.Thread( target = self._serve, args = (sock, ) )
+            thread.daemon = True
+            thread.start()
+            self._threads.append( thread )
+
+    def _serve( self, sock ):
+        request = _Request( sock )
+        try:
+            request.int()
+            request.int()
+            request.string()
+            while True:
+                command = request.int()
+                response = self._handle( command, request )
+                if response is None:
+                    break
+                if self.delay:
+                    time.sleep( self.delay )
+                sock.sendall( response )
+        except (_Disconnect, socket.error):
+            pass
+        finally:
+            try:
+                sock.close()
+            except socket.error:
+                pass
+            if sock in self._connections:
+                self._connections.remove( sock )
+
+    def _failure( self, command ):
+        for i, failure in enumerate( self.failures ):
+            failing, action = failure[:2]
+            if failing is None or failing == command:
+                if len(failure) > 2 and failure[2] > 0:
+                    self.failures[i] = (failing, action, failure[2] - 1)
+                    return None
+                del self.failures[i]
+                return action
+        return None
+
+    def _handle( self, command, request ):
+        cluster = self._cluster
+        self.calls[command] = self.calls.get( command, 0 ) + 1
+        # read the whole request before deciding how to answer it
+        args = self._readArguments( command, request )
+        action = self._failure( command )
+        if action == 'close':
+            return None
+        if action == 'hang':
+            self._stopped.wait()
+            return None
+        if action is not None:
+            return _error( action, "injected" )
+
+        isMaster = cluster.master == self.name
+        if command == ARA_CMD_WHO:
+            return _ok( _packStringOption( cluster.master ) )
+        if command == ARA_CMD_NOP:
+            return _ok() if isMaster else _error( ARA_ERR_NOT_MASTER, self.name )
+        if command == ARA_CMD_GET_TXID:
+            return _ok( "\x02" + struct.pack( "q", cluster.txid ) )
+
+        consistency = args[0]
+        if command in cluster.readCommands:
+            if consistency == "\x00" and not isMaster:
+                return _error( ARA_ERR_NOT_MASTER, self.name )
+        elif not isMaster:
+            return _error( ARA_ERR_NOT_MASTER, self.name )
+
+        with cluster.lock:
+            return self._execute( command, args[1:] )
+
+    def _readArguments( self, command, request ):
+        if command in (ARA_CMD_WHO, ARA_CMD_NOP, ARA_CMD_GET_TXID):
+            return (None, )
+        if command in (ARA_CMD_GET, ARA_CMD_EXISTS):
+            return (request.consistency(), request.string())
+        if command in (ARA_CMD_MULTI_GET, ARA_CMD_MULTI_GET_OPTION):
+            consistency = request.consistency()
+            return (consistency, [ request.string() for i in xrange( request.int() ) ])
+        if command in (ARA_CMD_RAN, ARA_CMD_RAN_E, ARA_CMD_REV_RAN_E):
+            return (request.consistency(), request.stringOption(), request.bool(),
+                    request.stringOption(), request.bool(), request.signedInt())
+        if command == ARA_CMD_PRE:
+            return (request.consistency(), request.string(), request.signedInt())
+        if command == ARA_CMD_SET:
+            return (None, request.string(), request.string())
+        if command == ARA_CMD_DEL:
+            return (None, request.string())
+        if command in (ARA_CMD_SEQ, ARA_CMD_SYNCED_SEQUENCE):
+            return (None, request.string())
+        raise ValueError( "unsupported command %x" % command )
+
+    def _execute( self, command, args ):
+        cluster = self._cluster
+        store = cluster.store
+        if command == ARA_CMD_GET:
+            key, = args
+            if key not in store:
+                return _error( ARA_ERR_NOT_FOUND, key )
+            return _ok( _packString( store[key] ) )
+        if command == ARA_CMD_EXISTS:
+            key, = args
+            return _ok( "\x01" if key in store else "\x00" )
+        if command == ARA_CMD_MULTI_GET:
+            keys, = args
+            for key in keys:
+                if key not in store:
+                    return _error( ARA_ERR_NOT_FOUND, key )
+            values = [ store[key] for key in reversed( keys ) ]
+            return _ok( struct.pack( "I", len(keys) ) + "".join( map( _packString, values ) ) )
+        if command == ARA_CMD_MULTI_GET_OPTION:
+            keys, = args
+            values = [ store.get( key ) for key in keys ]
+            return _ok( struct.pack( "I", len(keys) ) + "".join( map( _packStringOption, values ) ) )
+        if command in (ARA_CMD_RAN, ARA_CMD_RAN_E, ARA_CMD_REV_RAN_E):
+            beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = args
+            if command == ARA_CMD_REV_RAN_E:
+                keys = [ key for key in sorted( store, reverse = True )
+                         if _inRange( key, endKey, endKeyIncluded, beginKey, beginKeyIncluded ) ]
+            else:
+                keys = [ key for key in sorted( store )
+                         if _inRange( key, beginKey, beginKeyIncluded, endKey, endKeyIncluded ) ]
+            if maxElements >= 0:
+                keys = keys[:maxElements]
+            keys.reverse()
+            if command == ARA_CMD_RAN:
+                payload = "".join( map( _packString, keys ) )
+            else:
+                payload = "".join( [ _packString(key) + _packString(store[key]) for key in keys ] )
+            return _ok( struct.pack( "I", len(keys) ) + payload )
+        if command == ARA_CMD_PRE:
+            prefix, maxElements = args
+            keys = [ key for key in sorted( store ) if key.startswith( prefix ) ]
+            if maxElements >= 0:
+                keys = keys[:maxElements]
+            keys.reverse()
+            return _ok( struct.pack( "I", len(keys) ) + "".join( map( _packString, keys ) ) )
+        if command == ARA_CMD_SET:
+            key, value = args
+            store[key] = value
+            cluster.txid += 1
+            return _ok()
+        if command == ARA_CMD_DEL:
+            key, = args
+            if key not in store:
+                return _error( ARA_ERR_NOT_FOUND, key )
+            del store[key]
+            cluster.txid += 1
+            return _ok()
+        if command in (ARA_CMD_SEQ, ARA_CMD_SYNCED_SEQUENCE):
+            buf, = args
+            updates = []
+            _parseUpdates( buf, 0, updates )
+            return self._applySequence( updates )
+
+    def _applySequence( self, updates ):
+        cluster = self._cluster
+        store = dict( cluster.store )
+        for (kind, key, value) in updates:
+            if kind == "set":
+                store[key] = value
+            elif kind == "delete":
+                if key not in store:
+                    return _error( ARA_ERR_NOT_FOUND, key )
+                del store[key]
+            elif kind == "assert":
+                if store.get( key ) != value:
+                    return _error( ARA_ERR_ASSERTION_FAILED, key )
+            elif kind == "assert_exists":
+                if key not in store:
+                    return _error( ARA_ERR_ASSERTEXISTS_FAILED, key )
+        cluster.store.clear()
+        cluster.store.update( store )
+        cluster.sequences.append( updates )
+        cluster.txid += 1
+        return _ok()
+
+class FakeCluster:
+    """
+    Nodes sharing one store, of which master (a node name, or None) takes updates
+
+    Dirty reads are answered by every node, consistent reads only by the master.
+    """
+    readCommands = ( ARA_CMD_GET, ARA_CMD_EXISTS, ARA_CMD_MULTI_GET, ARA_CMD_MULTI_GET_OPTION,
+                     ARA_CMD_RAN, ARA_CMD_RAN_E, ARA_CMD_REV_RAN_E, ARA_CMD_PRE )
+
+    def __init__( self, nodeCount = 1, clusterId = "fake" ):
+        self.clusterId = clusterId
+        self.store = dict()
+        self.sequences = []
+        self.txid = 0
+        self.lock = threading.Lock()
+        self.nodes = dict()
+        for i in range( nodeCount ):
+            name = "%s_%d" % (clusterId, i)
+            self.nodes[name] = FakeNode( name, self )
+        self.master = sorted( self.nodes )[0]
+
+    def node( self, i ):
+        return self.nodes[ "%s_%d" % (self.clusterId, i) ]
+
+    def config( self, **kwargs ):
+        nodes = dict()
+        for (name, node) in self.nodes.iteritems():
+            nodes[name] = ( [ "127.0.0.1" ], node.port )
+        return ArakoonClientConfig( self.clusterId, nodes, **kwargs )
+
+    def stop( self ):
+        for node in self.nodes.itervalues():
+            node.stop()
@@ -0,0 +1,309 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Tests of the nursery client against in-memory stand-ins for its cluster clients
+
+from nose.tools import *
+
+from arakoon import Nursery
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import Sequence, Set, Delete
+from arakoon.NurseryRouting import RoutingInfo, LeafRoutingNode
+
+import new
+import threading
+import time
+
+class _Config:
+    def __init__( self, nodes ):
+        self._nodes = nodes
+
+    def getNodes( self ):
+        return self._nodes
+
+class _ClusterClient:
+    """
+    Serves the keys in [begin, end), refusing the others like a nursery cluster
+    """
+    def __init__( self, clusterId, begin, end ):
+        self._config = _Config( clusterId )
+        self.begin = begin
+        self.end = end
+        self.store = dict()
+        self.sequences = []
+        self.dropped = 0
+        self.intervalCalls = 0
+        self.down = False
+
+    def _check( self, key ):
+        if (self.begin is not None and key < self.begin) or \
+           (self.end is not None and key >= self.end):
+            raise NurseryRangeError( key )
+
+    def _getInterval( self ):
+        self.intervalCalls += 1
+        if self.down:
+            raise ArakoonNotConnected( self._config.getNodes() )
+        return (self.begin, self.end, self.begin, self.end)
+
+    def sequence( self, seq, sync ):
+        for update in seq._updates:
+            self._check( update._key )
+        store = dict( self.store )
+        for update in seq._updates:
+            if isinstance( update, Set ):
+                store[update._key] = update._value
+            elif update._key in store:
+                del store[update._key]
+            else:
+                raise ArakoonNotFound( update._key )
+        self.store = store
+        self.sequences.append( [ update._key for update in seq._updates ] )
+
+    def dropConnections( self ):
+        self.dropped += 1
+
+class _Keeper:
+    def __init__( self, routing, clients ):
+        self.routing = routing
+        self.configs = dict()
+        for clusterId, client in clients.iteritems():
+            self.configs[clusterId] = client._config
+        self.calls = 0
+        # set to have getNurseryConfig wait until it is set again
+        self.entered = None
+        self.release = None
+
+    def getNurseryConfig( self ):
+        self.calls += 1
+        if self.release is not None:
+            self.entered.set()
+            self.release.wait()
+        return (self.routing, dict( self.configs ))
+
+def _nursery( clients, routing ):
+    nursery = new.instance( Nursery.NurseryClient )
+    nursery._keeperClient = _Keeper( routing, clients )
+    nursery._clusterClients = dict( clients )
+    nursery._publishedRouting = None
+    nursery._routingLock = threading.Lock()
+    nursery._routingGeneration = 0
+    nursery._routingChanged = False
+    nursery._routingUpdate = None
+    nursery._fetchNurseryConfig()
+    return nursery
+
+def _twoClusters():
+    a = _ClusterClient( "A", None, "m" )
+    b = _ClusterClient( "B", "m", None )
+    routing = RoutingInfo( LeafRoutingNode( "A" ) )
+    routing.split( "m", "B" )
+    return a, b, _nursery( { "A" : a, "B" : b }, routing )
+
+def _fourClusters():
+    clients = dict()
+    bounds = [ None, "g", "m", "t", None ]
+    routing = RoutingInfo( LeafRoutingNode( "A" ) )
+    for (i, clusterId) in enumerate( "ABCD" ):
+        clients[clusterId] = _ClusterClient( clusterId, bounds[i], bounds[i + 1] )
+        if i > 0:
+            routing.split( bounds[i], clusterId )
+    return clients, _nursery( clients, routing )
+
+def test_sequence_during_migration():
+    a, b, nursery = _twoClusters()
+    # A hands [g, m) over to B before the keeper publishes it
+    a.end = "g"
+    b.begin = "g"
+    seq = Sequence()
+    seq.addSet( "a", "1" )
+    seq.addSet( "x", "2" )
+    seq.addSet( "h", "3" )
+    nursery.sequence( seq )
+    assert_equals( a.store, { "a" : "1" } )
+    assert_equals( b.store, { "x" : "2", "h" : "3" } )
+    # only the part A refused is sent again
+    assert_equals( a.sequences, [ [ "a" ] ] )
+    assert_equals( b.sequences, [ [ "x" ], [ "h" ] ] )
+
+def test_sequence_failure_is_not_retried():
+    a, b, nursery = _twoClusters()
+    seq = Sequence()
+    seq.addSet( "x", "1" )
+    seq.addDelete( "a" )
+    assert_raises( ArakoonNotFound, nursery.sequence, seq )
+    assert_equals( a.sequences, [] )
+    assert_equals( b.sequences, [ [ "x" ] ] )
+
+def test_refresh_keeps_unchanged_clients():
+    a, b, nursery = _twoClusters()
+    built = []
+    def build( cfg ):
+        client = _ClusterClient( None, None, None )
+        client._config = cfg
+        built.append( client )
+        return client
+    arakoonClient = Nursery.ArakoonClient
+    Nursery.ArakoonClient = build
+    try:
+        keeper = nursery._keeperClient
+        assert_false( nursery._fetchNurseryConfig() )
+        assert_equals( built, [] )
+
+        # B moved to other nodes and C joined
+        keeper.configs["B"] = _Config( "B2" )
+        keeper.configs["C"] = _Config( "C" )
+        assert_true( nursery._fetchNurseryConfig() )
+        assert_true( nursery._clusterClients["A"] is a )
+        assert_equals( nursery._clusterClients["B"]._config.getNodes(), "B2" )
+        assert_equals( nursery._clusterClients["C"]._config.getNodes(), "C" )
+        assert_equals( len( built ), 2 )
+        assert_equals( (a.dropped, b.dropped), (0, 1) )
+
+        # C left again
+        c = nursery._clusterClients["C"]
+        del keeper.configs["C"]
+        assert_true( nursery._fetchNurseryConfig() )
+        assert_equals( sorted( nursery._clusterClients.keys() ), [ "A", "B" ] )
+        assert_equals( c.dropped, 1 )
+        assert_equals( len( built ), 2 )
+    finally:
+        Nursery.ArakoonClient = arakoonClient
+
+def test_refresh_routing_change():
+    a, b, nursery = _twoClusters()
+    keeper = nursery._keeperClient
+    routing = RoutingInfo( LeafRoutingNode( "A" ) )
+    routing.split( "g", "B" )
+    keeper.routing = routing
+    assert_true( nursery._fetchNurseryConfig() )
+    assert_true( nursery._clusterClients["A"] is a )
+    assert_true( nursery._clusterClients["B"] is b )
+    assert_equals( nursery._routing.getClusterId( "h" ), "B" )
+    # a keeper that cannot be reached leaves the clients and routing as they were
+    def unreachable():
+        raise ArakoonNotConnected( "keeper" )
+    keeper.getNurseryConfig = unreachable
+    assert_raises( ArakoonNotConnected, nursery._fetchNurseryConfig )
+    assert_true( nursery._clusterClients["B"] is b )
+    assert_equals( nursery._routing.getClusterId( "h" ), "B" )
+
+def test_follow_migration_asks_neighbours():
+    clients, nursery = _fourClusters()
+    # B hands [k, m) over to C, while A can not be reached
+    clients["B"].end = "k"
+    clients["C"].begin = "k"
+    clients["A"].down = True
+    seq = Sequence()
+    seq.addSet( "l", "1" )
+    nursery.sequence( seq )
+    assert_equals( clients["C"].store, { "l" : "1" } )
+    assert_equals( nursery._routing.getClusterId( "k" ), "C" )
+    assert_equals( [ clients[c].intervalCalls for c in "ABCD" ], [ 1, 1, 1, 0 ] )
+
+def test_follow_migration_unreachable():
+    clients, nursery = _fourClusters()
+    clients["B"].end = "k"
+    clients["C"].begin = "k"
+    clients["B"].down = True
+    # only B can tell it stopped serving the keys
+    assert_false( nursery._followMigrations( "B" ) )
+    assert_equals( nursery._routing.getClusterId( "l" ), "B" )
+    assert_false( nursery._followMigrations( "E" ) )
+
+def _published( separator ):
+    routing = RoutingInfo( LeafRoutingNode( "A" ) )
+    routing.split( separator, "B" )
+    return routing
+
+def test_update_routing_once():
+    a, b, nursery = _twoClusters()
+    keeper = nursery._keeperClient
+    keeper.routing = _published( "g" )
+    keeper.entered = threading.Event()
+    keeper.release = threading.Event()
+    calls = keeper.calls
+    generation = nursery._routingGeneration
+    results = []
+    def update():
+        results.append( nursery._updateRouting( generation, None ) )
+    threads = [ threading.Thread( target = update ) for i in range( 5 ) ]
+    threads[0].start()
+    keeper.entered.wait( 10 )
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep( 0.1 )
+    keeper.release.set()
+    for thread in threads:
+        thread.join( 10 )
+    assert_equals( results, [ True ] * 5 )
+    assert_equals( keeper.calls, calls + 1 )
+    assert_equals( nursery._routingGeneration, generation + 1 )
+    assert_equals( nursery._routing.getClusterId( "h" ), "B" )
+
+def test_update_routing_stale_generation():
+    a, b, nursery = _twoClusters()
+    keeper = nursery._keeperClient
+    generation = nursery._routingGeneration
+    keeper.routing = _published( "g" )
+    assert_true( nursery._updateRouting( generation, None ) )
+    calls = keeper.calls
+    # refused with the routing the update replaced: retry with the new one
+    keeper.routing = _published( "p" )
+    assert_true( nursery._updateRouting( generation, None ) )
+    assert_equals( keeper.calls, calls )
+    assert_equals( nursery._routing.getClusterId( "h" ), "B" )
+    # a failed update leaves the routing as it was
+    def unreachable():
+        raise ArakoonNotConnected( "keeper" )
+    keeper.getNurseryConfig = unreachable
+    assert_raises( ArakoonNotConnected, nursery._updateRouting, generation + 1, "A" )
+    assert_false( nursery._updateRouting( generation + 1, "A" ) )
+    assert_equals( nursery._routing.getClusterId( "h" ), "B" )
+
+def test_update_routing_full_fetch():
+    a, b, nursery = _twoClusters()
+    keeper = nursery._keeperClient
+    a.end = "g"
+    b.begin = "g"
+    # what the keeper publishes goes first; the clusters are not asked
+    keeper.routing = _published( "g" )
+    assert_true( nursery._updateRouting( nursery._routingGeneration, "A" ) )
+    assert_equals( (a.intervalCalls, b.intervalCalls), (0, 0) )
+    # without knowing the cluster that refused, only the keeper is asked
+    a.end = "c"
+    b.begin = "c"
+    assert_false( nursery._updateRouting( nursery._routingGeneration, None ) )
+    assert_equals( (a.intervalCalls, b.intervalCalls), (0, 0) )
+    assert_true( nursery._updateRouting( nursery._routingGeneration, "A" ) )
+    assert_equals( (a.intervalCalls, b.intervalCalls), (1, 1) )
+    assert_equals( nursery._routing.getClusterId( "d" ), "B" )
+    # until the keeper publishes the next routing
+    keeper.routing = _published( "e" )
+    assert_true( nursery._updateRouting( nursery._routingGeneration, "A" ) )
+    assert_equals( nursery._routing.getClusterId( "d" ), "A" )
+
+if __name__ == "__main__" :
+
+    test_sequence_during_migration()
+    test_sequence_failure_is_not_retried()
+    test_refresh_keeps_unchanged_clients()
+    test_refresh_routing_change()
+    test_follow_migration_asks_neighbours()
+    test_follow_migration_unreachable()
+    test_update_routing_once()
+    test_update_routing_stale_generation()
+    test_update_routing_full_fetch()
@@ -0,0 +1,140 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Tests of the nursery rebalancer's planning against in-memory cluster clients
+
+from nose.tools import *
+
+import os
+import sys
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                                  "..", "..", "server" ) )
+from NurseryRebalancer import NurseryRebalancer
+
+class _ClusterClient:
+    """
+    Answers the range queries the rebalancer makes from a dict
+    """
+    def __init__( self, keys ):
+        self.store = dict( (key, key) for key in keys )
+        self.pages = 0
+
+    def getKeyCount( self ):
+        return len( self.store )
+
+    def _select( self, lower, lowerIncluded, upper, upperIncluded ):
+        return [ key for key in sorted( self.store )
+                 if (lower is None or key > lower or (lowerIncluded and key == lower)) and
+                    (upper is None or key < upper or (upperIncluded and key == upper)) ]
+
+    def range( self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements ):
+        self.pages += 1
+        return self._select( beginKey, beginKeyIncluded, endKey, endKeyIncluded )[:maxElements]
+
+    def range_entries( self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements ):
+        keys = self.range( beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements )
+        return [ (key, self.store[key]) for key in keys ]
+
+    def rev_range_entries( self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements ):
+        self.pages += 1
+        keys = self._select( endKey, endKeyIncluded, beginKey, beginKeyIncluded )
+        keys.reverse()
+        return [ (key, self.store[key]) for key in keys[:maxElements] ]
+
+_keys = [ "key_%04d" % i for i in range( 300 ) ]
+
+def _nursery( *bounds ):
+    # clusters c0, c1, ... holding _keys split at the given indices
+    bounds = [ 0 ] + list( bounds ) + [ len( _keys ) ]
+    intervals = []
+    clients = dict()
+    for i in range( len( bounds ) - 1 ):
+        clusterId = "c%d" % i
+        lower = i > 0 and _keys[bounds[i]] or None
+        upper = i + 2 < len( bounds ) and _keys[bounds[i + 1]] or None
+        intervals.append( (lower, upper, clusterId) )
+        clients[clusterId] = _ClusterClient( _keys[bounds[i]:bounds[i + 1]] )
+    return intervals, clients
+
+def _plan( intervals, clients, newClusterIds = None, tolerance = 0.1, maxStep = None, **kwargs ):
+    rebalancer = NurseryRebalancer( intervals, clients, **kwargs )
+    return [ (left, separator, right)
+             for (left, separator, right, moved) in rebalancer.plan( newClusterIds, tolerance, maxStep ) ]
+
+def test_balanced():
+    intervals, clients = _nursery( 100, 200 )
+    assert_equals( _plan( intervals, clients ), [] )
+    # off by less than the tolerance
+    intervals, clients = _nursery( 110, 200 )
+    assert_equals( _plan( intervals, clients ), [] )
+    assert_equals( _plan( intervals, clients, tolerance = 0.05 ), [ ("c0", _keys[100], "c1") ] )
+
+def test_new_clusters():
+    intervals, clients = _nursery()
+    assert_equals( _plan( intervals, clients, [ "c1", "c2" ] ),
+                   [ ("c0", _keys[100], "c1"), ("c1", _keys[200], "c2") ] )
+    # no step moves more than 150 keys
+    assert_equals( _plan( intervals, clients, [ "c1", "c2" ], maxStep = 150 ),
+                   [ ("c0", _keys[150], "c1"), ("c1", _keys[200], "c2"), ("c0", _keys[100], "c1") ] )
+    assert_equals( _plan( intervals, clients, [ "c1", "c2" ], metric = 'bytes' ),
+                   [ ("c0", _keys[100], "c1"), ("c1", _keys[200], "c2") ] )
+
+def test_first_and_last_boundaries():
+    # the first cluster holds too much, the last one too little
+    intervals, clients = _nursery( 200, 250 )
+    assert_equals( _plan( intervals, clients ),
+                   [ ("c0", _keys[100], "c1"), ("c1", _keys[200], "c2") ] )
+    # and the other way around
+    intervals, clients = _nursery( 50, 100 )
+    assert_equals( _plan( intervals, clients ),
+                   [ ("c1", _keys[200], "c2"), ("c0", _keys[100], "c1") ] )
+
+def test_empty_clusters():
+    intervals, clients = _nursery( 0 )
+    assert_equals( _plan( intervals, clients ), [ ("c0", _keys[150], "c1") ] )
+    intervals, clients = _nursery( 150, 150 )
+    assert_equals( _plan( intervals, clients ),
+                   [ ("c0", _keys[100], "c1"), ("c1", _keys[200], "c2") ] )
+    intervals = [ (None, "m", "c0"), ("m", None, "c1") ]
+    clients = { "c0" : _ClusterClient( [] ), "c1" : _ClusterClient( [] ) }
+    assert_equals( _plan( intervals, clients, [ "c2" ] ), [] )
+
+def test_bounded_scan():
+    intervals, clients = _nursery( 290 )
+    rebalancer = NurseryRebalancer( intervals, clients, samples = 300, pageSize = 10, maxPages = 3 )
+    # only the last 30 keys of c0 were seen, so the boundary moves that far
+    assert_equals( rebalancer.plan(), [ ("c0", _keys[260], "c1", 30) ] )
+    assert_equals( clients["c0"].pages, 3 )
+    # c1 holds no boundary to look for
+    assert_equals( clients["c1"].pages, 0 )
+
+def test_unusable_separators():
+    intervals = [ (None, None, "c0") ]
+    clients = { "c0" : _ClusterClient( _keys[:100] + [ _keys[100] + "\x00" ] + _keys[101:] ) }
+    assert_equals( _plan( intervals, clients, [ "c1" ] ), [ ("c0", _keys[150], "c1") ] )
+    clients = { "c0" : _ClusterClient( _keys[:150] + [ _keys[150] + "\x00" ] + _keys[151:] ) }
+    assert_equals( _plan( intervals, clients, [ "c1" ] ), [ ("c0", _keys[151], "c1") ] )
+    assert_raises( ValueError, NurseryRebalancer, intervals, clients, metric = 'values' )
+
+if __name__ == "__main__" :
+
+    test_balanced()
+    test_new_clusters()
+    test_first_and_last_boundaries()
+    test_empty_clusters()
+    test_bounded_scan()
+    test_unusable_separators()
@@ -242,8 +242,8 @@ def health_check() :
     # Do a ping to all nodes
     for node in C.node_names :
         try :
-            con = cli._sendMessage( node, encodedPing )
-            reply = con.decodeStringResult()
+            with cli._sendMessage( node, encodedPing ) as con:
+                reply = con.decodeStringResult()
             logging.info ( "Node %s is responsive: '%s'" , node, reply )
         except Exception, ex:
             monkey_dies = True
@@ -190,3 +190,72 @@ def test_routing_contains():
     assert_true(routing.contains(clus[0]), "Not even one is correct")
     routing.split("d", clus[1])
     routing.split("p", clus[2])
+
+def test_routing_intervals():
+    routing = RoutingInfo( LeafRoutingNode(clus[0]) )
+    routing.split("d", clus[1])
+    routing.split("p", clus[2])
+    assert_equals( routing.getIntervals(),
+                   [(None, "d", clus[0]), ("d", "p", clus[1]), ("p", None, clus[2])] )
+
+@C.with_custom_setup( C.setup_nursery_3, C.nursery_teardown )
+def test_nursery_multi_key_operations():
+    keys = ['a', 'b', 'l', 'm', 'y', 'z']
+    n = C.get_nursery()
+    n.migrate( clus[0], "d", clus[1] )
+    n.migrate( clus[1], "p", clus[2] )
+
+    cli = C.get_nursery_client()
+    seq = arakoon.ArakoonProtocol.Sequence()
+    for k in keys:
+        seq.addSet(k, k)
+    cli.sequence(seq)
+    check_migrated_keys( keys, cli._routing )
+
+    assert_equals( cli.multiGet(['z', 'a', 'm']), ['z', 'a', 'm'] )
+    assert_equals( cli.multiGetOption(['b', 'c', 'y']), ['b', None, 'y'] )
+    assert_raises( ArakoonNotFound, cli.multiGet, ['a', 'c'] )
+    assert_equals( cli.range_entries('b', True, 'y', False), [(k, k) for k in ['b', 'l', 'm']] )
+    assert_equals( cli.range_entries(None, True, None, True, 4), [(k, k) for k in keys[:4]] )
+    assert_equals( cli.prefix('m'), ['m'] )
+
+def test_routing_route_many():
+    routing = RoutingInfo( LeafRoutingNode(clus[0]) )
+    routing.split("d", clus[1])
+    routing.split("p", clus[2])
+    keys = ['z', 'a', 'd', 'c', 'p', 'o', '']
+    assert_equals( [routing.getClusterId(k) for k in keys],
+                   [clus[2], clus[0], clus[1], clus[0], clus[2], clus[1], clus[0]] )
+    assert_equals( routing.route_many(keys),
+                   { clus[0] : ['a', 'c', ''], clus[1] : ['d', 'o'], clus[2] : ['z', 'p'] } )
+
+def test_routing_narrowed():
+    routing = RoutingInfo( LeafRoutingNode(clus[0]) )
+    routing.split("d", clus[1])
+    routing.split("p", clus[2])
+    narrowed = routing.narrowed( clus[1], "f", "m" )
+    assert_equals( narrowed.getIntervals(),
+                   [(None, "f", clus[0]), ("f", "m", clus[1]), ("m", None, clus[2])] )
+    assert_equals( routing.getClusterId("e"), clus[1] )
+    assert_equals( narrowed.getClusterId("e"), clus[0] )
+    assert_equals( routing.narrowed( clus[1], "d", "p" ), None )
+    assert_equals( routing.narrowed( clus[1], "a", "z" ), None )
+    assert_equals( routing.narrowed( clus[1], "q", "z" ), None )
+
+@C.with_custom_setup( C.setup_nursery_3, C.nursery_teardown )
+def test_nursery_rebalance():
+    keys = ["key_%04d" % i for i in range(300)]
+    cli = C.get_nursery_client()
+    for k in keys:
+        cli.set(k, k)
+
+    n = C.get_nursery()
+    assert_equals( n.rebalance( newClusterIds = clus[1:], samples = 30 ),
+                   [(clus[0], keys[100], clus[1]), (clus[1], keys[200], clus[2])] )
+    n.rebalance( newClusterIds = clus[1:], execute = True, samples = 30, maxStep = 50 )
+    cli._fetchNurseryConfig()
+    assert_equals( cli._routing.getIntervals(),
+                   [(None, keys[100], clus[0]), (keys[100], keys[200], clus[1]), (keys[200], None, clus[2])] )
+    check_migrated_keys( keys, cli._routing )
+    validate_keys_in_nursery( cli, keys )
+    assert_equals( n.rebalance(), [] )
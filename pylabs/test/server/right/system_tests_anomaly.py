@@ -468,6 +468,6 @@ def test_block_master_ports () :
 
     flush_all_rules()
 
-    cli._masterId = None
+    cli.forgetMaster()
     Common.set_get_and_delete( cli, "k1", "v1")
     cli.dropConnections()
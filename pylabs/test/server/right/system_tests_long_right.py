@@ -143,7 +143,7 @@ def test_master_reelect():
     logging.info("waited %s, for reelection to happen" % delay)
     logging.info("config=%s" % (cli._config))
 
-    cli._masterId = None
+    cli.forgetMaster()
 
     new_master_id = cli.whoMaster()
     assert_not_equals ( new_master_id,
@@ -324,7 +324,7 @@ def drop_master(n):
     for i in range(n):
         logging.info("starting iteration %i", i)
         Common.dropMaster(previousMaster)
-        cli._masterId = None
+        cli.forgetMaster()
         master = cli.whoMaster()
         assert_not_equals(master, previousMaster, "Master did not change after drop master request.")
         previousMaster = master
@@ -1,4 +1,4 @@
-from setuptools import setup
+from setuptools import setup, Extension
 
 
 from subprocess import Popen, PIPE
@@ -28,7 +28,8 @@ def get_license():
 
 description =\
 """Arakoon is a simple distributed key value store.
-This package provides a pure python client for Arakoon.
+This package provides a pure python client for Arakoon, with an optional
+compiled codec that is used when it could be built.
 
 Mercurial version: %s
 """ % (get_version(),)
@@ -37,6 +38,9 @@ setup(name='arakoon',
       version=get_branch(),
       package_dir={'arakoon':'src/client/python'},
       packages=['arakoon'],
+      # falls back to the pure python codec if there is no compiler
+      ext_modules=[Extension('arakoon._codec', ['src/client/python/_codec.c'],
+                             optional=True)],
       data_files = [('license',['COPYING'])],
       url='http://www.arakoon.org',
       description=description,
@@ -46,7 +50,7 @@ setup(name='arakoon',
                    'Operating System :: OS Independent',
                    'Topic :: Database',
                    ],
-      zip_safe=True,
+      zip_safe=False,
       license= get_license()
       )
 
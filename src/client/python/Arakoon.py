@@ -24,20 +24,35 @@ Arakoon client module
 import sys
 import time
 import random
+import Queue
+import operator
 import threading
 
 from ArakoonProtocol import *
 from ArakoonProtocol import _packBool
 from ArakoonExceptions import *
 from ArakoonClientConnection import *
+from ArakoonMasterCache import ArakoonMasterCache
+from ArakoonCoalescer import ArakoonCoalescer
+from ArakoonReadCache import ArakoonReadCache
+from ArakoonReadBalancer import ArakoonReadBalancer
+from ArakoonHedging import ArakoonHedger
+from ArakoonEntries import ArakoonEntryList
+import ArakoonRetry
 from ArakoonValidators import SignatureValidator
 from ArakoonProtocol import ArakoonClientConfig
 
 from functools import wraps
+from contextlib import contextmanager
 
 #from arakoon import utils
 import utils
 
+# Bytes of requests a pipeline writes before reading their responses. While a
+# node writes a response the client does not read yet, it stops reading
+# requests, so the rest of the window must fit in the socket buffers.
+ARA_PIPELINE_WINDOW = 32 * 1024
+
 FILTER = ''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
 
 def dump(src, length=8):
@@ -51,39 +66,123 @@ def dump(src, length=8):
         N += length
     return result
 
+# Errors after which a dirty read can be tried on another node
+_NODE_READ_ERRORS = (ArakoonSocketException, ArakoonNotConnected, ArakoonPoolExhausted,
+                     ArakoonGoingDown, ArakoonInconsistentRead)
+
 # Seed the random generator
 random.seed ( time.time() )
 
+def _prefixEnd(prefix):
+    # smallest key that is larger than all keys starting with prefix
+    prefix = prefix.rstrip('\xff')
+    if prefix == '':
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _setBatches(entries, batchBytes, sync):
+    # encoded sequences of sets of about batchBytes bytes of keys and values,
+    # with the number of keys and bytes in each
+    seq = Sequence()
+    size = 0
+    for key, value in entries:
+        if not isinstance(key, str) or not isinstance(value, str):
+            raise ArakoonInvalidArguments('bulk_load', [('entry', (key, value))])
+        seq.addUpdate(Set(key, value))
+        size += len(key) + len(value)
+        if size >= batchBytes:
+            yield ArakoonProtocol.encodeSequence(seq, sync), len(seq._updates), size
+            seq = Sequence()
+            size = 0
+    if len(seq._updates) > 0:
+        yield ArakoonProtocol.encodeSequence(seq, sync), len(seq._updates), size
+
+def _entriesDecoder(compact):
+    if compact:
+        return ArakoonProtocol.decodeEntryListResult
+    return ArakoonProtocol.decodeStringPairListResult
+
+class _PageIterator :
+    """
+    The items of a paged query, asking for the next page before handing out the current one
+    """
+
+    def __init__(self, conn, page, nextRequest, decode, batchSize, done):
+        self._conn = conn
+        self._nextRequest = nextRequest
+        self._decode = decode
+        self._batchSize = batchSize
+        self._done = done
+        self._items = iter(())
+        self._advance(page)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            try:
+                return self._items.next()
+            except StopIteration:
+                pass
+            if not self._more:
+                self.close()
+                raise StopIteration
+            try:
+                page = self._decode(self._conn)
+            except:
+                self.close()
+                raise
+            self._advance(page)
+
+    def close(self):
+        """
+        Stop the iteration and close its connection
+        """
+        self._more = False
+        self._items = iter(())
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+            self._done()
+
+    def __del__(self):
+        self.close()
+
+    def _advance(self, page):
+        # a full page can only be told apart from the end by asking again
+        self._more = len(page) == self._batchSize
+        if self._more:
+            try:
+                self._conn.send(self._nextRequest(page))
+            except:
+                self.close()
+                raise
+        self._items = iter(page)
 
 def retryDuringMasterReelection (is_read_only = False):
     def wrap(f):
         @wraps(f)
         def retrying_f (self,*args,**kwargs):
-            start = time.time()
-            tryCount = 0.0
-            backoffPeriod = 0.2
-            callSucceeded = False
-            retryPeriod = ArakoonClientConfig.getNoMasterRetryPeriod ()
-            deadline = start + retryPeriod
-            while( not callSucceeded and time.time() < deadline ):
-                try :
-                    retVal = f(self,*args,**kwargs)
-                    callSucceeded = True
-                except (ArakoonNoMaster, ArakoonNodeNotMaster, ArakoonSocketException, ArakoonNotConnected, ArakoonGoingDown) as ex:
-                    if not is_read_only and \
-                       isinstance(ex, (ArakoonSocketException, ArakoonGoingDown)):
-                        raise
-                    if len( self._config.getNodes().keys()) == 0 :
-                        raise ArakoonInvalidConfig( "Empty client configuration" )
-                    self._masterId = None
-                    self.dropConnections()
-                    sleepPeriod = backoffPeriod * tryCount
-                    if time.time() + sleepPeriod > deadline :
-                        raise
-                    tryCount += 1.0
-                    ArakoonClientLogger.logWarning( "Master not found (%s). Retrying in %0.2f sec." % (ex, sleepPeriod) )
-                    time.sleep( sleepPeriod )
-            return retVal
+            timeout = kwargs.pop('timeout', None)
+            if timeout is None:
+                # Most calls succeed at once: only set up retrying once one failed
+                start = time.time()
+                try:
+                    result = f(self, *args, **kwargs)
+                except ArakoonException:
+                    failure = sys.exc_info()
+                else:
+                    ArakoonRetry.ARA_RETRY_BUDGET.deposit()
+                    return result
+                deadline = start + ArakoonClientConfig.getNoMasterRetryPeriod()
+                return ArakoonRetry.retry(lambda: f(self, *args, **kwargs), is_read_only,
+                                          deadline, self._beforeRetry, failure)
+            call = lambda: f(self, *args, **kwargs)
+            # An explicit timeout bounds the socket operations as well
+            deadline = time.time() + timeout
+            with callDeadline(deadline):
+                return ArakoonRetry.retry(call, is_read_only, deadline, self._beforeRetry)
 
         return retrying_f
     return wrap
@@ -108,8 +207,14 @@ class ArakoonClient :
         self._initialize( config )
         self.__lock = threading.RLock()
         self._masterId = None
-        self._connections = dict()
+        self._masterCache = ArakoonMasterCache.forConfig( self._config )
+        self._pools = dict()
         self._consistency = Consistent()
+        self._coalescer = None
+        self._readCache = None
+        self._readBalancer = None
+        self._hedger = None
+        self._lastTxid = None
         nodeList = self._config.getNodes().keys()
         if len(nodeList) == 0:
             raise ArakoonInvalidConfig("Node list empty.")
@@ -138,15 +243,169 @@ class ArakoonClient :
         """
         self._consistency = c
 
+    def enableCoalescing(self, window = 0.002, maxKeys = 100):
+        """
+        Send concurrent L{get} and L{exists} calls as a single multiGetOption request.
+
+        A call waits up to window seconds for calls from other threads to join it,
+        so this only pays off when many threads read single keys at the same time.
+
+        @type window: float
+        @param window: maximum time in seconds a call waits for others
+        @type maxKeys: integer
+        @param maxKeys: maximum number of keys fetched in one request
+        """
+        self._coalescer = ArakoonCoalescer( self._fetchCoalesced, window, maxKeys )
+
+    def disableCoalescing(self):
+        """
+        Send every L{get} and L{exists} call as a request of its own (the default).
+        """
+        self._coalescer = None
+
+    def enableReadCache(self, maxEntries = 10000, maxBytes = 16 * 1024 * 1024):
+        """
+        Keep the values read by L{get} and L{multiGet} in a client side cache.
+
+        Reads with consistency L{NoGuarantee}, or L{AtLeast} a transaction id the
+        cached value is known to include, are then answered from the cache.
+        Updates made through this client remove the keys they touch from the cache;
+        updates made by other clients are only seen once a value is evicted or
+        a more recent transaction id is asked for.
+
+        @type maxEntries: integer
+        @param maxEntries: maximum number of cached values
+        @type maxBytes: integer
+        @param maxBytes: maximum total size of the cached keys and values
+        """
+        self._readCache = ArakoonReadCache( maxEntries, maxBytes )
+
+    def disableReadCache(self):
+        """
+        Drop the client side cache; all reads go to the cluster again (the default).
+        """
+        self._readCache = None
+
+    @contextmanager
+    def _updating(self, keys = None):
+        # Drop the keys from the read cache before and after the update, so
+        # values read while it is in progress are not kept either.
+        cache = self._readCache
+        if cache is None or keys == []:
+            yield
+            return
+        cache.invalidate(keys)
+        try:
+            yield
+        finally:
+            cache.invalidate(keys)
+
+    def _fetchCoalesced(self, keys, consistency):
+        msg = ArakoonProtocol.encodeMultiGetOption(keys, consistency)
+        return self._read(msg, ArakoonProtocol.decodeStringOptionArrayResult, consistency, hedge = True)
+
+    def setReadBalancing(self, strategy = None):
+        """
+        Spread dirty reads over all nodes instead of sending them to the dirty read node.
+
+        Reads that fail on a node, or that a node is too far behind to serve,
+        are tried on the other nodes. See L{ArakoonReadBalancer} for the strategies.
+
+        @type strategy: string
+        @param strategy: L{ArakoonReadBalancer.ROUND_ROBIN}, L{ArakoonReadBalancer.LEAST_OUTSTANDING},
+            L{ArakoonReadBalancer.EWMA}, or None to use the dirty read node again (the default)
+        """
+        if strategy is None:
+            self._readBalancer = None
+        else:
+            self._readBalancer = ArakoonReadBalancer( self._config.getNodes().keys(), strategy )
+
+    def enableHedging(self, percentile = 95, initialDelay = 0.05):
+        """
+        Send slow dirty reads to a second node as well, and use the first answer.
+
+        Applies to L{get}, L{exists}, L{multiGetOption} and L{range_entries} with
+        consistency L{NoGuarantee} or L{AtLeast}. See L{ArakoonHedger}.
+
+        @type percentile: float
+        @param percentile: a read is hedged when it takes longer than this percentile of recent reads
+        @type initialDelay: float
+        @param initialDelay: seconds before a read is hedged, until enough reads were seen
+        """
+        self._hedger = ArakoonHedger( percentile, initialDelay )
+
+    def disableHedging(self):
+        """
+        Send every read to a single node (the default).
+        """
+        self._hedger = None
+
     def _initialize(self, config ):
         self._config = config
 
-    def __send__(self,msg):
-        if self._consistency.isDirty():
-            conn = self._sendMessage(self._dirtyReadNode, msg)
+    def _read(self, msg, decode, consistency = None, hedge = False):
+        if consistency is None:
+            consistency = self._consistency
+        if not consistency.isDirty():
+            with self._sendToMaster(msg) as conn:
+                return decode(conn)
+        balancer = self._readBalancer
+        hedger = self._hedger
+        if hedge and hedger is not None and len(self._config.getNodes()) > 1:
+            return self._hedgedRead(hedger, balancer, msg, decode)
+        if balancer is None:
+            with self._sendMessage(self._dirtyReadNode, msg) as conn:
+                return decode(conn)
+
+        tried = []
+        while True:
+            nodeId = balancer.choose(tried)
+            try:
+                return self._readFromNode(nodeId, msg, decode, balancer)
+            except _NODE_READ_ERRORS, ex:
+                tried.append(nodeId)
+                if len(tried) == len(self._config.getNodes()):
+                    raise
+                ArakoonClientLogger.logWarning( "Read from node '%s' failed (%s), trying another node",
+                                                nodeId, ex )
+
+    def _readFromNode(self, nodeId, msg, decode, balancer, sent = None):
+        # sent, if given, is called with the connection once msg is written
+        if balancer is None:
+            with self._sendMessage(nodeId, msg) as conn:
+                if sent is not None:
+                    sent(conn)
+                return decode(conn)
+        start = time.time()
+        try:
+            with self._sendMessage(nodeId, msg) as conn:
+                if sent is not None:
+                    sent(conn)
+                result = decode(conn)
+        except _NODE_READ_ERRORS:
+            balancer.finished(nodeId, None, False)
+            raise
+        except:
+            balancer.finished(nodeId, time.time() - start, True)
+            raise
+        balancer.finished(nodeId, time.time() - start, True)
+        return result
+
+    def _hedgedRead(self, hedger, balancer, msg, decode):
+        if balancer is None:
+            first = self._dirtyReadNode
+            def chooseSecond(first):
+                return random.choice([ nodeId for nodeId in self._config.getNodes().keys()
+                                       if nodeId != first ])
         else:
-            conn = self._sendToMaster (msg)
-        return conn
+            first = balancer.choose()
+            def chooseSecond(first):
+                return balancer.choose([first])
+        deadline = currentDeadline()
+        def attempt(nodeId, sent):
+            with callDeadline(deadline):
+                return self._readFromNode(nodeId, msg, decode, balancer, sent)
+        return hedger.call(attempt, first, chooseSecond, _NODE_READ_ERRORS)
 
     @utils.update_argspec('self', 'node')
     def setDirtyReadNode(self, node):
@@ -161,7 +420,7 @@ class ArakoonClient :
             raise ArakoonUnknownNode( node )
         self._dirtyReadNode = node
 
-    @utils.update_argspec('self')
+    @utils.update_argspec('self', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def getKeyCount (self) :
         """
@@ -170,8 +429,8 @@ class ArakoonClient :
         @rtype: int
         """
         encoded = ArakoonProtocol.encodeGetKeyCount()
-        conn = self._sendToMaster(encoded)
-        return conn.decodeInt64Result()
+        with self._sendToMaster(encoded) as conn:
+            return conn.decodeInt64Result()
 
     def getDirtyReadNode(self):
         """
@@ -182,7 +441,7 @@ class ArakoonClient :
         """
         return self._dirtyReadNode
 
-    @utils.update_argspec('self', 'clientId', ('clusterId', 'arakoon'))
+    @utils.update_argspec('self', 'clientId', ('clusterId', 'arakoon'), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string', 'string' )
     def hello (self, clientId, clusterId = 'arakoon'):
@@ -199,8 +458,8 @@ class ArakoonClient :
         @return: The master identifier and its version in a single string
         """
         encoded = ArakoonProtocol.encodePing(clientId,clusterId)
-        conn = self._sendToMaster(encoded)
-        return conn.decodeStringResult()
+        with self._sendToMaster(encoded) as conn:
+            return conn.decodeStringResult()
 
 
     def getVersion(self, nodeId = None):
@@ -218,7 +477,8 @@ class ArakoonClient :
         else:
             conn = self._sendMessage(nodeId, msg )
 
-        result = conn.decodeVersionResult()
+        with conn:
+            result = conn.decodeVersionResult()
 
         return result
 
@@ -235,11 +495,12 @@ class ArakoonClient :
         else:
             conn = self._sendMessage(nodeId,msg)
 
-        result = conn.decodeStringResult()
+        with conn:
+            result = conn.decodeStringResult()
         return result
 
 
-    @utils.update_argspec('self', 'key')
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string' )
     def exists(self, key):
@@ -248,11 +509,13 @@ class ArakoonClient :
         @param key : key
         @return : True if there is a value for that key, False otherwise
         """
+        coalescer = self._coalescer
+        if coalescer is not None:
+            return coalescer.lookup(key, self._consistency) is not None
         msg = ArakoonProtocol.encodeExists(key, self._consistency)
-        conn = self.__send__(msg)
-        return conn.decodeBoolResult()
+        return self._read(msg, ArakoonProtocol.decodeBoolResult, hedge = True)
 
-    @utils.update_argspec('self', 'key')
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string' )
     def get(self, key):
@@ -266,12 +529,23 @@ class ArakoonClient :
         @rtype: string
         @return: The value associated with the given key
         """
+        cache = self._readCache
+        if cache is not None:
+            return cache.read([key], self._consistency, self._lastTxid,
+                              lambda keys: [self._get(keys[0])])[0]
+        return self._get(key)
+
+    def _get(self, key):
+        coalescer = self._coalescer
+        if coalescer is not None:
+            value = coalescer.lookup(key, self._consistency)
+            if value is None:
+                raise ArakoonNotFound(key)
+            return value
         msg = ArakoonProtocol.encodeGet(key, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringResult()
-        return result
+        return self._read(msg, ArakoonProtocol.decodeStringResult, hedge = True)
 
-    @utils.update_argspec('self', 'keys')
+    @utils.update_argspec('self', 'keys', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def multiGet(self,keys):
         """
@@ -281,12 +555,16 @@ class ArakoonClient :
         @rtype: string list
         @return: the values associated with the respective keys
         """
+        cache = self._readCache
+        if cache is not None:
+            return cache.read(keys, self._consistency, self._lastTxid, self._multiGet)
+        return self._multiGet(keys)
+
+    def _multiGet(self, keys):
         msg = ArakoonProtocol.encodeMultiGet(keys, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringListResult()
-        return result
+        return self._read(msg, ArakoonProtocol.decodeStringListResult)
 
-    @utils.update_argspec('self','keys')
+    @utils.update_argspec('self','keys', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def multiGetOption(self,keys):
         """
@@ -299,11 +577,9 @@ class ArakoonClient :
         """
 
         msg = ArakoonProtocol.encodeMultiGetOption(keys, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringOptionArrayResult()
-        return result
+        return self._read(msg, ArakoonProtocol.decodeStringOptionArrayResult, hedge = True)
 
-    @utils.update_argspec('self', 'key', 'value')
+    @utils.update_argspec('self', 'key', 'value', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator( 'string', 'string' )
     def set(self, key, value):
@@ -321,27 +597,31 @@ class ArakoonClient :
 
         @rtype: void
         """
-        conn = self._sendToMaster ( ArakoonProtocol.encodeSet( key, value ) )
-        conn.decodeVoidResult()
+        with self._updating([key]):
+            with self._sendToMaster ( ArakoonProtocol.encodeSet( key, value ) ) as conn:
+                conn.decodeVoidResult()
 
     @retryDuringMasterReelection()
     def nop(self):
         """
         does a paxos nop (reaches consensus)
         """
-        conn = self._sendToMaster(ArakoonProtocol.encodeNOP())
-        conn.decodeVoidResult()
+        with self._sendToMaster(ArakoonProtocol.encodeNOP()) as conn:
+            conn.decodeVoidResult()
 
     @retryDuringMasterReelection()
     def get_txid(self):
         """
         returns the current transaction id for later usage
         """
-        conn = self._sendToMaster(ArakoonProtocol.encodeGetTxid())
-        result = conn.decodeGetTxidResult()
+        with self._sendToMaster(ArakoonProtocol.encodeGetTxid()) as conn:
+            result = conn.decodeGetTxidResult()
+        if isinstance(result, AtLeast) and \
+           (self._lastTxid is None or result._i > self._lastTxid):
+            self._lastTxid = result._i
         return result
 
-    @utils.update_argspec('self', 'key', 'value')
+    @utils.update_argspec('self', 'key', 'value', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string','string')
     def confirm(self, key,value):
@@ -351,10 +631,11 @@ class ArakoonClient :
         @rtype: void
         """
         msg = ArakoonProtocol.encodeConfirm(key,value)
-        conn = self._sendToMaster(msg)
-        conn.decodeVoidResult()
+        with self._updating([key]):
+            with self._sendToMaster(msg) as conn:
+                conn.decodeVoidResult()
 
-    @utils.update_argspec('self', 'key', 'vo')
+    @utils.update_argspec('self', 'key', 'vo', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator('string','string_option')
     def aSSert(self, key, vo):
@@ -367,11 +648,9 @@ class ArakoonClient :
         @rtype: void
         """
         msg = ArakoonProtocol.encodeAssert(key, vo, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeVoidResult()
-        return result
+        return self._read(msg, ArakoonProtocol.decodeVoidResult)
 
-    @utils.update_argspec('self', 'key')
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator('string')
     def aSSert_exists(self, key):
@@ -382,11 +661,9 @@ class ArakoonClient :
         @rtype: void
         """
         msg = ArakoonProtocol.encodeAssertExists(key, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeVoidResult()
-        return result
+        return self._read(msg, ArakoonProtocol.decodeVoidResult)
 
-    @utils.update_argspec('self', 'seq', ('sync', False))
+    @utils.update_argspec('self', 'seq', ('sync', False), ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator( 'sequence', 'bool' )
     def sequence(self, seq, sync = False):
@@ -399,8 +676,9 @@ class ArakoonClient :
         @type seq: Sequence
         """
         encoded = ArakoonProtocol.encodeSequence(seq, sync)
-        conn = self._sendToMaster(encoded)
-        conn.decodeVoidResult()
+        with self._updating():
+            with self._sendToMaster(encoded) as conn:
+                conn.decodeVoidResult()
 
     def makeSequence(self):
         """
@@ -408,7 +686,101 @@ class ArakoonClient :
         """
         return Sequence()
 
-    @utils.update_argspec('self', 'key')
+    def pipeline(self, batchSize = 1000):
+        """
+        Factory method for pipelines
+
+        A pipeline queues requests and sends them over a single connection
+        without waiting for the individual responses, which are decoded
+        afterwards in order. See L{ArakoonPipeline}.
+
+        @type batchSize: integer
+        @param batchSize: maximum number of requests sent over a connection at once. Of
+            those, at most L{ARA_PIPELINE_WINDOW} bytes of requests are written before
+            their responses are read back.
+        @rtype: L{ArakoonPipeline}
+        """
+        return ArakoonPipeline(self, batchSize)
+
+    def bulk_load(self, entries, batch_bytes = 1024 * 1024, inflight = 4, sync = False):
+        """
+        Set a large number of key-value pairs, in batches.
+
+        The pairs are grouped into sequences of about batch_bytes bytes of keys
+        and values each. Up to inflight sequences are written to the master at
+        once, before their responses are read back. When a sequence fails, it
+        and the ones written after it are sent again, one at a time and in
+        order, like calls to L{sequence}: a key set more than once ends up with
+        its last value. They only set keys, so applying them twice is harmless.
+
+        Each sequence is all-or-nothing, but the load as a whole is not: if it
+        fails, some of the sequences before the failing one have been applied.
+
+        @type entries: iterable of (string, string)
+        @type batch_bytes: integer
+        @param batch_bytes: size of the keys and values in one sequence. Defaults to 1MB.
+        @type inflight: integer
+        @param inflight: number of sequences written before their responses are read. Defaults to 4.
+        @type sync: boolean
+        @param sync: synchronise the filesystem on the server after every sequence
+        @rtype: dict
+        @return: the number of 'keys', 'bytes' and 'batches' loaded, how many batches were
+            'retried', the 'seconds' it took, and 'keys_per_second' and 'bytes_per_second'
+        """
+        if batch_bytes <= 0 or inflight <= 0:
+            raise ValueError("batch_bytes and inflight must be positive")
+        report = { 'keys' : 0, 'bytes' : 0, 'batches' : 0, 'retried' : 0 }
+        start = time.time()
+        with self._updating():
+            window = []
+            for batch in _setBatches(entries, batch_bytes, sync):
+                window.append(batch)
+                if len(window) == inflight:
+                    self._loadBatches(window, report)
+                    window = []
+            if len(window) > 0:
+                self._loadBatches(window, report)
+
+        seconds = time.time() - start
+        report['seconds'] = seconds
+        if seconds > 0:
+            report['keys_per_second'] = report['keys'] / seconds
+            report['bytes_per_second'] = report['bytes'] / seconds
+        else:
+            report['keys_per_second'] = report['bytes_per_second'] = 0.0
+        ArakoonClientLogger.logInfo( "Loaded %d keys (%d bytes) in %.3fs: %.0f keys/s, %.0f bytes/s",
+                                     report['keys'], report['bytes'], seconds,
+                                     report['keys_per_second'], report['bytes_per_second'] )
+        return report
+
+    def _loadBatches(self, batches, report):
+        msgs = [msg for msg, keys, size in batches]
+        try:
+            self._determineMaster()
+            # the responses are a few bytes each, so all of the window can be written at once
+            results = self._sendPipelined(self._masterId, msgs, ['decodeVoidResult'] * len(msgs),
+                                          maxBytes = None)
+        except ArakoonException, ex:
+            # which of them were applied is unknown, so retry them all
+            results = [ex] * len(msgs)
+
+        failed = False
+        for (msg, keys, size), result in zip(batches, results):
+            # later batches were applied before this one, redo them after it
+            failed = failed or isinstance(result, ArakoonException)
+            if failed:
+                report['retried'] += 1
+                self._sendEncodedUpdate(msg)
+            report['keys'] += keys
+            report['bytes'] += size
+            report['batches'] += 1
+
+    @retryDuringMasterReelection()
+    def _sendEncodedUpdate(self, msg):
+        with self._sendToMaster(msg) as conn:
+            conn.decodeVoidResult()
+
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator( 'string' )
     def delete(self, key):
@@ -420,10 +792,11 @@ class ArakoonClient :
 
         @rtype: void
         """
-        conn = self._sendToMaster ( ArakoonProtocol.encodeDelete( key ) )
-        conn.decodeVoidResult()
+        with self._updating([key]):
+            with self._sendToMaster ( ArakoonProtocol.encodeDelete( key ) ) as conn:
+                conn.decodeVoidResult()
 
-    @utils.update_argspec('self','prefix')
+    @utils.update_argspec('self','prefix', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string')
     def deletePrefix(self, prefix):
@@ -435,8 +808,9 @@ class ArakoonClient :
         @rtype: integer
         """
         msg = ArakoonProtocol.encodeDeletePrefix(prefix)
-        conn = self._sendToMaster(msg)
-        result = conn.decodeIntResult()
+        with self._updating():
+            with self._sendToMaster(msg) as conn:
+                result = conn.decodeIntResult()
         return result
 
     __setitem__= set
@@ -445,7 +819,7 @@ class ArakoonClient :
     __contains__ = exists
 
     @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
-                          'endKeyIncluded', ('maxElements', 1000))
+                          'endKeyIncluded', ('maxElements', 1000), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
     def range(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000 ):
@@ -472,19 +846,20 @@ class ArakoonClient :
         """
         msg = ArakoonProtocol.encodeRange( beginKey, beginKeyIncluded, endKey,
                                            endKeyIncluded, maxElements, self._consistency)
-        conn = self.__send__(msg)
-        return conn.decodeStringListResult()
+        return self._read(msg, ArakoonProtocol.decodeStringListResult)
 
     @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
-                          'endKeyIncluded', ('maxElements', 1000))
+                          'endKeyIncluded', ('maxElements', 1000), ('compact', False),
+                          ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
-    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int', 'bool' )
     def range_entries(self,
                       beginKey,
                       beginKeyIncluded,
                       endKey,
                       endKeyIncluded,
-                      maxElements= 1000):
+                      maxElements= 1000,
+                      compact = False):
         """
         Perform a range query on the store, retrieving the set of matching key-value pairs
 
@@ -502,6 +877,8 @@ class ArakoonClient :
         @param endKey: Upper boundary of the requested range
         @param endKeyIncluded: Indicates if the upper boundary should be part of the result set
         @param maxElements: The maximum number of key-value pairs to return. Negative means no maximum, all matches will be returned. Defaults to 1000.
+        @type compact: boolean
+        @param compact: Return an L{ArakoonEntryList}, which keeps all pairs in a single buffer and takes a lot less memory for large results. Defaults to False.
 
         @rtype: list of (string,string)
         @return: Returns a list containing all matching key-value pairs
@@ -512,18 +889,18 @@ class ArakoonClient :
                                                  endKeyIncluded,
                                                  maxElements,
                                                  self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringPairListResult()
-        return result
+        return self._read(msg, _entriesDecoder(compact), hedge = True)
 
     @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
-                          'endKeyIncluded', ('maxElements', 1000))
+                          'endKeyIncluded', ('maxElements', 1000), ('compact', False),
+                          ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
-    @SignatureValidator('string_option', 'bool', 'string_option', 'bool','int')
+    @SignatureValidator('string_option', 'bool', 'string_option', 'bool','int', 'bool')
     def rev_range_entries(self,
                           beginKey, beginKeyIncluded,
                           endKey,  endKeyIncluded,
-                          maxElements= 1000):
+                          maxElements= 1000,
+                          compact = False):
         """
         Performs a reverse range query on the store, returning a sorted (in reverse order) list of key value pairs.
         @type beginKey: string option
@@ -534,6 +911,8 @@ class ArakoonClient :
         @param beginKey: higher boundary of the requested range
         @param endKey: lower boundary of the requested range
         @param maxElements: maximum number of key-value pairs to return. Negative means 'all'. Defaults to 1000.
+        @type compact: boolean
+        @param compact: Return an L{ArakoonEntryList} instead of a list, see L{range_entries}. Defaults to False.
         @rtype : list of (string,string)
         """
         msg = ArakoonProtocol.encodeReverseRangeEntries(beginKey,
@@ -542,12 +921,10 @@ class ArakoonClient :
                                                         endKeyIncluded,
                                                         maxElements,
                                                         self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringPairListResult()
-        return result
+        return self._read(msg, _entriesDecoder(compact))
 
 
-    @utils.update_argspec('self', 'keyPrefix', ('maxElements', 1000))
+    @utils.update_argspec('self', 'keyPrefix', ('maxElements', 1000), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string', 'int' )
     def prefix(self, keyPrefix , maxElements = 1000 ):
@@ -566,21 +943,128 @@ class ArakoonClient :
         @return: Returns a list of keys matching the provided prefix
         """
         msg = ArakoonProtocol.encodePrefixKeys( keyPrefix, maxElements, self._consistency)
-        conn = self.__send__(msg)
-        return conn.decodeStringListResult( )
+        return self._read(msg, ArakoonProtocol.decodeStringListResult)
+
+    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
+                          'endKeyIncluded', ('batchSize', 1000), ('timeout', None))
+    @retryDuringMasterReelection(is_read_only=True)
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
+    def iter_range_entries(self,
+                           beginKey,
+                           beginKeyIncluded,
+                           endKey,
+                           endKeyIncluded,
+                           batchSize = 1000):
+        """
+        Iterate over the key-value pairs in a range, fetching them in pages.
+
+        Unlike L{range_entries}, there is no limit on the number of pairs: the range
+        is read in pages of batchSize pairs over a dedicated connection, and the next
+        page is requested before the current one is handed out.
+        Only two pages are held in memory at any time.
+
+        The first page is fetched before the iterator is returned, and retried
+        like the other reads; a timeout applies to it. The other pages are fetched
+        while iterating, within the connection timeout and the deadline of the
+        thread iterating, if any.
+
+        @type beginKey: string option
+        @type beginKeyIncluded: boolean
+        @type endKey :string option
+        @type endKeyIncluded: boolean
+        @type batchSize: integer
+        @param batchSize: The number of key-value pairs fetched per round trip. Defaults to 1000.
+        @rtype: iterator of (string,string)
+        """
+        return self._iterPages(ArakoonProtocol.encodeRangeEntries,
+                               ArakoonProtocol.decodeStringPairListResult,
+                               operator.itemgetter(0),
+                               beginKey, beginKeyIncluded,
+                               endKey, endKeyIncluded, batchSize)
+
+    @utils.update_argspec('self', 'keyPrefix', ('batchSize', 1000), ('timeout', None))
+    @retryDuringMasterReelection(is_read_only=True)
+    @SignatureValidator( 'string', 'int' )
+    def iter_prefix(self, keyPrefix, batchSize = 1000):
+        """
+        Iterate over the keys that match the provided prefix, fetching them in pages.
+
+        See L{iter_range_entries} for how the pages are fetched.
+
+        @type keyPrefix: string
+        @type batchSize: integer
+        @param batchSize: The number of keys fetched per round trip. Defaults to 1000.
+        @rtype: iterator of strings
+        """
+        return self._iterPages(ArakoonProtocol.encodeRange,
+                               ArakoonProtocol.decodeStringListResult,
+                               lambda key: key,
+                               keyPrefix, True,
+                               _prefixEnd(keyPrefix), False, batchSize)
+
+    def _iterPages(self, encode, decode, keyOf,
+                   beginKey, beginKeyIncluded, endKey, endKeyIncluded, batchSize):
+        if batchSize <= 0:
+            raise ValueError("batchSize must be positive")
+
+        consistency = self._consistency
+        balancer = None
+        if consistency.isDirty():
+            balancer = self._readBalancer
+            if balancer is None:
+                nodeId = self._dirtyReadNode
+            else:
+                nodeId = balancer.choose()
+        else:
+            self._determineMaster()
+            nodeId = self._masterId
+
+        # A pending page request must not get mixed up with the responses
+        # of other calls, so the iterator gets a connection of its own.
+        conn = None
+        try:
+            conn = ArakoonClientConnection(self._config.getNodeLocations(nodeId),
+                                           self._config.getClusterId(),
+                                           self._config)
+            conn.send(encode(beginKey, beginKeyIncluded, endKey, endKeyIncluded,
+                             batchSize, consistency))
+            page = decode(conn)
+        except:
+            if conn is not None:
+                conn.close()
+            if balancer is not None:
+                balancer.finished(nodeId, None, False)
+            raise
+
+        def nextRequest(page):
+            return encode(keyOf(page[-1]), False, endKey, endKeyIncluded, batchSize, consistency)
+        def done():
+            if balancer is not None:
+                balancer.finished(nodeId, None, True)
+        return _PageIterator(conn, page, nextRequest, decode, batchSize, done)
 
     def whoMaster(self):
         self._determineMaster()
         return self._masterId
 
+    def forgetMaster(self):
+        """
+        Forget the master, so the next call looks it up again.
+
+        The master is also forgotten by the other clients of the cluster in this
+        process, which share it for L{ArakoonClientConfig.getMasterLeasePeriod} seconds.
+        """
+        self._masterId = None
+        self._masterCache.invalidate()
+
     def expectProgressPossible(self):
         """
         @return: true if the master thinks progress is possible, false otherwise
         """
         msg = ArakoonProtocol.encodeExpectProgressPossible()
         try:
-            conn = self._sendToMaster(msg)
-            return conn.decodeBoolResult()
+            with self._sendToMaster(msg) as conn:
+                return conn.decodeBoolResult()
         except ArakoonNoMaster:
             return False
 
@@ -590,10 +1074,10 @@ class ArakoonClient :
         @return a dictionary with some statistics about the master
         """
         msg = ArakoonProtocol.encodeStatistics()
-        conn = self._sendToMaster(msg)
-        return conn.decodeStatistics()
+        with self._sendToMaster(msg) as conn:
+            return conn.decodeStatistics()
 
-    @utils.update_argspec('self', 'key', 'oldValue', 'newValue')
+    @utils.update_argspec('self', 'key', 'oldValue', 'newValue', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator( 'string', 'string_option', 'string_option' )
     def testAndSet(self, key, oldValue, newValue):
@@ -615,10 +1099,11 @@ class ArakoonClient :
         @return: The value that was associated with the key prior to this operation
         """
         msg = ArakoonProtocol.encodeTestAndSet( key, oldValue, newValue )
-        conn = self._sendToMaster( msg )
-        return conn.decodeStringOptionResult()
+        with self._updating([key]):
+            with self._sendToMaster( msg ) as conn:
+                return conn.decodeStringOptionResult()
 
-    @utils.update_argspec('self','key','wanted')
+    @utils.update_argspec('self','key','wanted', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string','string_option')
     def replace(self,key,wanted):
@@ -632,10 +1117,11 @@ class ArakoonClient :
         @return: the previous binding (if any)
         """
         msg = ArakoonProtocol.encodeReplace(key,wanted)
-        conn = self._sendToMaster( msg )
-        return conn.decodeStringOptionResult()
+        with self._updating([key]):
+            with self._sendToMaster( msg ) as conn:
+                return conn.decodeStringOptionResult()
 
-    @utils.update_argspec('self', 'name', 'argument')
+    @utils.update_argspec('self', 'name', 'argument', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string', 'string_option')
     def userFunction(self, name, argument): #pylint: disable-msg=C0103
@@ -650,61 +1136,146 @@ class ArakoonClient :
         '''
 
         msg = ArakoonProtocol.encodeUserFunction(name, argument)
-        conn = self._sendToMaster(msg)
-        return conn.decodeStringOptionResult()
+        with self._updating():
+            with self._sendToMaster(msg) as conn:
+                return conn.decodeStringOptionResult()
 
-    @utils.update_argspec('self')
+    @utils.update_argspec('self', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def getNurseryConfig(self):
         msg = ArakoonProtocol.encodeGetNurseryCfg()
-        con = self._sendToMaster(msg)
-        return con.decodeNurseryCfgResult()
+        with self._sendToMaster(msg) as con:
+            return con.decodeNurseryCfgResult()
+
+    @utils.update_argspec('self', ('timeout', None))
+    @retryDuringMasterReelection(is_read_only=True)
+    def getInterval(self):
+        """
+        Retrieve the key range this cluster is responsible for, as a member of a nursery
+
+        Keys are only served from the public range. During a migration, the
+        private range also covers the keys that are being moved in or out.
+
+        @rtype: tuple of 4 string options
+        @return: (publicBegin, publicEnd, privateBegin, privateEnd); begins are
+            included, ends are excluded and None means unbounded
+        """
+        return self._getInterval()
+
+    def _getInterval(self):
+        msg = ArakoonProtocol.encodeGetInterval()
+        with self._sendToMaster(msg) as con:
+            return con.decodeIntervalResult()
 
     def dropConnections(self):
         '''Drop all connections to the Arakoon servers'''
-        keysToRemove = self._connections.keys()
+        with self.__lock :
+            for pool in self._pools.itervalues():
+                pool.clear()
 
-        for key in keysToRemove:
-            self._connections[key].close()
-            del self._connections[ key ]
+    def _beforeRetry(self, ex):
+        if len( self._config.getNodes().keys()) == 0 :
+            raise ArakoonInvalidConfig( "Empty client configuration" )
+        self._forgetMaster()
+        self.dropConnections()
 
     def _determineMaster(self):
-        nodeIds = []
+        self._masterId = self._masterCache.lookup( self._discoverMaster )
 
-        if self._masterId is None:
-            # Prepare to ask random nodes who is master
-            nodeIds = self._config.getNodes().keys()
-            random.shuffle( nodeIds )
+    def _forgetMaster(self):
+        masterId = self._masterId
+        self._masterId = None
+        if masterId is not None:
+            self._masterCache.invalidate( masterId )
 
-            while self._masterId is None and len(nodeIds) > 0 :
-                node = nodeIds.pop()
-                try :
-                    self._masterId = self._getMasterIdFromNode( node )
-                    tmpMaster = self._masterId
+    def _discoverMaster(self):
+        masterId = None
 
-                    try :
-                        if self._masterId is not None :
-                            if self._masterId != node and not self._validateMasterId ( self._masterId ) :
-                                self._masterId = None
-                        else :
-                            ArakoonClientLogger.logWarning( "Node '%s' does not know who the master is", node )
+        if ArakoonClientConfig.getParallelMasterDiscovery() and \
+           len(self._config.getNodes()) > 1:
+            return self._discoverMasterInParallel()
 
-                    except Exception, ex :
+        # Prepare to ask random nodes who is master
+        nodeIds = self._config.getNodes().keys()
+        random.shuffle( nodeIds )
 
-                        ArakoonClientLogger.logWarning( "Could not validate master on node '%s'", tmpMaster )
-                        ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
-                        self._masterId = None
+        while masterId is None and len(nodeIds) > 0 :
+            node = nodeIds.pop()
+            try :
+                masterId = self._getMasterIdFromNode( node )
+                tmpMaster = masterId
 
+                try :
+                    if masterId is not None :
+                        if masterId != node and not self._validateMasterId ( masterId ) :
+                            masterId = None
+                    else :
+                        ArakoonClientLogger.logWarning( "Node '%s' does not know who the master is", node )
 
                 except Exception, ex :
-                    # Exceptions will occur when nodes are down, simply ignore and try the next node
-                    ArakoonClientLogger.logWarning( "Could not query node '%s' to see who is master", node )
+
+                    ArakoonClientLogger.logWarning( "Could not validate master on node '%s'", tmpMaster )
                     ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
+                    masterId = None
 
 
-        if self._masterId is None:
+            except Exception, ex :
+                # Exceptions will occur when nodes are down, simply ignore and try the next node
+                ArakoonClientLogger.logWarning( "Could not query node '%s' to see who is master", node )
+                ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
+
+
+        if masterId is None:
             ArakoonClientLogger.logError( "Could not determine master."  )
             raise ArakoonNoMaster()
+        return masterId
+
+    def _discoverMasterInParallel(self):
+        nodeIds = self._config.getNodes().keys()
+        answers = Queue.Queue()
+
+        callerDeadline = currentDeadline()
+        def ask(nodeId):
+            try :
+                with callDeadline( callerDeadline ):
+                    answers.put( (nodeId, self._getMasterIdFromNode( nodeId ), None) )
+            except Exception, ex :
+                answers.put( (nodeId, None, ex) )
+
+        for nodeId in nodeIds:
+            asker = threading.Thread( target = ask, args = (nodeId,) )
+            asker.setDaemon( True )
+            asker.start()
+
+        quorum = len(nodeIds) / 2 + 1
+        votes = dict()
+        confirmed = set()
+        deadline = time.time() + remainingTime()
+        for i in range(len(nodeIds)):
+            try :
+                node, masterId, ex = answers.get( True, max(0, deadline - time.time()) )
+            except Queue.Empty :
+                break
+            if ex is not None:
+                ArakoonClientLogger.logWarning( "Could not query node '%s' to see who is master", node )
+                ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
+                continue
+            if masterId is None:
+                ArakoonClientLogger.logWarning( "Node '%s' does not know who the master is", node )
+                continue
+            votes[masterId] = votes.get( masterId, 0 ) + 1
+            if masterId == node:
+                confirmed.add( masterId )
+            if votes[masterId] >= quorum:
+                return masterId
+
+        # Without a majority, fall back to what the sequential discovery
+        # accepts: a master that confirms it is the master.
+        if len(confirmed) == 1:
+            return confirmed.pop()
+
+        ArakoonClientLogger.logError( "Could not determine master."  )
+        raise ArakoonNoMaster()
 
     def _sendToMaster(self, msg):
 
@@ -724,64 +1295,270 @@ class ArakoonClient :
         return masterId == otherMasterId
 
     def _getMasterIdFromNode(self, nodeId):
-        conn = self._sendMessage( nodeId , ArakoonProtocol.encodeWhoMaster() )
-        masterId = conn.decodeStringOptionResult( )
+        with self._sendMessage( nodeId , ArakoonProtocol.encodeWhoMaster() ) as conn:
+            masterId = conn.decodeStringOptionResult( )
         return masterId
 
-    def _sleep(self, timeout):
-        time.sleep( timeout )
+    def _sendMessage(self, nodeId, msgBuffer):
+        # Failures are not retried here, but by the caller's retry policy
+        # (see L{ArakoonRetry}).
+        connection = None
+        try :
+            connection = self._getConnection( nodeId )
+            connection.send( msgBuffer )
+        except Exception, ex:
+            fmt = "Attempt to exchange message with node %s failed with error (%s: '%s')."
+            ArakoonClientLogger.logWarning( fmt , nodeId, ex.__class__.__name__, ex )
+
+            # Get rid of the connection in case of an exception
+            if connection is not None:
+                connection.discard()
+            if nodeId == self._masterId:
+                self._forgetMaster()
+            raise
 
-    def _sendMessage(self, nodeId, msgBuffer, tryCount = -1):
+        # Message sent correctly, return client connection so result
+        # can be read. It goes back to the pool when the caller's
+        # with-block around the decoding ends.
+        return connection
 
-        result = None
+    def _sendPipelined(self, nodeId, msgs, decoders, maxBytes = ARA_PIPELINE_WINDOW):
+        """
+        Write msgs to nodeId and decode the responses in order.
+
+        Requests are written up to maxBytes at a time (at least one), and the
+        responses to those are read before writing more. A maxBytes of None
+        writes them all at once, which is only safe if the responses are small.
+
+        Errors reported by the server for a single request leave the stream
+        intact, so they are returned in place of the result. Socket errors
+        and timeouts abort the whole exchange.
+        """
+        results = []
+        connection = self._getConnection( nodeId )
+        try :
+            with connection:
+                i = 0
+                while i < len(msgs):
+                    j = i + 1
+                    if maxBytes is None:
+                        j = len(msgs)
+                    else:
+                        size = len(msgs[i])
+                        while j < len(msgs) and size + len(msgs[j]) <= maxBytes:
+                            size += len(msgs[j])
+                            j += 1
+                    connection.send( ''.join(msgs[i:j]) )
+                    for decoder in decoders[i:j]:
+                        try :
+                            results.append( getattr(connection, decoder)() )
+                        except (ArakoonSocketException, ArakoonTimeout) :
+                            raise
+                        except ArakoonException, ex:
+                            results.append( ex )
+                    i = j
+        except Exception, ex:
+            fmt = "Pipelined exchange with node %s failed with error (%s: '%s')."
+            ArakoonClientLogger.logWarning( fmt, nodeId,
+                                            ex.__class__.__name__, ex )
+            if nodeId == self._masterId:
+                self._forgetMaster()
+            raise
+        return results
+
+    def _getPool(self, nodeId):
+        with self.__lock :
+            pool = self._pools.get( nodeId )
+            if pool is None:
+                nodeLocations = self._config.getNodeLocations( nodeId )
+                clusterId = self._config.getClusterId()
+                pool = ArakoonConnectionPool( nodeLocations, clusterId, self._config )
+                self._pools[ nodeId ] = pool
+        return pool
 
-        if tryCount == -1 :
-            tryCount = self._config.getTryCount()
+    def _getConnection(self, nodeId):
+        '''Check out a connection to nodeId; use it in a with-block to return it'''
+        return self._getPool( nodeId ).get()
+
+
+class ArakoonPipeline :
+    """
+    Queues requests for an L{ArakoonClient} and sends them without waiting
+    for the individual round trips.
+
+    Requests are written to a single connection a window of
+    L{ARA_PIPELINE_WINDOW} bytes at a time, and the responses to a window are
+    decoded, in the order the requests were queued, before the next window
+    is written. Use it as
+    a context manager, in which case the queued requests are executed when
+    the block exits::
+
+        with client.pipeline() as p:
+            for key in keys:
+                p.get(key)
+        values = p.results
+
+    When all queued requests are reads and the client allows dirty reads,
+    the pipeline goes to the dirty read node, otherwise to the master.
+    Pipelined requests are not retried during master re-election.
+    """
+
+    def __init__(self, client, batchSize = 1000):
+        if batchSize <= 0:
+            raise ValueError("batchSize must be positive")
+        self._client = client
+        self._batchSize = batchSize
+        self._msgs = []
+        self._decoders = []
+        self._readOnly = True
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None and len(self._msgs) > 0:
+            self.execute()
+
+    def __len__(self):
+        return len(self._msgs)
+
+    def _queue(self, msg, decoder, isReadOnly):
+        self._msgs.append(msg)
+        self._decoders.append(decoder)
+        self._readOnly = self._readOnly and isReadOnly
+
+    def _read(self, msg, decoder):
+        self._queue(msg, decoder, True)
+
+    def _update(self, msg, decoder):
+        self._queue(msg, decoder, False)
+
+    def reset(self):
+        """
+        Discard all queued requests
+        """
+        self._msgs = []
+        self._decoders = []
+        self._readOnly = True
+
+    def execute(self, raiseOnError = True, timeout = None):
+        """
+        Send all queued requests and decode their responses.
+
+        @type raiseOnError: boolean
+        @param raiseOnError: if True, the first error reported by the server is raised
+            after all responses have been read. Otherwise the exception objects are
+            returned in place of the results.
+        @type timeout: float
+        @param timeout: seconds all requests together may take, or None
+        @rtype: list
+        @return: the results of the queued requests, in order
+        """
+        client = self._client
+        msgs, decoders, readOnly = self._msgs, self._decoders, self._readOnly
+        self.reset()
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        balancer = None
+        if readOnly and client._consistency.isDirty():
+            balancer = client._readBalancer
+            if balancer is None:
+                nodeId = client._dirtyReadNode
+            else:
+                nodeId = balancer.choose()
+        else:
+            with callDeadline(deadline):
+                client._determineMaster()
+            nodeId = client._masterId
 
-        for i in range(tryCount) :
+        results = []
+        succeeded = False
+        try:
+            with callDeadline(deadline), client._updating([] if readOnly else None):
+                for i in xrange(0, len(msgs), self._batchSize):
+                    j = i + self._batchSize
+                    results.extend( client._sendPipelined(nodeId, msgs[i:j], decoders[i:j]) )
+            succeeded = True
+        finally:
+            if balancer is not None:
+                balancer.finished(nodeId, None, succeeded)
+        self.results = results
+
+        if raiseOnError:
+            for r in results:
+                if isinstance(r, ArakoonException):
+                    raise r
+        return results
 
-            if i > 0:
-                maxSleep = i * ArakoonClientConfig.getBackoffInterval()
-                self._sleep( random.randint(0, maxSleep) )
+    @SignatureValidator( 'string' )
+    def exists(self, key):
+        self._read(ArakoonProtocol.encodeExists(key, self._client._consistency),
+                   'decodeBoolResult')
 
-            with self.__lock :
+    @SignatureValidator( 'string' )
+    def get(self, key):
+        self._read(ArakoonProtocol.encodeGet(key, self._client._consistency),
+                   'decodeStringResult')
 
-                try :
-                    connection = self._getConnection( nodeId )
-                    connection.send( msgBuffer )
-
-                    # Message sent correctly, return client connection so result
-                    # can be read
-                    result = connection
-                    break
-
-                except Exception, ex:
-                    fmt = "Attempt %d to exchange message with node %s failed with error (%s: '%s')."
-                    ArakoonClientLogger.logWarning( fmt , i, nodeId,
-                                                    ex.__class__.__name__, ex )
-
-                    # Get rid of the connection in case of an exception
-                    self._connections[nodeId].close()
-                    del self._connections[ nodeId ]
-                    self._masterId = None
-
-        if result is None:
-            # If result is None, this means that all retries failed.
-            # Re-raise the last exception to escalate the problem
-            raise
+    def multiGet(self, keys):
+        self._read(ArakoonProtocol.encodeMultiGet(keys, self._client._consistency),
+                   'decodeStringListResult')
 
-        return result
+    def multiGetOption(self, keys):
+        self._read(ArakoonProtocol.encodeMultiGetOption(keys, self._client._consistency),
+                   'decodeStringOptionArrayResult')
 
-    def _getConnection(self, nodeId):
-        connection = None
-        if self._connections.has_key( nodeId ) :
-            connection = self._connections [ nodeId ]
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
+    def range(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000):
+        msg = ArakoonProtocol.encodeRange(beginKey, beginKeyIncluded, endKey,
+                                          endKeyIncluded, maxElements,
+                                          self._client._consistency)
+        self._read(msg, 'decodeStringListResult')
+
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int', 'bool' )
+    def range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000,
+                      compact = False):
+        msg = ArakoonProtocol.encodeRangeEntries(beginKey, beginKeyIncluded, endKey,
+                                                 endKeyIncluded, maxElements,
+                                                 self._client._consistency)
+        self._read(msg, compact and 'decodeEntryListResult' or 'decodeStringPairListResult')
+
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int', 'bool' )
+    def rev_range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000,
+                          compact = False):
+        msg = ArakoonProtocol.encodeReverseRangeEntries(beginKey, beginKeyIncluded, endKey,
+                                                        endKeyIncluded, maxElements,
+                                                        self._client._consistency)
+        self._read(msg, compact and 'decodeEntryListResult' or 'decodeStringPairListResult')
 
-        if connection is None:
-            nodeLocations = self._config.getNodeLocations( nodeId )
-            clusterId = self._config.getClusterId()
-            connection = ArakoonClientConnection ( nodeLocations , clusterId,
-                self._config)
-            self._connections[ nodeId ] = connection
+    @SignatureValidator( 'string', 'int' )
+    def prefix(self, keyPrefix, maxElements = 1000):
+        msg = ArakoonProtocol.encodePrefixKeys(keyPrefix, maxElements, self._client._consistency)
+        self._read(msg, 'decodeStringListResult')
 
-        return connection
+    @SignatureValidator( 'string', 'string' )
+    def set(self, key, value):
+        self._update(ArakoonProtocol.encodeSet(key, value), 'decodeVoidResult')
+
+    @SignatureValidator( 'string', 'string' )
+    def confirm(self, key, value):
+        self._update(ArakoonProtocol.encodeConfirm(key, value), 'decodeVoidResult')
+
+    @SignatureValidator( 'string' )
+    def delete(self, key):
+        self._update(ArakoonProtocol.encodeDelete(key), 'decodeVoidResult')
+
+    @SignatureValidator( 'string', 'string_option', 'string_option' )
+    def testAndSet(self, key, oldValue, newValue):
+        self._update(ArakoonProtocol.encodeTestAndSet(key, oldValue, newValue),
+                     'decodeStringOptionResult')
+
+    @SignatureValidator( 'string', 'string_option' )
+    def replace(self, key, wanted):
+        self._update(ArakoonProtocol.encodeReplace(key, wanted), 'decodeStringOptionResult')
+
+    @SignatureValidator( 'sequence', 'bool' )
+    def sequence(self, seq, sync = False):
+        self._update(ArakoonProtocol.encodeSequence(seq, sync), 'decodeVoidResult')
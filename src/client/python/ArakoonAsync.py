@@ -0,0 +1,557 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Arakoon client with non-blocking calls
+
+Every call returns an L{ArakoonFuture} right away. Finding the master and
+connecting to a node are left to a scheduler thread; the calls waiting for
+it are sent once it is done. Requests to the same node share a single connection; the server
+answers them in order, and one reader thread per connection hands the
+responses to the waiting futures. This way a single process can have
+thousands of requests in flight without a thread per request.
+"""
+
+import time
+import heapq
+import socket
+import itertools
+import threading
+import collections
+
+from ArakoonProtocol import *
+from ArakoonExceptions import *
+from ArakoonClientConnection import ArakoonClientConnection
+from ArakoonValidators import SignatureValidator
+from Arakoon import ArakoonClient
+import ArakoonRetry
+
+# Most retries an AsyncArakoonClient keeps waiting at once; beyond that failed calls are not retried
+ARA_ASYNC_MAX_PENDING_RETRIES = 10000
+
+class ArakoonFuture :
+    """
+    The eventual result of a call on an L{AsyncArakoonClient}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.isSet()
+
+    def result(self, timeout = None):
+        """
+        Wait for the call to complete and return its result, or raise its exception
+
+        @type timeout: float
+        @param timeout: seconds to wait, None means no limit
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout = None):
+        """
+        Wait for the call to complete and return its exception (None on success)
+        """
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """
+        Have fn(future) called when the call completes. If it already has,
+        fn is called immediately. Callbacks run on the connection's reader
+        thread, so they should not block.
+        """
+        with self._lock:
+            if not self._event.isSet():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _wait(self, timeout):
+        self._event.wait(timeout)
+        if not self._event.isSet():
+            raise ArakoonTimeout()
+
+    def _complete(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception, ex:
+                ArakoonClientLogger.logError( "Future callback failed (%s: '%s')",
+                                              ex.__class__.__name__, ex )
+
+
+class _MultiplexedConnection :
+    """
+    A connection shared by all in-flight requests to one node
+    """
+
+    def __init__(self, nodeLocations, clusterId, config):
+        self._conn = ArakoonClientConnection(nodeLocations, clusterId, config)
+        if not self._conn._connected:
+            raise ArakoonNotConnected( nodeLocations )
+        # written to directly: a send must never reconnect behind the reader's back
+        self._socket = self._conn._socket
+        self._pending = collections.deque()
+        self._cond = threading.Condition( threading.Lock() )
+        # Serializes the writers. The reader only takes self._cond, which is
+        # never held while writing, so a full send buffer can not stop it
+        # from draining the responses the server is blocked on.
+        self._sendLock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target = self._readLoop)
+        self._reader.setDaemon(True)
+        self._reader.start()
+
+    def submit(self, msg, decode, onDone):
+        with self._sendLock:
+            with self._cond:
+                if self._closed:
+                    raise ArakoonSockSendError()
+                # queued in the order the requests go out
+                self._pending.append( (decode, onDone) )
+                self._cond.notify()
+            failure = None
+            try:
+                self._socket.sendall(msg)
+            except Exception, ex:
+                ArakoonClientLogger.logWarning( "Error while sending data (%s: '%s')",
+                                                ex.__class__.__name__, ex )
+                failure = ArakoonSockSendError()
+            if failure is not None or self._closed:
+                self._conn.close()
+        if failure is not None:
+            # a partial write leaves the stream unusable for the others;
+            # this request fails through onDone along with them
+            with self._cond:
+                failed = self._shutdown()
+            self._fail(failed, failure)
+
+    def close(self):
+        with self._cond:
+            failed = self._shutdown()
+        self._release()
+        self._fail(failed, ArakoonSockRecvClosed())
+
+    def isClosed(self):
+        return self._closed
+
+    def _shutdown(self):
+        # must be called with self._cond held
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        failed = list(self._pending)
+        self._pending.clear()
+        self._cond.notify()
+        return failed
+
+    def _release(self):
+        # close the socket, unless a writer is busy with it: it closes the socket when done
+        if self._sendLock.acquire(False):
+            try:
+                self._conn.close()
+            finally:
+                self._sendLock.release()
+
+    def _fail(self, failed, exception):
+        for decode, onDone in failed:
+            onDone(None, exception)
+
+    def _readLoop(self):
+        while True:
+            with self._cond:
+                while len(self._pending) == 0 and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                decode, onDone = self._pending[0]
+
+            try:
+                result = decode(self._conn)
+                exception = None
+            except ArakoonSocketException, ex:
+                with self._cond:
+                    failed = self._shutdown()
+                self._release()
+                self._fail(failed, ex)
+                return
+            except ArakoonException, ex:
+                # reported by the server, the stream is still in sync
+                result = None
+                exception = ex
+            except Exception, ex:
+                with self._cond:
+                    failed = self._shutdown()
+                self._release()
+                self._fail(failed, ArakoonSockRecvError())
+                return
+
+            with self._cond:
+                if self._closed:
+                    # failed along with the other pending requests
+                    return
+                self._pending.popleft()
+            onDone(result, exception)
+
+
+class _Scheduler :
+    """
+    Runs functions after a delay, one at a time, on a single thread
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition( threading.Lock() )
+        self._heap = []
+        self._order = itertools.count()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, delay, fn, *args):
+        with self._cond:
+            # the counter keeps functions due at the same time in order
+            heapq.heappush( self._heap, (time.time() + delay, self._order.next(), fn, args) )
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if len(self._heap) == 0:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.time()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                (due, order, fn, args) = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception, ex:
+                ArakoonClientLogger.logError( "Scheduled call failed (%s: '%s')",
+                                              ex.__class__.__name__, ex )
+
+
+class _AsyncCall :
+    def __init__(self, msg, decode, isReadOnly, isDirty):
+        self.msg = msg
+        self.decode = decode
+        self.isReadOnly = isReadOnly
+        self.isDirty = isDirty
+        self.future = ArakoonFuture()
+        self.deadline = time.time() + ArakoonClientConfig.getNoMasterRetryPeriod()
+        self.delay = None
+
+
+class AsyncArakoonClient :
+    """
+    Arakoon client whose calls return an L{ArakoonFuture} instead of blocking.
+
+    It speaks the same protocol as L{ArakoonClient} and retries failed calls
+    according to the same policies and retry budget (see L{ArakoonRetry}).
+    Retries wait on a single scheduler thread, so no caller is blocked while a
+    new master is elected; at most L{ARA_ASYNC_MAX_PENDING_RETRIES} wait at once.
+
+    Example::
+
+        client = AsyncArakoonClient(config)
+        futures = [client.get(key) for key in keys]
+        values = [f.result() for f in futures]
+
+    TLS connections are not supported, since the SSL sockets of Python 2 can
+    not be read and written from different threads at the same time.
+    """
+
+    def __init__(self, config):
+        if config.tls:
+            raise ArakoonNotSupportedException("AsyncArakoonClient does not support TLS connections")
+        self._config = config
+        self._lock = threading.RLock()
+        self._masterId = None
+        self._connections = dict()
+        self._consistency = Consistent()
+        self._scheduler = _Scheduler()
+        # calls waiting for the master to be found or a connection to be made
+        self._waiting = []
+        self._connecting = False
+        # used for the (blocking) master discovery only
+        self._discovery = ArakoonClient(config)
+        self._dirtyReadNode = self._discovery.getDirtyReadNode()
+
+    def allowDirtyReads(self):
+        """
+        Allow the client to read values from a potential slave.
+
+        Enabling this can give back outdated values!
+        """
+        self._consistency = NoGuarantee()
+
+    def disallowDirtyReads(self):
+        """
+        Disallow the client to read values from a potential slave.
+        """
+        self._consistency = Consistent()
+
+    def setConsistency(self, c):
+        """
+        Either Consistent or NoGuarantees or AtLeast. Allows fine grained consistency constraints on subsequent reads
+        @type c: Consistency
+        """
+        self._consistency = c
+
+    def setDirtyReadNode(self, node):
+        """
+        Set the node that will be used for dirty read operations
+
+        @type node : string
+        @param node : the node identifier
+        """
+        if node not in self._config.getNodes().keys():
+            raise ArakoonUnknownNode( node )
+        self._dirtyReadNode = node
+
+    def getDirtyReadNode(self):
+        return self._dirtyReadNode
+
+    def whoMaster(self):
+        """
+        Determine the master (blocking)
+        """
+        return self._determineMaster()
+
+    def dropConnections(self):
+        '''Drop all connections to the Arakoon servers; in-flight calls fail or are retried'''
+        with self._lock:
+            connections = self._connections.values()
+            self._connections = dict()
+        for conn in connections:
+            conn.close()
+        self._discovery.dropConnections()
+
+    @SignatureValidator( 'string' )
+    def exists(self, key):
+        msg = ArakoonProtocol.encodeExists(key, self._consistency)
+        return self._read(msg, ArakoonProtocol.decodeBoolResult)
+
+    @SignatureValidator( 'string' )
+    def get(self, key):
+        msg = ArakoonProtocol.encodeGet(key, self._consistency)
+        return self._read(msg, ArakoonProtocol.decodeStringResult)
+
+    def multiGet(self, keys):
+        msg = ArakoonProtocol.encodeMultiGet(keys, self._consistency)
+        return self._read(msg, ArakoonProtocol.decodeStringListResult)
+
+    def multiGetOption(self, keys):
+        msg = ArakoonProtocol.encodeMultiGetOption(keys, self._consistency)
+        return self._read(msg, ArakoonProtocol.decodeStringOptionArrayResult)
+
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
+    def range(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000):
+        msg = ArakoonProtocol.encodeRange(beginKey, beginKeyIncluded, endKey,
+                                          endKeyIncluded, maxElements, self._consistency)
+        return self._read(msg, ArakoonProtocol.decodeStringListResult)
+
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int', 'bool' )
+    def range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000,
+                      compact = False):
+        msg = ArakoonProtocol.encodeRangeEntries(beginKey, beginKeyIncluded, endKey,
+                                                 endKeyIncluded, maxElements, self._consistency)
+        return self._read(msg, compact and ArakoonProtocol.decodeEntryListResult
+                                    or ArakoonProtocol.decodeStringPairListResult)
+
+    @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int', 'bool' )
+    def rev_range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000,
+                          compact = False):
+        msg = ArakoonProtocol.encodeReverseRangeEntries(beginKey, beginKeyIncluded, endKey,
+                                                        endKeyIncluded, maxElements, self._consistency)
+        return self._read(msg, compact and ArakoonProtocol.decodeEntryListResult
+                                    or ArakoonProtocol.decodeStringPairListResult)
+
+    @SignatureValidator( 'string', 'int' )
+    def prefix(self, keyPrefix, maxElements = 1000):
+        msg = ArakoonProtocol.encodePrefixKeys(keyPrefix, maxElements, self._consistency)
+        return self._read(msg, ArakoonProtocol.decodeStringListResult)
+
+    @SignatureValidator( 'string', 'string' )
+    def set(self, key, value):
+        return self._update(ArakoonProtocol.encodeSet(key, value),
+                            ArakoonProtocol.decodeVoidResult)
+
+    @SignatureValidator( 'string', 'string' )
+    def confirm(self, key, value):
+        return self._update(ArakoonProtocol.encodeConfirm(key, value),
+                            ArakoonProtocol.decodeVoidResult)
+
+    @SignatureValidator( 'string' )
+    def delete(self, key):
+        return self._update(ArakoonProtocol.encodeDelete(key),
+                            ArakoonProtocol.decodeVoidResult)
+
+    @SignatureValidator( 'string', 'string_option', 'string_option' )
+    def testAndSet(self, key, oldValue, newValue):
+        return self._update(ArakoonProtocol.encodeTestAndSet(key, oldValue, newValue),
+                            ArakoonProtocol.decodeStringOptionResult)
+
+    @SignatureValidator( 'string', 'string_option' )
+    def replace(self, key, wanted):
+        return self._update(ArakoonProtocol.encodeReplace(key, wanted),
+                            ArakoonProtocol.decodeStringOptionResult)
+
+    @SignatureValidator( 'sequence', 'bool' )
+    def sequence(self, seq, sync = False):
+        return self._update(ArakoonProtocol.encodeSequence(seq, sync),
+                            ArakoonProtocol.decodeVoidResult)
+
+    def _read(self, msg, decode):
+        call = _AsyncCall(msg, decode, True, self._consistency.isDirty())
+        self._dispatch(call)
+        return call.future
+
+    def _update(self, msg, decode):
+        call = _AsyncCall(msg, decode, False, False)
+        self._dispatch(call)
+        return call.future
+
+    def _dispatch(self, call):
+        with self._lock:
+            if call.isDirty:
+                nodeId = self._dirtyReadNode
+            else:
+                nodeId = self._masterId
+            conn = self._connections.get(nodeId)
+            if conn is None or conn.isClosed():
+                # the master lookup and the connect happen on the scheduler thread
+                self._waiting.append(call)
+                if self._connecting:
+                    return
+                self._connecting = True
+                conn = None
+        if conn is None:
+            self._scheduler.schedule(0, self._connectWaiting)
+        else:
+            self._submit(conn, nodeId, call)
+
+    def _submit(self, conn, nodeId, call):
+        try:
+            conn.submit(call.msg, call.decode,
+                        lambda result, ex: self._completed(call, nodeId, result, ex))
+        except Exception, ex:
+            self._completed(call, nodeId, None, ex)
+
+    def _connectWaiting(self):
+        while True:
+            with self._lock:
+                calls, self._waiting = self._waiting, []
+                if len(calls) == 0:
+                    self._connecting = False
+                    return
+            # looked up once for all calls waiting at the same time: (nodeId, exception)
+            master = None
+            connections = dict()
+            for call in calls:
+                if call.isDirty:
+                    nodeId, ex = self._dirtyReadNode, None
+                else:
+                    if master is None:
+                        try:
+                            master = (self._determineMaster(), None)
+                        except Exception, ex:
+                            master = (None, ex)
+                    nodeId, ex = master
+                if ex is None:
+                    if nodeId not in connections:
+                        try:
+                            connections[nodeId] = (self._getConnection(nodeId), None)
+                        except Exception, ex:
+                            connections[nodeId] = (None, ex)
+                    conn, ex = connections[nodeId]
+                if ex is None:
+                    self._submit(conn, nodeId, call)
+                else:
+                    self._completed(call, nodeId, None, ex)
+
+    def _completed(self, call, nodeId, result, exception):
+        if exception is None:
+            ArakoonRetry.ARA_RETRY_BUDGET.deposit()
+            call.future._complete(result, None)
+            return
+
+        policy = ArakoonRetry.policyFor(exception, call.isReadOnly)
+        if policy is None:
+            call.future._complete(None, exception)
+            return
+        sleepPeriod = policy.nextDelay(call.delay)
+        if time.time() + sleepPeriod > call.deadline or \
+           len(self._scheduler) >= ARA_ASYNC_MAX_PENDING_RETRIES or \
+           not ArakoonRetry.ARA_RETRY_BUDGET.withdraw():
+            call.future._complete(None, exception)
+            return
+
+        with self._lock:
+            if nodeId is not None and nodeId == self._masterId:
+                self._masterId = None
+                self._discovery._masterCache.invalidate(nodeId)
+            conn = self._connections.get(nodeId)
+            if conn is not None and conn.isClosed():
+                del self._connections[nodeId]
+        call.delay = sleepPeriod
+        ArakoonClientLogger.logWarning( "Call failed (%s: %s). Retrying in %0.2f sec." %
+                                        (exception.__class__.__name__, exception, sleepPeriod) )
+        self._scheduler.schedule(sleepPeriod, self._dispatch, call)
+
+    def _determineMaster(self):
+        masterId = self._masterId
+        if masterId is None:
+            masterId = self._discovery.whoMaster()
+            with self._lock:
+                self._masterId = masterId
+        return masterId
+
+    def _getConnection(self, nodeId):
+        with self._lock:
+            conn = self._connections.get(nodeId)
+        if conn is None or conn.isClosed():
+            nodeLocations = self._config.getNodeLocations( nodeId )
+            conn = _MultiplexedConnection(nodeLocations,
+                                          self._config.getClusterId(),
+                                          self._config)
+            with self._lock:
+                self._connections[nodeId] = conn
+        return conn
@@ -17,10 +17,57 @@ limitations under the License.
 
 
 import ssl
+import time
 import socket
+import select
+import threading
+from contextlib import contextmanager
 from ArakoonProtocol import *
 from ArakoonExceptions import *
 
+# Initial size of the per-connection receive buffer, in bytes
+ARA_RECV_BUFFER_SIZE = 64 * 1024
+
+_callState = threading.local()
+
+@contextmanager
+def callDeadline(deadline):
+    """
+    Bound all connects, sends and receives in this thread by deadline (as in time.time())
+
+    Nested deadlines can only shorten the time left; None leaves it unchanged.
+    """
+    previous = getattr(_callState, 'deadline', None)
+    if deadline is None or (previous is not None and previous < deadline):
+        deadline = previous
+    _callState.deadline = deadline
+    try:
+        yield
+    finally:
+        _callState.deadline = previous
+
+def currentDeadline():
+    """
+    @return: the deadline set with L{callDeadline} in this thread, or None
+    """
+    return getattr(_callState, 'deadline', None)
+
+def remainingTime():
+    """
+    Seconds a single socket operation may take in this thread
+
+    @return: the connection timeout, or less if the current call's deadline is closer
+    @raise ArakoonTimeout: if the current call's deadline has passed
+    """
+    timeout = ArakoonClientConfig.getConnectionTimeout()
+    deadline = getattr(_callState, 'deadline', None)
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise ArakoonTimeout()
+    return min(timeout, remaining)
+
 class ArakoonClientConnection :
 
     def __init__ (self, nodeLocations, clusterId, config):
@@ -33,37 +80,73 @@ class ArakoonClientConnection :
         self._socket = None
         self._socketInfo = None
         self._config = config
+        self._pool = None
+        self._generation = 0
+        self._lastUsed = 0
+        self._resetBuffer()
         self._reconnect()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # Errors reported by the server leave the stream in a known state,
+        # anything else (socket errors, interrupts) does not.
+        if exc_type is None or \
+           (issubclass(exc_type, ArakoonException) and \
+            not issubclass(exc_type, ArakoonSocketException)):
+            self.release()
+        else:
+            self.discard()
+        return False
+
+    def release(self):
+        '''Return the connection to the pool it was checked out from'''
+        if self._pool is not None:
+            self._pool.put( self )
+
+    def discard(self):
+        '''Close the connection and give up its place in the pool'''
+        if self._pool is not None:
+            self._pool.discard( self )
+        else:
+            self.close()
+
+    def _isHealthy(self):
+        if not self._connected or self._rstart != self._rend:
+            return False
+        try:
+            if isinstance(self._socket, ssl.SSLSocket) and self._socket.pending() > 0:
+                return False
+            # An idle connection has nothing to read, unless the peer closed it
+            readable, _, _ = select.select( [self._socket], [], [], 0 )
+        except Exception:
+            return False
+        return len(readable) == 0
+
+    def _resetBuffer(self):
+        self._rbuf = bytearray(ARA_RECV_BUFFER_SIZE)
+        self._rview = memoryview(self._rbuf)
+        self._rstart = 0
+        self._rend = 0
+
     def _reconnect(self):
         self.close()
+        timeout = remainingTime()
         try :
             ip = self._nodeIPs[self._index]
-            sock = socket.create_connection((ip , self._nodePort),
-                                                    ArakoonClientConfig.getConnectionTimeout())
+            sock = socket.create_connection((ip , self._nodePort), timeout)
 
             if self._config.tls:
-                kwargs = {
-                    'ssl_version': ssl.PROTOCOL_TLSv1,
-                    'cert_reqs': ssl.CERT_OPTIONAL,
-                    'do_handshake_on_connect': True
-                }
-
-                if self._config.tls_ca_cert:
-                    kwargs['cert_reqs'] = ssl.CERT_REQUIRED
-                    kwargs['ca_certs'] = self._config.tls_ca_cert
-
-                if self._config.tls_cert:
-                    cert, key = self._config.tls_cert
-                    kwargs['keyfile'] = key
-                    kwargs['certfile'] = cert
-
-                self._socket = ssl.wrap_socket(sock, **kwargs)
+                self._socket = self._config.getTLSContext().wrap_socket(
+                    sock, do_handshake_on_connect = True)
             else:
                 self._socket = sock
 
             self._socketInfo = (ip, self._nodePort)
             sendPrologue(self._socket, self._clusterId)
+            # The connection outlives this call: later calls must not inherit its deadline
+            self._socket.settimeout( ArakoonClientConfig.getConnectionTimeout() )
             self._connected = True
         except Exception, ex :
             ArakoonClientLogger.logWarning( "Unable to connect to %s:%s (%s: '%s')" ,
@@ -81,7 +164,24 @@ class ArakoonClientConnection :
             if not self._connected :
                 raise ArakoonNotConnected( (self._nodeIPs, self._nodePort) )
         try:
-            self._socket.sendall( msg )
+            if currentDeadline() is None:
+                self._socket.sendall( msg )
+            else:
+                self._socket.settimeout( remainingTime() )
+                try:
+                    self._socket.sendall( msg )
+                finally:
+                    self._socket.settimeout( ArakoonClientConfig.getConnectionTimeout() )
+        except ArakoonTimeout:
+            self.close()
+            raise
+        except socket.timeout, ex:
+            self.close()
+            if currentDeadline() is not None:
+                raise ArakoonTimeout()
+            ArakoonClientLogger.logWarning( "Timeout while sending data to (%s,%s)" ,
+                self._nodeIPs[self._index], self._nodePort )
+            raise ArakoonSockSendError ()
         except Exception, ex:
             self.close()
             ArakoonClientLogger.logWarning( "Error while sending data to (%s,%s) => %s: '%s'" ,
@@ -97,6 +197,91 @@ class ArakoonClientConnection :
                     self._nodeIPs[self._index], self._nodePort, ex.__class__.__name__, ex  )
             self._socketInfo = None
             self._connected = False
+        self._rstart = 0
+        self._rend = 0
+
+    def _closeAfterRecvFailure(self):
+        try:
+            self._socket.close()
+        except Exception, ex:
+            ArakoonClientLogger.logError( "Error while closing socket. %s: %s" % (ex.__class__.__name__,ex))
+        self._connected = False
+        self._rstart = 0
+        self._rend = 0
+
+    def _fill(self, n):
+        """
+        Make sure at least n bytes are available in the receive buffer.
+
+        Reads as much as the socket has to offer (up to the free space in
+        the buffer), so consecutive fields of a response are parsed from
+        the buffer without additional system calls.
+        """
+        available = self._rend - self._rstart
+        if available >= n:
+            return
+        if not self._connected :
+            raise ArakoonSockRecvClosed()
+
+        capacity = len(self._rbuf)
+        if self._rstart + n > capacity:
+            if n > capacity:
+                bigger = bytearray(max(n, 2 * capacity))
+                bigger[0:available] = self._rview[self._rstart:self._rend].tobytes()
+                self._rbuf = bigger
+                self._rview = memoryview(bigger)
+            elif available > 0:
+                self._rbuf[0:available] = self._rview[self._rstart:self._rend].tobytes()
+            self._rstart = 0
+            self._rend = available
+        elif available == 0:
+            self._rstart = 0
+            self._rend = 0
+
+        sock = self._socket
+        isSSL = isinstance(sock, ssl.SSLSocket)
+        while self._rend - self._rstart < n:
+            if not (isSSL and sock.pending() > 0):
+                try:
+                    timeout = remainingTime()
+                except ArakoonTimeout:
+                    # the rest of the response can not be told apart from the next one
+                    self._closeAfterRecvFailure()
+                    raise
+                readable, _, _ = select.select( [sock], [], [], timeout )
+                if len(readable) == 0:
+                    msg = str(self._socketInfo)
+                    self._closeAfterRecvFailure()
+                    deadline = currentDeadline()
+                    if deadline is not None and time.time() >= deadline:
+                        raise ArakoonTimeout()
+                    raise ArakoonSockNotReadable(msg = msg)
+            try :
+                received = sock.recv_into( self._rview[self._rend:] )
+            except Exception, ex:
+                ArakoonClientLogger.logError ("Error while receiving from socket. %s: '%s'" % (ex.__class__.__name__, ex) )
+                self._connected = False
+                raise ArakoonSockRecvError()
+            if received == 0:
+                self._closeAfterRecvFailure()
+                raise ArakoonSockReadNoBytes ()
+            self._rend += received
+
+    def _consume(self, n):
+        """
+        Take the next n bytes from the receive buffer.
+
+        @return: the buffer and the offset at which the n bytes start.
+            Only valid until the next call on this connection.
+        """
+        self._fill(n)
+        view = self._rview
+        offset = self._rstart
+        self._rstart = offset + n
+        if self._rstart == self._rend and len(self._rbuf) > ARA_RECV_BUFFER_SIZE:
+            # drop a buffer that was grown for a single large value
+            self._resetBuffer()
+        return view, offset
 
     def decodeStringResult(self) :
         return ArakoonProtocol.decodeStringResult ( self )
@@ -122,6 +307,9 @@ class ArakoonClientConnection :
     def decodeStringPairListResult(self) :
         return ArakoonProtocol.decodeStringPairListResult ( self )
 
+    def decodeEntryListResult(self):
+        return ArakoonProtocol.decodeEntryListResult ( self )
+
     def decodeStatistics(self):
         return ArakoonProtocol.decodeStatistics(self)
 
@@ -131,6 +319,9 @@ class ArakoonClientConnection :
     def decodeIntResult(self):
         return ArakoonProtocol.decodeIntResult(self)
 
+    def decodeIntervalResult(self):
+        return ArakoonProtocol.decodeIntervalResult(self)
+
     def decodeNurseryCfgResult(self):
         return ArakoonProtocol.decodeNurseryCfgResult(self)
 
@@ -140,3 +331,94 @@ class ArakoonClientConnection :
     def decodeGetTxidResult(self):
         return ArakoonProtocol.decodeGetTxidResult(self)
 
+
+
+class ArakoonConnectionPool :
+    """
+    Connections to a single node, shared by the threads using a client.
+
+    A connection is checked out for a complete request/response exchange,
+    so concurrent calls never read each other's responses. At most
+    L{ArakoonClientConfig.getPoolSize} connections are open at the same time;
+    idle connections are closed after L{ArakoonClientConfig.getPoolIdleTimeout}
+    seconds and are checked before they are handed out again.
+    """
+
+    def __init__(self, nodeLocations, clusterId, config):
+        self._nodeLocations = nodeLocations
+        self._clusterId = clusterId
+        self._config = config
+        self._maxSize = config.getPoolSize()
+        self._idleTimeout = config.getPoolIdleTimeout()
+        self._idle = []
+        self._size = 0
+        self._generation = 0
+        self._cond = threading.Condition( threading.Lock() )
+
+    def get(self):
+        deadline = time.time() + remainingTime()
+        with self._cond:
+            while True:
+                now = time.time()
+                while len(self._idle) > 0:
+                    conn = self._idle.pop()
+                    if now - conn._lastUsed < self._idleTimeout and conn._isHealthy():
+                        return conn
+                    self._size -= 1
+                    conn.close()
+                if self._size < self._maxSize:
+                    self._size += 1
+                    generation = self._generation
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise ArakoonPoolExhausted( self._nodeLocations )
+                self._cond.wait( remaining )
+
+        try:
+            conn = ArakoonClientConnection( self._nodeLocations, self._clusterId,
+                                            self._config )
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        conn._pool = self
+        conn._generation = generation
+        return conn
+
+    def put(self, conn):
+        with self._cond:
+            if conn._connected and conn._rstart == conn._rend \
+               and conn._generation == self._generation:
+                now = time.time()
+                conn._lastUsed = now
+                self._idle.append( conn )
+                while len(self._idle) > 0 and \
+                      now - self._idle[0]._lastUsed >= self._idleTimeout:
+                    stale = self._idle.pop(0)
+                    self._size -= 1
+                    stale.close()
+            else:
+                self._size -= 1
+                conn.close()
+            self._cond.notify()
+
+    def discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            conn.close()
+            self._cond.notify()
+
+    def clear(self):
+        """
+        Close all idle connections; connections that are checked out are
+        closed when they are returned.
+        """
+        with self._cond:
+            self._generation += 1
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
@@ -0,0 +1,106 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import sys
+import threading
+
+from ArakoonExceptions import ArakoonTimeout
+from ArakoonClientConnection import remainingTime
+
+class _Batch :
+    def __init__(self, consistency):
+        self.consistency = consistency
+        self.keys = []
+        self.positions = {}
+        self.closed = threading.Event()
+        self.done = threading.Event()
+        self.values = None
+        self.error = None
+
+    def add(self, key):
+        pos = self.positions.get(key)
+        if pos is None:
+            pos = len(self.keys)
+            self.positions[key] = pos
+            self.keys.append(key)
+        return pos
+
+class ArakoonCoalescer :
+    """
+    Collects single key reads issued by concurrent threads into one multiGetOption request.
+
+    The first thread to look up a key opens a batch and waits up to window seconds
+    (or until maxKeys distinct keys were asked for) for other threads to add
+    their keys. It then fetches all of them at once and hands every waiting
+    thread its own value. Only reads with the same consistency share a batch.
+    A thread waiting for another's batch gives up with L{ArakoonTimeout} when
+    its own call's deadline passes (see L{remainingTime}).
+    """
+
+    def __init__(self, fetch, window, maxKeys):
+        """
+        @param fetch: callable taking a list of keys and a consistency, returning the list of values (or None)
+        @type window: float
+        @param window: maximum time in seconds a batch waits for more keys
+        @type maxKeys: integer
+        @param maxKeys: number of distinct keys after which a batch is sent right away
+        """
+        self._fetch = fetch
+        self._window = window
+        self._maxKeys = maxKeys
+        self._lock = threading.Lock()
+        self._open = {}
+
+    def lookup(self, key, consistency):
+        """
+        Retrieve the value of key, or None if it has no value
+
+        @type key: string
+        @type consistency: Consistency
+        """
+        batchKey = consistency.encode()
+        with self._lock:
+            batch = self._open.get(batchKey)
+            isLeader = batch is None
+            if isLeader:
+                batch = _Batch(consistency)
+                self._open[batchKey] = batch
+            pos = batch.add(key)
+            if len(batch.keys) >= self._maxKeys:
+                del self._open[batchKey]
+                batch.closed.set()
+
+        if isLeader:
+            batch.closed.wait(self._window)
+            with self._lock:
+                if self._open.get(batchKey) is batch:
+                    del self._open[batchKey]
+            try:
+                batch.values = self._fetch(batch.keys, batch.consistency)
+            except:
+                batch.error = sys.exc_info()[1]
+            batch.done.set()
+        else:
+            # bounded like a socket operation of this call, not by the leader's
+            batch.done.wait(remainingTime())
+            if not batch.done.isSet():
+                raise ArakoonTimeout()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.values[pos]
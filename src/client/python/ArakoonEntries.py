@@ -0,0 +1,156 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+
+import struct
+import bisect
+
+_INT = struct.Struct("I")
+
+class ArakoonEntryList :
+    """
+    Read-only list of key-value pairs, as returned by range queries with compact results.
+
+    All keys and values are kept in a single buffer, in their wire encoding
+    (each preceded by its length), with the offset at which each pair starts
+    in an array. The key and value strings are only created when a pair is
+    accessed, so a large result costs a few bytes per pair on top of the keys
+    and values themselves, instead of a tuple and two strings per pair.
+
+    Pairs are accessed like a list of (key, value) tuples. Since range queries
+    return the pairs sorted on their key, L{get} finds a value by its key
+    with a binary search.
+    """
+
+    def __init__(self, data, offsets):
+        """
+        @type data: string or buffer
+        @param data: the encoded pairs
+        @type offsets: array
+        @param offsets: offset in data of each pair, in the order of the list
+        """
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _keyAt(self, offset):
+        size = _INT.unpack_from(self._data, offset)[0]
+        start = offset + 4
+        return self._data[start:start + size]
+
+    def _entryAt(self, offset):
+        data = self._data
+        size = _INT.unpack_from(data, offset)[0]
+        start = offset + 4
+        key = data[start:start + size]
+        offset = start + size
+        size = _INT.unpack_from(data, offset)[0]
+        start = offset + 4
+        return key, data[start:start + size]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._entryAt(offset) for offset in self._offsets[i]]
+        return self._entryAt(self._offsets[i])
+
+    def __iter__(self):
+        entryAt = self._entryAt
+        for offset in self._offsets:
+            yield entryAt(offset)
+
+    def __reversed__(self):
+        entryAt = self._entryAt
+        offsets = self._offsets
+        for i in xrange(len(offsets) - 1, -1, -1):
+            yield entryAt(offsets[i])
+
+    def key(self, i):
+        """
+        @return: the key of the i-th pair
+        """
+        return self._keyAt(self._offsets[i])
+
+    def value(self, i):
+        """
+        @return: the value of the i-th pair
+        """
+        return self._entryAt(self._offsets[i])[1]
+
+    def keys(self):
+        """
+        @rtype: list of strings
+        """
+        keyAt = self._keyAt
+        return [keyAt(offset) for offset in self._offsets]
+
+    def values(self):
+        """
+        @rtype: list of strings
+        """
+        return [entry[1] for entry in self]
+
+    def get(self, key, default = None):
+        """
+        Look up the value of key
+
+        @type key: string
+        @return: the value of key, or default if key is not in the list
+        """
+        keys = _SortedKeys(self)
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys):
+            k, v = self._entryAt(self._offsets[keys.index(i)])
+            if k == key:
+                return v
+        return default
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and list(self) == list(other)
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class _SortedKeys :
+    """
+    The keys of an L{ArakoonEntryList} in ascending order, for bisect
+    """
+
+    def __init__(self, entries):
+        self._entries = entries
+        n = len(entries)
+        self._descending = n > 1 and entries.key(0) > entries.key(n - 1)
+
+    def index(self, i):
+        if self._descending:
+            return len(self._entries) - 1 - i
+        return i
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, i):
+        return self._entries.key(self.index(i))
@@ -59,6 +59,18 @@ class ArakoonNotConnected( ArakoonException ):
         self._msg = ArakoonNotConnected._msgF % ( ips, port )
         ArakoonException.__init__( self, self._msg )
 
+class ArakoonPoolExhausted( ArakoonException ):
+    _msgF = "No connection to node at %s on port %s became available in time"
+
+    def __init__ (self, t):
+        ips = t[0]
+        port = t[1]
+        self._msg = ArakoonPoolExhausted._msgF % ( ips, port )
+        ArakoonException.__init__( self, self._msg )
+
+class ArakoonTimeout( ArakoonException ):
+    _msg = "Operation did not complete in time"
+
 class ArakoonNoMaster( ArakoonException ):
     _msg = "Could not determine the Arakoon master node"
 
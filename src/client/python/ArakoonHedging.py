@@ -0,0 +1,185 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import os
+import sys
+import time
+import select
+import threading
+from collections import deque
+
+from ArakoonExceptions import ArakoonTimeout
+from ArakoonClientConnection import remainingTime
+
+# Number of recent read latencies the hedge delay is computed from
+ARA_HEDGE_SAMPLES = 1000
+
+class _Overtaken(Exception):
+    # the second request answered before the first
+    pass
+
+class _Hedge :
+    """
+    The second request of a hedged read, started by the first one when it is slow
+    """
+
+    def __init__(self, hedger, attempt, firstNode, chooseSecond, failover):
+        self._hedger = hedger
+        self._attempt = attempt
+        self._firstNode = firstNode
+        self._chooseSecond = chooseSecond
+        self._failover = failover
+        self.secondNode = None
+        self._pipe = None
+        self._done = threading.Event()
+        self._answer = None
+
+    def started(self):
+        return self.secondNode is not None
+
+    def sent(self, conn):
+        """
+        Called by the first attempt once its request is written: returns when
+        its answer starts to arrive, or raises L{_Overtaken} if the second
+        request answered first.
+        """
+        sock = conn._socket
+        delay = min(self._hedger._delay, remainingTime())
+        if conn._rstart != conn._rend or len(select.select([sock], [], [], delay)[0]) > 0:
+            return
+        self.start()
+        if not self.started():
+            return
+        while not self._done.isSet():
+            readable, _, _ = select.select([sock, self._pipe[0]], [], [], remainingTime())
+            if len(readable) == 0 or sock in readable:
+                # the decoder reports the timeout, or reads the answer
+                return
+        succeeded, value = self._answer
+        if succeeded or not isinstance(value, self._failover):
+            raise _Overtaken()
+
+    def start(self):
+        # send the read to the second node, on a thread of its own
+        if self.started():
+            return
+        self.secondNode = self._chooseSecond(self._firstNode)
+        if self.secondNode is None:
+            return
+        self._pipe = os.pipe()
+        worker = threading.Thread( target = self._run )
+        worker.setDaemon( True )
+        worker.start()
+
+    def _run(self):
+        start = time.time()
+        try:
+            self._answer = (True, self._attempt(self.secondNode, None))
+            self._hedger._record(time.time() - start)
+        except:
+            self._answer = (False, sys.exc_info()[1])
+        self._done.set()
+        try:
+            os.write(self._pipe[1], "x")
+        except OSError:
+            pass
+        os.close(self._pipe[1])
+
+    def result(self):
+        """
+        Wait for the second request to complete and return its result, or raise its exception
+        """
+        self._done.wait(remainingTime())
+        if not self._done.isSet():
+            raise ArakoonTimeout()
+        succeeded, value = self._answer
+        if succeeded:
+            return value
+        raise value
+
+    def close(self):
+        if self._pipe is not None:
+            os.close(self._pipe[0])
+
+class ArakoonHedger :
+    """
+    Sends a read to a second node when the first one is slow to answer.
+
+    The read is made on the calling thread. The second request goes out, on a
+    thread of its own, when the first has not started to answer within the
+    given percentile of the latencies of recent reads (initialDelay seconds
+    until enough reads were seen), or as soon as the first node fails. The
+    first answer wins; when it is the second, the connection of the first
+    request is closed.
+    """
+
+    def __init__(self, percentile, initialDelay):
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100")
+        self._percentile = percentile
+        self._delay = initialDelay
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen = ARA_HEDGE_SAMPLES)
+        self._sinceUpdate = 0
+
+    def getDelay(self):
+        """
+        @return: seconds a read waits before it is sent to a second node
+        """
+        return self._delay
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._sinceUpdate += 1
+            # sorting on every read would cost more than it gains
+            if self._sinceUpdate >= 100 or \
+               (self._sinceUpdate >= 10 and len(self._latencies) < 100):
+                ordered = sorted(self._latencies)
+                self._delay = ordered[int(len(ordered) * self._percentile / 100.0)]
+                self._sinceUpdate = 0
+
+    def call(self, attempt, firstNode, chooseSecond, failover):
+        """
+        Run attempt(firstNode), and attempt on a second node if it is slow or fails
+
+        @param attempt: callable taking a node identifier and either None or a callable
+            to call with the connection once the request is written (see L{_Hedge.sent}),
+            returning the result of the read
+        @param chooseSecond: callable taking the first node, returning the node to hedge to (or None)
+        @param failover: exception types after which the other node is waited for
+        """
+        hedge = _Hedge(self, attempt, firstNode, chooseSecond, failover)
+        start = time.time()
+        try:
+            try:
+                result = attempt(firstNode, hedge.sent)
+            except _Overtaken:
+                return hedge.result()
+            except failover:
+                if hedge.started():
+                    return hedge.result()
+                secondNode = chooseSecond(firstNode)
+                if secondNode is None:
+                    raise
+                # nothing else is in flight, so no thread is needed
+                return attempt(secondNode, None)
+        finally:
+            hedge.close()
+        self._record(time.time() - start)
+        return result
@@ -0,0 +1,117 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import time
+import threading
+
+from ArakoonProtocol import ArakoonClientConfig
+from ArakoonExceptions import ArakoonNoMaster
+from ArakoonClientConnection import currentDeadline
+
+class _Refresh :
+    def __init__(self):
+        self.event = threading.Event()
+        self.masterId = None
+
+class ArakoonMasterCache :
+    """
+    The master of a cluster, as known by all clients of that cluster in this process.
+
+    A master found by one client is used by the others until it expires after
+    L{ArakoonClientConfig.getMasterLeasePeriod} seconds, or until a client finds
+    out it is no longer the master. Only one client at a time looks for a new
+    master; the others wait for its answer.
+    """
+
+    _caches = {}
+    _cachesLock = threading.Lock()
+
+    @staticmethod
+    def forConfig(config):
+        """
+        Retrieve the cache shared by all clients with the same cluster configuration
+
+        @type config: L{ArakoonClientConfig}
+        @rtype: L{ArakoonMasterCache}
+        """
+        nodes = config.getNodes()
+        key = (config.getClusterId(),
+               tuple(sorted((nodeId, tuple(ips), port)
+                            for (nodeId, (ips, port)) in nodes.iteritems())))
+        with ArakoonMasterCache._cachesLock:
+            cache = ArakoonMasterCache._caches.get(key)
+            if cache is None:
+                cache = ArakoonMasterCache()
+                ArakoonMasterCache._caches[key] = cache
+        return cache
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._masterId = None
+        self._expiry = 0
+        self._refresh = None
+
+    def lookup(self, discover):
+        """
+        Retrieve the master, calling discover() to find it if it is not known.
+
+        @param discover: callable returning the master's node identifier, or raising
+        @return: the master's node identifier
+        """
+        with self._lock:
+            if self._masterId is not None and time.time() < self._expiry:
+                return self._masterId
+            refresh = self._refresh
+            isLeader = refresh is None
+            if isLeader:
+                refresh = _Refresh()
+                self._refresh = refresh
+
+        if not isLeader:
+            timeout = ArakoonClientConfig.getNoMasterRetryPeriod()
+            deadline = currentDeadline()
+            if deadline is not None:
+                timeout = max(0, min(timeout, deadline - time.time()))
+            refresh.event.wait( timeout )
+            if refresh.masterId is None:
+                raise ArakoonNoMaster()
+            return refresh.masterId
+
+        try:
+            masterId = discover()
+        except:
+            with self._lock:
+                self._refresh = None
+            refresh.event.set()
+            raise
+
+        with self._lock:
+            self._masterId = masterId
+            self._expiry = time.time() + ArakoonClientConfig.getMasterLeasePeriod()
+            self._refresh = None
+        refresh.masterId = masterId
+        refresh.event.set()
+        return masterId
+
+    def invalidate(self, masterId = None):
+        """
+        Forget the master, if it is still masterId (whichever it is if None)
+        """
+        with self._lock:
+            if masterId is None or self._masterId == masterId:
+                self._masterId = None
@@ -22,22 +22,36 @@ Module implementing the Arakoon protocol
 from ArakoonExceptions import *
 from ArakoonValidators import SignatureValidator
 from NurseryRouting import RoutingInfo
+from ArakoonEntries import ArakoonEntryList
 
+import array
 import os.path
 import ssl
 import struct
+import threading
 import logging
-import select
 import operator
-import cStringIO
 import types
+import warnings
+
+try:
+    # compiled version of the hot parts of the codec, see _codec.c
+    import _codec
+except ImportError:
+    _codec = None
 
 FILTER = ''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
 
-ARA_CFG_TRY_CNT = 1
+ARA_CFG_TRY_CNT = 1         # no longer used, see ArakoonClientConfig.getTryCount
 ARA_CFG_CONN_TIMEOUT = 60
-ARA_CFG_CONN_BACKOFF = 5
+ARA_CFG_CONN_BACKOFF = 5    # no longer used, see ArakoonClientConfig.getBackoffInterval
 ARA_CFG_NO_MASTER_RETRY = 60
+ARA_CFG_POOL_SIZE = 8
+ARA_CFG_POOL_IDLE_TIMEOUT = 60
+ARA_CFG_MASTER_LEASE = 10
+ARA_CFG_PARALLEL_DISCOVERY = False
+
+_tlsContextLock = threading.Lock()
 
 class ArakoonClientConfig :
 
@@ -56,11 +70,10 @@ class ArakoonClientConfig :
                   "mySecondNode" :(["127.0.0.1"], 5000 ),
                   "myThirdNode"  :(["127.0.0.1","10.0.0.1"], 6000 )] })
 
-        Note: This client package only supports TLSv1 when connecting to nodes,
-        due to Python 2.x only supporting this TLS version. If your cluster is
-        configured to use another TLS version, you'll need to use another
-        Arakoon client which can work using a different socket interface which
-        supports different TLS versions.
+        Note: TLS connections use the highest protocol version both the node
+        and the OpenSSL library Python was built with support (TLSv1 or later,
+        SSLv2 and SSLv3 are refused). All connections made with one
+        configuration share a single SSL context, see L{getTLSContext}.
 
         @type clusterId: string
         @param clusterId: name of the cluster
@@ -100,11 +113,39 @@ class ArakoonClientConfig :
         self._tls = tls
         self._tls_ca_cert = tls_ca_cert
         self._tls_cert = tls_cert
+        self._tlsContext = None
 
     tls = property(operator.attrgetter('_tls'))
     tls_ca_cert = property(operator.attrgetter('_tls_ca_cert'))
     tls_cert = property(operator.attrgetter('_tls_cert'))
 
+    def getTLSContext(self):
+        """
+        Retrieve the SSL context for the TLS connections made with this configuration
+
+        The context is created, and the certificate files are read, only once;
+        reconnecting only costs the handshake itself.
+
+        @rtype: ssl.SSLContext
+        """
+        if self._tlsContext is None:
+            with _tlsContextLock:
+                if self._tlsContext is None:
+                    self._tlsContext = self._createTLSContext()
+        return self._tlsContext
+
+    def _createTLSContext(self):
+        context = ssl.SSLContext( getattr(ssl, 'PROTOCOL_TLS', ssl.PROTOCOL_SSLv23) )
+        context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.verify_mode = ssl.CERT_OPTIONAL
+        if self._tls_ca_cert:
+            context.verify_mode = ssl.CERT_REQUIRED
+            context.load_verify_locations( self._tls_ca_cert )
+        if self._tls_cert:
+            cert, key = self._tls_cert
+            context.load_cert_chain( cert, key )
+        return context
+
     def _cleanUp(self, nodes):
         for k in nodes.keys():
             t = nodes[k]
@@ -125,13 +166,41 @@ class ArakoonClientConfig :
         """
         Retrieve the period messages to the master should be retried when a master re-election occurs
 
-        This period is specified in seconds
+        This period is specified in seconds. It applies to calls that are not
+        given a timeout of their own.
 
         @rtype: integer
         @return: Returns the retry period in seconds
         """
         return ARA_CFG_NO_MASTER_RETRY
 
+    @staticmethod
+    def getMasterLeasePeriod() :
+        """
+        Retrieve how long a master that was found is trusted before it is looked up again
+
+        This period is specified in seconds and should match the lease_period of the cluster.
+        Can be controlled by changing the global variable L{ARA_CFG_MASTER_LEASE}
+
+        @rtype: integer
+        @return: Returns the master lease period in seconds
+        """
+        return ARA_CFG_MASTER_LEASE
+
+    @staticmethod
+    def getParallelMasterDiscovery() :
+        """
+        Whether the master is looked up by asking all nodes at the same time
+
+        When enabled, all nodes are asked who the master is concurrently, and the first
+        answer given by a majority of the nodes is used. Unreachable nodes then no longer
+        delay the discovery by a connection timeout each.
+        Can be controlled by changing the global variable L{ARA_CFG_PARALLEL_DISCOVERY}
+
+        @rtype: boolean
+        """
+        return ARA_CFG_PARALLEL_DISCOVERY
+
     def getNodeLocations(self, nodeId):
         """
         Retrieve location of the server node with give node identifier
@@ -159,13 +228,40 @@ class ArakoonClientConfig :
         """
         Retrieve the number of attempts a message should be tried before giving up
 
-        Can be controlled by changing the global variable L{ARA_CFG_TRY_CNT}
+        Deprecated: the client no longer uses it. Failed calls are retried
+        according to L{ArakoonRetry.ARA_RETRY_POLICIES}, limited by
+        L{ArakoonRetry.ARA_RETRY_BUDGET} and L{getNoMasterRetryPeriod}.
 
         @rtype: integer
-        @return: Returns the max retry count.
+        @return: Returns L{ARA_CFG_TRY_CNT}
         """
+        warnings.warn( "getTryCount has no effect, see ArakoonRetry.ARA_RETRY_POLICIES "
+                       "and ArakoonRetry.ARA_RETRY_BUDGET", DeprecationWarning, stacklevel = 2 )
         return ARA_CFG_TRY_CNT
 
+    def getPoolSize(self):
+        """
+        Retrieve the maximum number of connections a client keeps open to a single node
+
+        Concurrent calls on the same client each check out a connection of their own,
+        up to this number. Can be controlled by changing the global variable L{ARA_CFG_POOL_SIZE}
+
+        @rtype: integer
+        @return: Returns the maximum number of connections per node
+        """
+        return ARA_CFG_POOL_SIZE
+
+    def getPoolIdleTimeout(self):
+        """
+        Retrieve the number of seconds an unused pooled connection is kept open
+
+        Can be controlled by changing the global variable L{ARA_CFG_POOL_IDLE_TIMEOUT}
+
+        @rtype: integer
+        @return: Returns the idle timeout in seconds
+        """
+        return ARA_CFG_POOL_IDLE_TIMEOUT
+
 
     def getNodes(self):
         """
@@ -194,14 +290,15 @@ class ArakoonClientConfig :
         """
         Retrieves the backoff interval.
 
-        If an attempt to send a message to the server fails,
-        the client will wait a random number of seconds. The maximum wait time is n*getBackoffInterVal()
-        with n being the attempt counter.
-        Can be controlled by changing the global variable L{ARA_CFG_CONN_BACKOFF}
+        Deprecated: the client no longer uses it. The pauses between retries
+        are set per kind of failure by the L{ArakoonRetry.ArakoonRetryPolicy}
+        objects in L{ArakoonRetry.ARA_RETRY_POLICIES}.
 
         @rtype: integer
-        @return: The maximum backoff interval
+        @return: Returns L{ARA_CFG_CONN_BACKOFF}
         """
+        warnings.warn( "getBackoffInterval has no effect, see the ArakoonRetryPolicy "
+                       "objects in ArakoonRetry.ARA_RETRY_POLICIES", DeprecationWarning, stacklevel = 2 )
         return ARA_CFG_CONN_BACKOFF
 
     def getClusterId(self):
@@ -209,6 +306,10 @@ class ArakoonClientConfig :
 
 class ArakoonClientLogger :
 
+    @staticmethod
+    def logInfo( msg, *args ):
+        logging.info( msg, *args )
+
     @staticmethod
     def logWarning( msg, *args ):
         logging.warning(msg, *args )
@@ -282,6 +383,8 @@ ARA_CMD_KEY_COUNT                = 0x0000001a | ARA_CMD_MAG
 
 ARA_CMD_CONFIRM                  = 0x0000001c | ARA_CMD_MAG
 
+ARA_CMD_GET_INTERVAL             = 0x0000001e | ARA_CMD_MAG
+
 ARA_CMD_GET_NURSERY_CFG          = 0x00000020 | ARA_CMD_MAG
 ARA_CMD_REV_RAN_E                = 0x00000023 | ARA_CMD_MAG
 ARA_CMD_SYNCED_SEQUENCE          = 0x00000024 | ARA_CMD_MAG
@@ -323,27 +426,46 @@ NAMED_FIELD_TYPE_FLOAT  = 3
 NAMED_FIELD_TYPE_STRING = 4
 NAMED_FIELD_TYPE_LIST   = 5
 
+# Precompiled packers, so encoding does not build and parse a format per field
+_INT        = struct.Struct("I")
+_SIGNED_INT = struct.Struct("i")
+_INT64      = struct.Struct("q")
+_BOOL       = struct.Struct("?")
+_FLOAT      = struct.Struct("d")
+
+_packInt       = _INT.pack
+_packSignedInt = _SIGNED_INT.pack
+_packInt64     = _INT64.pack
+_packBool      = _BOOL.pack
+
+_NONE = _packBool(False)
+_SOME = _packBool(True)
+
 def _packString( toPack ):
-    toPackLength = len( toPack )
-    return struct.pack("I%ds" % ( toPackLength), toPackLength, toPack )
+    return _packInt( len(toPack) ) + toPack
 
 def _packStringOption ( toPack = None ):
     if toPack is None:
-        return _packBool ( 0 )
+        return _NONE
     else :
-        return _packBool ( 1 ) + _packString (toPack)
-
-def _packInt ( toPack ):
-    return struct.pack( "I", toPack )
-
-def _packInt64 ( toPack ):
-    return struct.pack( "q", toPack )
-
-def _packSignedInt ( toPack ):
-    return struct.pack( "i", toPack )
-
-def _packBool ( toPack) :
-    return struct.pack( "?", toPack)
+        return _SOME + _packInt( len(toPack) ) + toPack
+
+def _packStringList( parts, strings ):
+    """
+    Append the encoding of a list of strings to parts, a list of buffers
+    that is joined once the whole message has been built.
+    """
+    if _codec is not None:
+        try:
+            parts.append( _codec.pack_string_list( strings ) )
+            return parts
+        except TypeError:
+            pass
+    parts.append( _packInt( len(strings) ) )
+    for s in strings:
+        parts.append( _packInt( len(s) ) )
+        parts.append( s )
+    return parts
 
 def sendPrologue(socket, clusterId):
     p  = _packInt(ARA_CMD_MAG)
@@ -352,70 +474,23 @@ def sendPrologue(socket, clusterId):
     socket.sendall(p)
 
 def _readExactNBytes( con, n ):
-
-    if not con._connected :
-        raise ArakoonSockRecvClosed()
-    bytesRemaining = n
-    tmpResult = ""
-    timeout = ArakoonClientConfig.getConnectionTimeout()
-
-    if isinstance(con._socket, ssl.SSLSocket):
-        s = con._socket
-        pending = s.pending()
-        if pending > 0:
-            tmpResult = s.recv(min(n, pending))
-            bytesRemaining = bytesRemaining - len(tmpResult)
-
-    while bytesRemaining > 0 :
-
-        tripleList = select.select(  [con._socket] , [] , [] , timeout )
-
-        if ( len ( tripleList [0]) != 0 ) :
-            newChunk = ""
-            try :
-                newChunk =  tripleList [0][0].recv ( bytesRemaining)
-            except Exception, ex:
-                ArakoonClientLogger.logError ("Error while receiving from socket. %s: '%s'" % (ex.__class__.__name__, ex) )
-                con._connected = False
-                raise ArakoonSockRecvError()
-
-            newChunkSize = len( newChunk )
-            if newChunkSize == 0 :
-                try:
-                    con._socket.close()
-                except Exception, ex:
-                    ArakoonClientLogger.logError( "Error while closing socket. %s: %s" % (ex.__class__.__name__,ex))
-                con._connected = False
-                raise ArakoonSockReadNoBytes ()
-            tmpResult = tmpResult + newChunk
-            bytesRemaining = bytesRemaining - newChunkSize
-
-        else :
-            msg = str(con._socketInfo)
-            try:
-                con._socket.close()
-            except Exception, ex:
-                ArakoonClientLogger.logError( "Error while closing socket. %s: %s" % (ex.__class__.__name__,ex))
-            con._connected = False
-            raise ArakoonSockNotReadable(msg = msg)
-
-    return tmpResult
+    buf, offset = con._consume( n )
+    return buf[offset:offset + n].tobytes()
 
 def _recvString ( con ):
     strLength = _recvInt( con )
-    buf = _readExactNBytes( con, strLength)
-    return struct.unpack( "%ds" % strLength, buf ) [0]
+    return _readExactNBytes( con, strLength )
 
 def _unpackInt(buf, offset):
-    r=struct.unpack_from( "I", buf,offset)
+    r=_INT.unpack_from( buf,offset)
     return r[0], offset + ARA_TYPE_INT_SIZE
 
 def _unpackSignedInt(buf, offset):
-    r=struct.unpack_from( "i", buf,offset)
+    r=_SIGNED_INT.unpack_from( buf,offset)
     return r[0], offset + ARA_TYPE_INT_SIZE
 
 def _unpackInt64(buf, offset):
-    r= struct.unpack_from("q", buf, offset)
+    r= _INT64.unpack_from(buf, offset)
     return r[0], offset + 8
 
 def _unpackString(buf, offset):
@@ -460,31 +535,31 @@ def _unpackNamedField(buf, offset):
     raise ArakoonException("Cannot decode named field %s. Invalid type: %d" % (name,type) )
 
 def _recvInt ( con ):
-    buf = _readExactNBytes ( con, ARA_TYPE_INT_SIZE )
-    i,o2 = _unpackInt(buf,0)
+    buf, offset = con._consume( ARA_TYPE_INT_SIZE )
+    i,o2 = _unpackInt(buf, offset)
     return i
 
 def _recvInt64 ( con ):
-    buf = _readExactNBytes( con, ARA_TYPE_INT64_SIZE )
-    i,o2 = _unpackInt64(buf,0)
+    buf, offset = con._consume( ARA_TYPE_INT64_SIZE )
+    i,o2 = _unpackInt64(buf, offset)
     return i
 
 def _unpackBool(buf, offset):
-    r = struct.unpack_from( "?", buf, offset) [0]
+    r = _BOOL.unpack_from( buf, offset) [0]
     return r, offset+1
 
 def _recvBool ( con ):
-    buf = _readExactNBytes( con, 1 )
-    b, o2 = _unpackBool(buf,0)
+    buf, offset = con._consume( ARA_TYPE_BOOL_SIZE )
+    b, o2 = _unpackBool(buf, offset)
     return b
 
 def _unpackFloat(buf, offset):
-    r = struct.unpack_from("d", buf, offset)
+    r = _FLOAT.unpack_from(buf, offset)
     return r[0], offset+8
 
-def _recvFloat(buf):
-    buf = _readExactNBytes(con, 8)
-    f,o2 = _unpackFloat(buf,0)
+def _recvFloat(con):
+    buf, offset = con._consume( 8 )
+    f,o2 = _unpackFloat(buf, offset)
     return f
 
 def _recvStringOption ( con ):
@@ -494,6 +569,80 @@ def _recvStringOption ( con ):
     else :
         return None
 
+def _recvListCompiled ( con, kind ):
+    """
+    Receive a list of elements with the compiled codec, which decodes all
+    elements present in the receive buffer in a single call.
+    """
+    count = _recvInt( con )
+    result = []
+    while True:
+        offset, needed = _codec.unpack_list( kind, con._rbuf, con._rstart, con._rend,
+                                             count - len(result), result )
+        con._rstart = offset
+        if len(result) == count:
+            break
+        con._fill( needed )
+    # lets the connection drop a buffer that was grown for this response
+    con._consume( 0 )
+    return result
+
+def _recvEntryList ( con ):
+    """
+    Receive a list of key-value pairs into an L{ArakoonEntryList}, copying the
+    encoded pairs out of the receive buffer once, into a single bytearray.
+
+    The response only gives the number of pairs, so the bytearray is sized
+    for the rest of them from the average size of the pairs parsed so far.
+    """
+    remaining = _recvInt( con )
+    data = bytearray()
+    size = 0
+    offsets = array.array( 'L' )
+    unpack = _INT.unpack_from
+    while True:
+        buf = con._rbuf
+        start = con._rstart
+        end = con._rend
+        offset = start
+        needed = 0
+        while remaining > 0:
+            if end - offset < 4:
+                needed = 4
+                break
+            valueOffset = offset + 4 + unpack( buf, offset )[0]
+            if end - valueOffset < 4:
+                needed = valueOffset + 4 - offset
+                break
+            nextOffset = valueOffset + 4 + unpack( buf, valueOffset )[0]
+            if nextOffset > end:
+                needed = nextOffset - offset
+                break
+            offsets.append( size + offset - start )
+            offset = nextOffset
+            remaining -= 1
+        if offset > start:
+            newSize = size + offset - start
+            if newSize > len(data):
+                capacity = newSize + newSize / len(offsets) * remaining
+                if len(data) > 0:
+                    capacity = max( capacity, 2 * len(data) )
+                grown = bytearray( capacity )
+                grown[0:size] = data[0:size]
+                data = grown
+            data[size:newSize] = con._rview[start:offset]
+            size = newSize
+            con._rstart = offset
+        if remaining == 0:
+            break
+        con._fill( needed )
+    # lets the connection drop a buffer that was grown for this response
+    con._consume( 0 )
+    del data[size:]
+    # the pairs arrive in reverse order
+    offsets.reverse()
+    return ArakoonEntryList( buffer( data ), offsets )
+
 class Consistency:
     def __init__(self):
         self._v = _packBool(False)
@@ -530,6 +679,18 @@ class AtLeast(Consistency):
     def isDirty(self):
         return True
 
+_SEQ_SET           = _packInt(1)
+_SEQ_DELETE        = _packInt(2)
+_SEQ_SEQUENCE      = _packInt(5)
+_SEQ_ASSERT        = _packInt(8)
+_SEQ_ASSERT_EXISTS = _packInt(15)
+
+class _Parts(list):
+    """
+    Collects the buffers written by L{Update.write}, to be joined at once
+    """
+    write = list.append
+
 class Update(object):
     pass
 class Set(Update):
@@ -538,7 +699,7 @@ class Set(Update):
         self._value = value
 
     def write(self, fob):
-        fob.write(_packInt(1))
+        fob.write(_SEQ_SET)
         fob.write(_packString(self._key))
         fob.write(_packString(self._value))
 
@@ -547,7 +708,7 @@ class Delete(Update):
         self._key = key
 
     def write(self, fob):
-        fob.write(_packInt(2))
+        fob.write(_SEQ_DELETE)
         fob.write(_packString(self._key))
 
 class Assert(Update):
@@ -556,7 +717,7 @@ class Assert(Update):
         self._vo = vo
 
     def write(self, fob):
-        fob.write(_packInt(8))
+        fob.write(_SEQ_ASSERT)
         fob.write(_packString(self._key))
         fob.write(_packStringOption(self._vo))
 
@@ -565,7 +726,7 @@ class AssertExists(Update):
         self._key = key
 
     def write(self, fob):
-        fob.write(_packInt(15))
+        fob.write(_SEQ_ASSERT_EXISTS)
         fob.write(_packString(self._key))
 
 class Sequence(Update):
@@ -590,11 +751,14 @@ class Sequence(Update):
         self._updates.append(AssertExists(key))
 
     def write(self, fob):
-        fob.write( _packInt(5))
+        fob.write( _SEQ_SEQUENCE )
         fob.write( _packInt(len(self._updates)))
         for update in self._updates:
             update.write(fob)
 
+if _codec is not None:
+    _codec.register_update_types(Set, Delete, Assert, AssertExists, Sequence)
+
 
 class ArakoonProtocol :
 
@@ -666,10 +830,17 @@ class ArakoonProtocol :
 
     @staticmethod
     def encodeSequence(seq, sync):
-        r = cStringIO.StringIO()
-        seq.write(r)
-        flattened = r.getvalue()
-        r.close()
+        flattened = None
+        if _codec is not None:
+            try:
+                flattened = _codec.encode_sequence(seq)
+            except TypeError:
+                # updates of other classes (or unicode) only know how to write themselves
+                pass
+        if flattened is None:
+            r = _Parts()
+            seq.write(r)
+            flattened = ''.join(r)
         cmd = ARA_CMD_SEQ
         if sync:
             cmd = ARA_CMD_SYNCED_SEQUENCE
@@ -681,26 +852,24 @@ class ArakoonProtocol :
 
     @staticmethod
     def encodeRange( bKey, bInc, eKey, eInc, maxCnt , consistency):
-        retVal = _packInt( ARA_CMD_RAN ) + consistency.encode()
-        retVal += _packStringOption( bKey ) + _packBool ( bInc )
-        retVal += _packStringOption( eKey ) + _packBool (eInc) + _packSignedInt (maxCnt)
-        return  retVal
+        return ''.join([_packInt( ARA_CMD_RAN ), consistency.encode(),
+                        _packStringOption( bKey ), _packBool ( bInc ),
+                        _packStringOption( eKey ), _packBool (eInc),
+                        _packSignedInt (maxCnt)])
 
     @staticmethod
     def encodeRangeEntries(first, finc, last, linc, maxEntries, consistency):
-        r = _packInt(ARA_CMD_RAN_E) + consistency.encode()
-        r += _packStringOption(first) + _packBool(finc)
-        r += _packStringOption(last)  + _packBool(linc)
-        r += _packSignedInt(maxEntries)
-        return r
+        return ''.join([_packInt(ARA_CMD_RAN_E), consistency.encode(),
+                        _packStringOption(first), _packBool(finc),
+                        _packStringOption(last), _packBool(linc),
+                        _packSignedInt(maxEntries)])
 
     @staticmethod
     def encodeReverseRangeEntries(first, finc, last, linc, maxEntries, consistency):
-        r = _packInt(ARA_CMD_REV_RAN_E) + consistency.encode()
-        r += _packStringOption(first) + _packBool(finc)
-        r += _packStringOption(last) + _packBool(linc)
-        r += _packSignedInt(maxEntries)
-        return r
+        return ''.join([_packInt(ARA_CMD_REV_RAN_E), consistency.encode(),
+                        _packStringOption(first), _packBool(finc),
+                        _packStringOption(last), _packBool(linc),
+                        _packSignedInt(maxEntries)])
 
     @staticmethod
     def encodePrefixKeys( key, maxCnt, consistency ):
@@ -724,19 +893,13 @@ class ArakoonProtocol :
 
     @staticmethod
     def encodeMultiGet(keys, consistency):
-        retVal = _packInt(ARA_CMD_MULTI_GET) + consistency.encode()
-        retVal += _packInt(len(keys))
-        for key in keys:
-            retVal += _packString(key)
-        return retVal
+        parts = [_packInt(ARA_CMD_MULTI_GET), consistency.encode()]
+        return ''.join(_packStringList(parts, keys))
 
     @staticmethod
     def encodeMultiGetOption(keys, consistency):
-        retVal = _packInt(ARA_CMD_MULTI_GET_OPTION) + consistency.encode()
-        retVal += _packInt(len(keys))
-        for key in keys:
-            retVal += _packString(key)
-        return retVal
+        parts = [_packInt(ARA_CMD_MULTI_GET_OPTION), consistency.encode()]
+        return ''.join(_packStringList(parts, keys))
 
     @staticmethod
     def encodeExpectProgressPossible():
@@ -825,17 +988,23 @@ class ArakoonProtocol :
     def decodeStringListResult( con ):
 
         ArakoonProtocol._evaluateErrorCode( con )
-        retVal = []
+        if _codec is not None:
+            retVal = _recvListCompiled( con, _codec.LIST_STRING )
+            retVal.reverse()
+            return retVal
 
+        # the server sends the list in reverse order
         arraySize = _recvInt( con )
-
-        for i in xrange( arraySize ) :
-            retVal[:0] = [ _recvString( con ) ]
+        retVal = [ None ] * arraySize
+        for i in xrange( arraySize - 1, -1, -1 ) :
+            retVal[i] = _recvString( con )
         return retVal
 
     @staticmethod
     def decodeStringArrayResult(con):
         ArakoonProtocol._evaluateErrorCode(con)
+        if _codec is not None:
+            return _recvListCompiled( con, _codec.LIST_STRING )
         retVal = []
         size = _recvInt(con)
         for i in xrange(size):
@@ -847,6 +1016,8 @@ class ArakoonProtocol :
     @staticmethod
     def decodeStringOptionArrayResult(con):
         ArakoonProtocol._evaluateErrorCode(con)
+        if _codec is not None:
+            return _recvListCompiled( con, _codec.LIST_STRING_OPTION )
         retVal = []
         arraySize = _recvInt(con)
         for i in xrange(arraySize):
@@ -855,13 +1026,23 @@ class ArakoonProtocol :
         return retVal
 
 
+    @staticmethod
+    def decodeIntervalResult( con ):
+        ArakoonProtocol._evaluateErrorCode(con)
+        publicBegin = _recvStringOption(con)
+        publicEnd = _recvStringOption(con)
+        privateBegin = _recvStringOption(con)
+        privateEnd = _recvStringOption(con)
+        return (publicBegin, publicEnd, privateBegin, privateEnd)
+
     @staticmethod
     def decodeNurseryCfgResult( con ):
         ArakoonProtocol._evaluateErrorCode(con)
 
         offset = 0
         encoded = _recvString( con )
-        routing, offset = RoutingInfo.unpack(encoded, offset, _unpackBool, _unpackString)
+        root, offset = RoutingInfo.unpack(encoded, offset, _unpackBool, _unpackString)
+        routing = RoutingInfo(root)
         cfgCount, offset = _unpackInt(encoded, offset)
         resultCfgs = {}
         for i in range(cfgCount) :
@@ -898,23 +1079,38 @@ class ArakoonProtocol :
     @staticmethod
     def decodeStringPairListResult(con):
         ArakoonProtocol._evaluateErrorCode(con)
-        result = []
+        if _codec is not None:
+            result = _recvListCompiled( con, _codec.LIST_STRING_PAIR )
+            result.reverse()
+            return result
 
+        # the server sends the list in reverse order
         size = _recvInt( con )
-
-        for i in range(size):
+        result = [ None ] * size
+        for i in xrange( size - 1, -1, -1 ):
             k = _recvString ( con )
             v = _recvString ( con )
-            result [:0] = [(k, v)]
+            result[i] = (k, v)
 
         return result
 
+    @staticmethod
+    def decodeEntryListResult(con):
+        ArakoonProtocol._evaluateErrorCode(con)
+        return _recvEntryList( con )
+
     @staticmethod
     def decodeStatistics(con):
         ArakoonProtocol._evaluateErrorCode(con)
 
         buffer = _recvString(con)
-        result, offset = _unpackNamedField(buffer,0)
+        if _codec is not None:
+            try:
+                result = _codec.unpack_named_field(buffer)
+            except ValueError, ex:
+                raise ArakoonException(str(ex))
+        else:
+            result, offset = _unpackNamedField(buffer,0)
         return result['arakoon_stats']
 
     @staticmethod
@@ -933,3 +1129,7 @@ class ArakoonProtocol :
     @staticmethod
     def encodeGetNurseryCfg ():
         return _packInt(ARA_CMD_GET_NURSERY_CFG)
+
+    @staticmethod
+    def encodeGetInterval ():
+        return _packInt(ARA_CMD_GET_INTERVAL)
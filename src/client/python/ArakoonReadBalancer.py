@@ -0,0 +1,115 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import time
+import random
+import threading
+
+# Seconds a node that failed a read is avoided
+ARA_READ_FAILURE_PENALTY = 5.0
+
+# Weight of the latest latency in the moving average of a node
+ARA_READ_EWMA_WEIGHT = 0.3
+
+class _NodeStats :
+    def __init__(self):
+        self.outstanding = 0
+        self.latency = 0.0
+        self.avoidUntil = 0
+
+class ArakoonReadBalancer :
+    """
+    Spreads dirty reads over the nodes of a cluster.
+
+    Strategies:
+     - L{ROUND_ROBIN}: every node in turn
+     - L{LEAST_OUTSTANDING}: the node with the fewest reads in progress
+     - L{EWMA}: the node with the lowest moving average latency, weighted by the reads in progress
+
+    A node that fails a read, or is too far behind to serve it, is avoided for
+    L{ARA_READ_FAILURE_PENALTY} seconds, unless no other node is left.
+    """
+
+    ROUND_ROBIN = 'round_robin'
+    LEAST_OUTSTANDING = 'least_outstanding'
+    EWMA = 'ewma'
+
+    STRATEGIES = (ROUND_ROBIN, LEAST_OUTSTANDING, EWMA)
+
+    def __init__(self, nodeIds, strategy):
+        if strategy not in ArakoonReadBalancer.STRATEGIES:
+            raise ValueError("Unknown read balancing strategy '%s'" % strategy)
+        self._strategy = strategy
+        self._nodeIds = sorted(nodeIds)
+        self._stats = dict( (nodeId, _NodeStats()) for nodeId in self._nodeIds )
+        self._next = random.randint(0, len(self._nodeIds) - 1)
+        self._lock = threading.Lock()
+
+    def getStrategy(self):
+        return self._strategy
+
+    def choose(self, exclude = ()):
+        """
+        Pick the node for the next read and count it as in progress
+
+        @param exclude: nodes that must not be picked
+        @return: the node identifier, or None if all nodes are excluded
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [ nodeId for nodeId in self._nodeIds
+                           if nodeId not in exclude ]
+            healthy = [ nodeId for nodeId in candidates
+                        if self._stats[nodeId].avoidUntil <= now ]
+            if len(healthy) > 0:
+                candidates = healthy
+            if len(candidates) == 0:
+                return None
+
+            if self._strategy == ArakoonReadBalancer.ROUND_ROBIN:
+                nodeId = candidates[self._next % len(candidates)]
+                self._next += 1
+            elif self._strategy == ArakoonReadBalancer.LEAST_OUTSTANDING:
+                nodeId = min( candidates,
+                              key = lambda n: (self._stats[n].outstanding, random.random()) )
+            else:
+                nodeId = min( candidates,
+                              key = lambda n: (self._stats[n].latency * (self._stats[n].outstanding + 1),
+                                               random.random()) )
+            self._stats[nodeId].outstanding += 1
+            return nodeId
+
+    def finished(self, nodeId, latency, succeeded):
+        """
+        Record the outcome of a read started with L{choose}
+
+        @type latency: float
+        @param latency: seconds the read took, or None if it should not count for the average
+        @type succeeded: boolean
+        @param succeeded: False if the node failed or could not serve the read
+        """
+        with self._lock:
+            stats = self._stats[nodeId]
+            stats.outstanding -= 1
+            if not succeeded:
+                stats.avoidUntil = time.time() + ARA_READ_FAILURE_PENALTY
+            elif latency is not None:
+                if stats.latency == 0.0:
+                    stats.latency = latency
+                else:
+                    stats.latency += ARA_READ_EWMA_WEIGHT * (latency - stats.latency)
@@ -0,0 +1,130 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import threading
+from collections import OrderedDict
+
+from ArakoonProtocol import AtLeast
+
+class ArakoonReadCache :
+    """
+    Values read by a client, kept for reads that do not need the latest value.
+
+    Every value is stored with the transaction id it is known to be at least
+    as recent as. Reads with consistency L{NoGuarantee} can use any cached
+    value, reads with L{AtLeast}(i) only values stored with a transaction id
+    of i or more. L{Consistent} reads always go to the master, but what they
+    read is cached for the other reads. The least recently used values are
+    dropped when the cache holds more than maxEntries values or more than
+    maxBytes bytes of keys and values.
+    """
+
+    def __init__(self, maxEntries, maxBytes):
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def read(self, keys, consistency, knownTxid, fetch):
+        """
+        Retrieve the values of keys, from the cache where possible
+
+        @type keys: string list
+        @type consistency: Consistency
+        @param knownTxid: transaction id a consistent read is known to be at least as recent as (or None)
+        @param fetch: callable taking the keys missing from the cache and returning their values
+        @rtype: list
+        """
+        if isinstance(consistency, AtLeast):
+            txid = consistency._i
+        elif consistency.isDirty():
+            txid = -1
+        else:
+            txid = knownTxid
+
+        values = [None] * len(keys)
+        if consistency.isDirty():
+            missing = []
+            for i, key in enumerate(keys):
+                value = self._lookup(key, txid)
+                if value is None:
+                    missing.append(i)
+                else:
+                    values[i] = value
+            if len(missing) == 0:
+                return values
+        else:
+            missing = range(len(keys))
+
+        generation = self._generation
+        fetched = fetch([keys[i] for i in missing])
+        for i, value in zip(missing, fetched):
+            values[i] = value
+            if txid is not None and value is not None:
+                self._store(keys[i], value, txid, generation)
+        return values
+
+    def invalidate(self, keys = None):
+        """
+        Drop the given keys from the cache, or all of them if keys is None
+
+        Values that were being read while this happened are not stored.
+        """
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                for key in keys:
+                    self._remove(key)
+
+    def _lookup(self, key, txid):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            value, storedTxid = entry
+            if storedTxid < txid:
+                return None
+            return value
+
+    def _store(self, key, value, txid, generation):
+        size = len(key) + len(value)
+        if size > self._maxBytes:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._remove(key)
+            self._entries[key] = (value, txid)
+            self._bytes += size
+            while len(self._entries) > self._maxEntries or self._bytes > self._maxBytes:
+                oldKey, (oldValue, _) = self._entries.popitem(last = False)
+                self._bytes -= len(oldKey) + len(oldValue)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(key) + len(entry[0])
@@ -0,0 +1,168 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import sys
+import time
+import random
+import threading
+
+from ArakoonProtocol import ArakoonClientLogger
+from ArakoonExceptions import *
+
+class ArakoonRetryPolicy :
+    """
+    How calls failing with a given kind of error are retried.
+
+    The delay before a retry is drawn at random between baseDelay and three
+    times the previous delay, capped at maxDelay ("decorrelated jitter"), so
+    clients retrying at the same time spread out instead of retrying in lock step.
+    """
+
+    def __init__(self, baseDelay, maxDelay, readOnlyOnly = False):
+        """
+        @type baseDelay: float
+        @param baseDelay: minimum delay in seconds before a retry
+        @type maxDelay: float
+        @param maxDelay: maximum delay in seconds before a retry
+        @type readOnlyOnly: boolean
+        @param readOnlyOnly: only retry calls that do not update the store, as an update
+            may have been applied before the error occurred
+        """
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.readOnlyOnly = readOnlyOnly
+
+    def nextDelay(self, previous = None):
+        """
+        @param previous: the delay before the previous retry of the call, or None
+        @return: the delay in seconds before the next retry
+        """
+        if previous is None or previous < self.baseDelay:
+            previous = self.baseDelay
+        return min(self.maxDelay, random.uniform(self.baseDelay, previous * 3))
+
+# The first policy whose exception class matches the error applies; errors
+# without a policy are not retried.
+ARA_RETRY_POLICIES = [
+    # the node answered, just not as master: look up the master right away
+    (ArakoonNodeNotMaster, ArakoonRetryPolicy(0.01, 1.0)),
+    (ArakoonNoMaster,      ArakoonRetryPolicy(0.2, 5.0)),
+    # nothing was sent yet, so updates can be retried too
+    (ArakoonNotConnected,  ArakoonRetryPolicy(0.1, 5.0)),
+    (ArakoonSocketException, ArakoonRetryPolicy(0.1, 5.0, readOnlyOnly = True)),
+    (ArakoonGoingDown,     ArakoonRetryPolicy(0.5, 5.0, readOnlyOnly = True)),
+]
+
+def policyFor(exception, isReadOnly):
+    """
+    Find the policy for retrying a call that failed with exception
+
+    @type isReadOnly: boolean
+    @param isReadOnly: whether the call leaves the store unchanged
+    @rtype: L{ArakoonRetryPolicy}
+    @return: the policy, or None if the call must not be retried
+    """
+    for (exceptionClass, policy) in ARA_RETRY_POLICIES:
+        if isinstance(exception, exceptionClass):
+            if policy.readOnlyOnly and not isReadOnly:
+                return None
+            return policy
+    return None
+
+class ArakoonRetryBudget :
+    """
+    Limits the retries of all clients in the process together.
+
+    Every successful call adds ratio to the budget and every retry takes one from it, so
+    at most about ratio retries are made per call when a cluster is in trouble,
+    rather than every call retrying until its deadline. On top of that,
+    minPerSecond retries per second are always allowed, so a client that makes
+    few calls can still ride out a master re-election.
+    """
+
+    def __init__(self, ratio = 0.1, minPerSecond = 10, maxTokens = 100):
+        self._ratio = ratio
+        self._minPerSecond = minPerSecond
+        self._maxTokens = maxTokens
+        self._tokens = float(maxTokens)
+        self._refilled = time.time()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        # A full budget, the common case, is left alone without taking the lock
+        if self._tokens >= self._maxTokens:
+            return
+        with self._lock:
+            self._tokens = min(self._maxTokens, self._tokens + self._ratio)
+
+    def withdraw(self):
+        """
+        Take one retry from the budget
+
+        @rtype: boolean
+        @return: False if the budget is exhausted and the call should not be retried
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self._maxTokens,
+                               self._tokens + (now - self._refilled) * self._minPerSecond)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+# Budget shared by all clients in this process
+ARA_RETRY_BUDGET = ArakoonRetryBudget()
+
+def retry(call, isReadOnly, deadline, beforeRetry, failure = None):
+    """
+    Run call() until it succeeds, retrying failures according to L{ARA_RETRY_POLICIES}
+
+    @param isReadOnly: whether the call leaves the store unchanged
+    @param deadline: time (as in time.time()) after which no more retries are started
+    @param beforeRetry: callable taking the exception, run before each retry
+    @param failure: sys.exc_info() of a first attempt the caller already made, if any
+    @return: the result of call()
+    """
+    budget = ARA_RETRY_BUDGET
+    delay = None
+    while True:
+        if failure is None:
+            try:
+                result = call()
+            except ArakoonException:
+                failure = sys.exc_info()
+            else:
+                budget.deposit()
+                return result
+        ex = failure[1]
+        policy = policyFor(ex, isReadOnly)
+        if policy is None:
+            raise failure[0], failure[1], failure[2]
+        delay = policy.nextDelay(delay)
+        if time.time() + delay > deadline:
+            raise failure[0], failure[1], failure[2]
+        if not budget.withdraw():
+            ArakoonClientLogger.logWarning( "Not retrying after %s: retry budget exhausted" % ex )
+            raise failure[0], failure[1], failure[2]
+        failure = None
+        beforeRetry(ex)
+        ArakoonClientLogger.logWarning( "Call failed (%s: %s). Retrying in %0.2f sec." %
+                                        (ex.__class__.__name__, ex, delay) )
+        time.sleep(delay)
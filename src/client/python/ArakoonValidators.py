@@ -33,47 +33,71 @@ class SignatureValidator :
         }
 
     def __call__ (self, f ):
+        # The signature is worked out once here: a call only binds its keyword
+        # arguments to positions and does an isinstance check per argument.
+        code = f.func_code
+        names = code.co_varnames[1:code.co_argcount]
+        count = min( len(names), len(self.param_types) )
+        bound = names[:count]
+        checks = tuple( zip( names, [self.classesFor(arg_type) for arg_type in self.param_types] ) )
+        defaults = dict()
+        if f.func_defaults:
+            first = len(names) - len(f.func_defaults)
+            for (i, value) in enumerate(f.func_defaults):
+                defaults[first + i] = value
+
         @wraps(f)
         def my_new_f ( *args, **kwargs ) :
-            new_args = list( args[1:] )
-            missing_args = f.func_code.co_varnames[len(args):]
-            for missing_arg in missing_args:
-                if( len(new_args) == len(self.param_types) ) :
-            
-                    break
-                if( kwargs.has_key(missing_arg) ) :
-                    pos = f.func_code.co_varnames.index( missing_arg )
-#                    if pos > len(new_args):
-#                        new_args.append( None )
-            
-                    new_args.insert(pos, kwargs[missing_arg])
-                    del kwargs[missing_arg]
-            
-            if len( kwargs ) > 0:
-                raise ArakoonInvalidArguments( f.func_name, list(kwargs.iteritems()) )
-            
-            i = 0
-            error_key_values = []
-            for (arg, arg_type) in zip(new_args, self.param_types) :
-                if not self.validate(arg, arg_type):
-                    error_key_values.append( (f.func_code.co_varnames[i+1],new_args[i]) )
-                i += 1
-                
-            if len(error_key_values) > 0 :
-                raise ArakoonInvalidArguments( f.func_name, error_key_values )
-            
+            new_args = args[1:]
+            if len(kwargs) == count and len(new_args) == 0:
+                # all arguments by name, as passed on by utils.update_argspec
+                try:
+                    new_args = [ kwargs[name] for name in bound ]
+                except KeyError:
+                    new_args = ()
+                else:
+                    kwargs = None
+            if kwargs:
+                new_args = list( new_args )
+                missing = []
+                for i in xrange( len(new_args), count ):
+                    name = names[i]
+                    if name not in kwargs:
+                        missing.append( i )
+                        continue
+                    # arguments left out before this one take their default
+                    for j in missing:
+                        if j not in defaults:
+                            raise TypeError( "%s() takes argument '%s'" % (f.func_name, names[j]) )
+                        new_args.append( defaults[j] )
+                    missing = []
+                    new_args.append( kwargs.pop(name) )
+
+                if len( kwargs ) > 0:
+                    raise ArakoonInvalidArguments( f.func_name, list(kwargs.iteritems()) )
+
+            for ((name, classes), arg) in zip(checks, new_args):
+                if not isinstance(arg, classes):
+                    error_key_values = [ (name, arg) for ((name, classes), arg) in zip(checks, new_args)
+                                         if not isinstance(arg, classes) ]
+                    raise ArakoonInvalidArguments( f.func_name, error_key_values )
+
             return f( args[0], *new_args )
-        
+
         return my_new_f
 
-    def validate(self,arg,arg_type):
+    def classesFor(self, arg_type):
+        """
+        @return: the classes (for isinstance) an argument of the given type can be an instance of
+        """
         if self.param_native_type_mapping.has_key( arg_type ):
-            return isinstance(arg,self.param_native_type_mapping[arg_type] )     
+            return self.param_native_type_mapping[arg_type]
         elif arg_type == 'string_option' :
-            return isinstance( arg, str ) or arg is None
+            return (str, type(None))
         elif arg_type == 'sequence' :
-            return isinstance( arg, ArakoonProtocol.Sequence )
+            return ArakoonProtocol.Sequence
         else:
             raise RuntimeError( "Invalid argument type supplied: %s" % arg_type )
-        
-    
\ No newline at end of file
+
+    def validate(self,arg,arg_type):
+        return isinstance( arg, self.classesFor(arg_type) )
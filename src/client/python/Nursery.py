@@ -16,69 +16,293 @@ limitations under the License.
 
 
 
-from Arakoon import ArakoonClient 
+from Arakoon import ArakoonClient, _prefixEnd
 from NurseryRouting import RoutingInfo 
 from ArakoonExceptions import NurseryRangeError, NurseryInvalidConfig,ArakoonException
+from ArakoonExceptions import ArakoonInvalidArguments
+from ArakoonProtocol import Sequence
+from ArakoonClientConnection import callDeadline, currentDeadline
 from functools import wraps
+import sys
 import time
 import logging
+import threading
 
 maxDuration = 3
 
+# Pauses between attempts while neither cluster serves the keys of a migration step
+minPause = 0.01
+maxPause = 0.1
+
+# Seconds a cluster gets to tell which keys it serves, while following a migration
+followTimeout = 1.0
+
 def retryDuringMigration (f):
     @wraps(f)    
     def retrying_f (self,*args,**kwargs):
-        naptime = 0.1
-        duration = 0.0
-        start = time.time()
-        
-        callSucceeded = False
-        while (not callSucceeded and duration < maxDuration ):
+        deadline = time.time() + maxDuration
+        pause = minPause
+        while True:
+            generation = self._routingGeneration
             try:
-                retVal = f(self,*args,**kwargs)
-                callSucceeded = True
+                return f(self,*args,**kwargs)
             except (NurseryRangeError, NurseryInvalidConfig) as ex:
-                logging.warning("Nursery range or config error (%s). Sleep %f before next attempt" % (ex, naptime) )
-                time.sleep(naptime)       
-                duration = time.time() - start
-                naptime *= 1.5    
-                self._fetchNurseryConfig()
-        
-        if( duration >= maxDuration) :
-            raise ArakoonException("Failed to process nursery request in a timely fashion")
-        
-        return retVal
+                if time.time() >= deadline:
+                    raise ArakoonException("Failed to process nursery request in a timely fashion")
+                logging.warning("Nursery range or config error (%s). Updating the routing" % ex)
+                if self._updateRouting(generation, getattr(ex, 'clusterId', None)):
+                    pause = minPause
+                else:
+                    # a migration step is moving the keys from one cluster to the other
+                    time.sleep(min(pause, max(0.0, deadline - time.time())))
+                    pause = min(2 * pause, maxPause)
     
     return retrying_f
 
+def _fanOut(calls):
+    """
+    Run the callables in calls in parallel, one of them in the calling thread.
+
+    @return: their results, in the order of calls
+    @raise: the exception raised by the first callable (in the order of calls)
+        that failed, once all of them are done
+    """
+    if len(calls) <= 1:
+        return [ call() for call in calls ]
+    results = [None] * len(calls)
+    failures = [None] * len(calls)
+    callerDeadline = currentDeadline()
+    def run(i):
+        try:
+            with callDeadline( callerDeadline ):
+                results[i] = calls[i]()
+        except:
+            failures[i] = sys.exc_info()
+
+    threads = []
+    for i in range(1, len(calls)):
+        thread = threading.Thread( target = run, args = (i,) )
+        thread.setDaemon( True )
+        thread.start()
+        threads.append( thread )
+    run(0)
+    for thread in threads:
+        thread.join()
+    for failure in failures:
+        if failure is not None:
+            raise failure[0], failure[1], failure[2]
+    return results
+
+def _clip(lower, upper, beginKey, beginKeyIncluded, endKey, endKeyIncluded):
+    # the part of a range query that falls in [lower, upper), or None
+    if upper is not None and beginKey is not None and beginKey >= upper:
+        return None
+    if lower is not None and endKey is not None and \
+       (endKey < lower or (endKey == lower and not endKeyIncluded)):
+        return None
+    if lower is not None and (beginKey is None or beginKey < lower):
+        beginKey, beginKeyIncluded = lower, True
+    if upper is not None and (endKey is None or endKey >= upper):
+        endKey, endKeyIncluded = upper, False
+    return beginKey, beginKeyIncluded, endKey, endKeyIncluded
+
+class _RoutingUpdate :
+    def __init__(self):
+        self.done = threading.Event()
+        self.changed = False
+
 class NurseryClient:
     
     def __init__(self,clientConfig):
         self.nurseryClusterId = clientConfig.getClusterId()
         self._keeperClient = ArakoonClient(clientConfig)
         self._clusterClients = dict ()
+        self._publishedRouting = None
+        self._routingLock = threading.Lock()
+        self._routingGeneration = 0
+        self._routingChanged = False
+        self._routingUpdate = None
         self._fetchNurseryConfig()
     
+    def _updateRouting(self, generation, clusterId):
+        """
+        Bring the routing up to date after a cluster refused a request
+
+        Only one thread updates the routing at a time; the others wait for it.
+        Threads that were refused with the routing an update replaced do not
+        update it again, but retry.
+
+        @param generation: the value of _routingGeneration when the request was made
+        @param clusterId: the cluster that refused the request, if known, in which
+        case it and its neighbours are asked which keys they serve
+        @return: whether the routing changed
+        """
+        with self._routingLock:
+            if self._routingGeneration != generation:
+                return self._routingChanged
+            update = self._routingUpdate
+            isLeader = update is None
+            if isLeader:
+                update = _RoutingUpdate()
+                self._routingUpdate = update
+
+        if not isLeader:
+            update.done.wait()
+            return update.changed
+
+        # the keeper and the clusters are asked without holding the lock
+        changed = False
+        try:
+            changed = self._fetchNurseryConfig()
+            if not changed and clusterId is not None:
+                changed = self._followMigrations(clusterId)
+        finally:
+            with self._routingLock:
+                self._routingChanged = changed
+                self._routingGeneration += 1
+                self._routingUpdate = None
+            update.changed = changed
+            update.done.set()
+        return changed
+
+    def _followMigrations(self, clusterId):
+        # A migration moves keys out of a cluster before the keeper publishes
+        # the new routing: route them to the neighbour taking them over as
+        # soon as the cluster stops serving them. Only the cluster that refused
+        # and its neighbours are asked; one that does not answer in time is
+        # left as it is.
+        intervals = self._routing.getIntervals()
+        clusterIds = [ c for (lower, upper, c) in intervals ]
+        if clusterId not in clusterIds:
+            return False
+        i = clusterIds.index(clusterId)
+        asked = clusterIds[max(0, i - 1):i + 2]
+
+        def ask(c):
+            try:
+                return self._clusterClients[c]._getInterval()
+            except Exception, ex:
+                logging.warning("Cluster %s did not tell which keys it serves (%s)" % (c, ex))
+                return None
+        with callDeadline( time.time() + followTimeout ):
+            answers = _fanOut( [ lambda c = c: ask(c) for c in asked ] )
+
+        routing = self._routing
+        for (c, answer) in zip(asked, answers):
+            if answer is None:
+                continue
+            publicBegin, publicEnd, privateBegin, privateEnd = answer
+            narrowed = routing.narrowed(c, publicBegin, publicEnd)
+            if narrowed is not None:
+                routing = narrowed
+        if routing.getIntervals() == intervals:
+            return False
+        logging.debug("Nursery client follows migration, routing: %s" % str(routing))
+        self._routing = routing
+        return True
+
     def _fetchNurseryConfig(self):
+        """
+        @return: whether the clusters or the routing changed
+        """
         (routing,cfgs) = self._keeperClient.getNurseryConfig()
-        self._routing = routing
         logging.debug( "Nursery client has routing: %s" % str(routing))
-        for (clusterId,client) in self._clusterClients.iteritems() :
-            client.dropConnections()
-        
-        self._clusterClients = dict()
         logging.debug("Nursery contains %d clusters", len(cfgs))
+
+        # Clusters whose nodes did not change keep their client, with its
+        # connections and known master.
+        clients = dict()
         for (clusterId,cfg) in cfgs.iteritems():
-            client = ArakoonClient(cfg)
-            logging.debug("Adding client for cluster %s" % clusterId )
-            self._clusterClients[clusterId] = client
+            client = self._clusterClients.get(clusterId)
+            if client is not None and client._config.getNodes() == cfg.getNodes():
+                logging.debug("Keeping client for cluster %s" % clusterId )
+            else:
+                if client is not None:
+                    client.dropConnections()
+                client = ArakoonClient(cfg)
+                logging.debug("Adding client for cluster %s" % clusterId )
+            clients[clusterId] = client
+
+        changed = False
+        for (clusterId,client) in self._clusterClients.iteritems() :
+            if clients.get( clusterId ) is not client:
+                changed = True
+            if not clients.has_key( clusterId ):
+                client.dropConnections()
+        if len(clients) != len(self._clusterClients):
+            changed = True
+
+        # the clients go first, so the new routing never names a cluster without one
+        self._clusterClients = clients
+        published = self._publishedRouting
+        if published is None or published.getIntervals() != routing.getIntervals():
+            # this also drops what _followMigrations learnt ahead of the keeper
+            self._publishedRouting = routing
+            self._routing = routing
+            changed = True
+        return changed
     
     def _getArakoonClient(self, key):
         clusterId = self._routing.getClusterId(key)
         logging.debug("Key %s goes to cluster %s" % (key, clusterId))
+        return self._getClusterClient(clusterId)
+
+    def _getClusterClient(self, clusterId):
         if not self._clusterClients.has_key( clusterId ):
             raise NurseryInvalidConfig()
         return self._clusterClients[clusterId]
+
+    def _onCluster(self, clusterId, method, *args):
+        client = self._getClusterClient(clusterId)
+        try:
+            return getattr(client, method)(*args)
+        except NurseryRangeError, ex:
+            # tells retryDuringMigration a cluster refused the keys
+            ex.clusterId = clusterId
+            raise
+
+    def _multiRead(self, keys, method):
+        groups = self._routing.route_many(keys)
+        calls = []
+        for clusterId, clusterKeys in groups.iteritems():
+            calls.append( lambda clusterId = clusterId, clusterKeys = clusterKeys:
+                              self._onCluster(clusterId, method, clusterKeys) )
+        values = dict()
+        for clusterKeys, clusterValues in zip(groups.itervalues(), _fanOut(calls)):
+            values.update( zip(clusterKeys, clusterValues) )
+        return [values[key] for key in keys]
+
+    def _rangeRead(self, method, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements):
+        calls = []
+        for lower, upper, clusterId in self._routing.getIntervals():
+            bounds = _clip(lower, upper, beginKey, beginKeyIncluded, endKey, endKeyIncluded)
+            if bounds is None:
+                continue
+            calls.append( lambda clusterId = clusterId, bounds = bounds:
+                              self._onCluster(clusterId, method, *(bounds + (maxElements,))) )
+        result = []
+        for part in _fanOut(calls):
+            result.extend( part )
+            if maxElements >= 0 and len(result) >= maxElements:
+                return result[:maxElements]
+        return result
+
+    def _splitSequence(self, seq, parts, applied):
+        # the updates of seq per cluster, leaving out those whose id is in applied
+        for update in seq._updates:
+            if isinstance(update, Sequence):
+                self._splitSequence(update, parts, applied)
+                continue
+            if id(update) in applied:
+                continue
+            key = getattr(update, '_key', None)
+            if key is None:
+                raise ArakoonInvalidArguments('sequence', [('update', update)])
+            clusterId = self._routing.getClusterId(key)
+            if not parts.has_key( clusterId ):
+                parts[clusterId] = Sequence()
+            parts[clusterId].addUpdate(update)
+        return parts
     
     @retryDuringMigration
     def set(self, key, value):
@@ -96,8 +320,7 @@ class NurseryClient:
 
         @rtype: void
         """
-        client = self._getArakoonClient(key)
-        client.set(key,value)
+        self._onCluster(self._routing.getClusterId(key), 'set', key, value)
         
     @retryDuringMigration
     def get(self, key):
@@ -110,8 +333,7 @@ class NurseryClient:
         @return: The value associated with the given key
         """
 
-        client = self._getArakoonClient(key)
-        return client.get(key)
+        return self._onCluster(self._routing.getClusterId(key), 'get', key)
     
     @retryDuringMigration
     def delete(self, key):
@@ -123,6 +345,95 @@ class NurseryClient:
 
         @rtype: void
         """
-        client = self._getArakoonClient(key)
-        client.delete(key)
+        self._onCluster(self._routing.getClusterId(key), 'delete', key)
+
+    @retryDuringMigration
+    def multiGet(self, keys):
+        """
+        Retrieve the values for the keys in the given list.
+
+        The keys are sent to their clusters in parallel, one request per cluster.
+
+        @type keys: string list
+        @rtype: string list
+        @return: the values, in the same order as the keys
+        @raise ArakoonNotFound: if one of the keys has no value
+        """
+        return self._multiRead(keys, 'multiGet')
+
+    @retryDuringMigration
+    def multiGetOption(self, keys):
+        """
+        Retrieve the values for the keys in the given list, None for keys without a value.
+
+        The keys are sent to their clusters in parallel, one request per cluster.
+
+        @type keys: string list
+        @rtype: list of string options
+        @return: the values, in the same order as the keys
+        """
+        return self._multiRead(keys, 'multiGetOption')
+
+    @retryDuringMigration
+    def range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000):
+        """
+        Perform a range query on the nursery, retrieving the set of matching key-value pairs
+
+        Every cluster whose keys overlap the range is queried in parallel, for at most
+        maxElements pairs each, and the results are concatenated in key order.
+
+        @type beginKey: string option
+        @type beginKeyIncluded: boolean
+        @type endKey :string option
+        @type endKeyIncluded: boolean
+        @type maxElements: integer
+        @param maxElements: The maximum number of key-value pairs to return. Negative means no maximum.
+        @rtype: list of (string,string)
+        """
+        return self._rangeRead('range_entries', beginKey, beginKeyIncluded,
+                               endKey, endKeyIncluded, maxElements)
+
+    @retryDuringMigration
+    def prefix(self, keyPrefix, maxElements = 1000):
+        """
+        Retrieve the keys that start with keyPrefix, in key order
+
+        Every cluster whose keys overlap the prefix is queried in parallel.
+
+        @type keyPrefix: string
+        @type maxElements: integer
+        @param maxElements: The maximum number of keys to return. Negative means no maximum.
+        @rtype: list of strings
+        """
+        return self._rangeRead('range', keyPrefix, True, _prefixEnd(keyPrefix), False, maxElements)
+
+    def sequence(self, seq, sync = False):
+        """
+        Execute a sequence of updates on the nursery.
+
+        The updates are split per cluster, keeping their order, and the part for each
+        cluster is executed as a sequence on that cluster, in parallel with the others.
+        Only a sequence whose keys all live in the same cluster is all-or-nothing:
+        when the part for one cluster fails, the parts for the others may have been applied.
+
+        When a cluster refuses its part because a migration moved some of its keys,
+        only the updates of that part are routed again and sent to the clusters now
+        holding them; the parts that were applied are not sent twice.
+
+        @type seq: Sequence
+        @type sync: boolean
+        @rtype: void
+        """
+        self._sequence(seq, sync, set())
 
+    @retryDuringMigration
+    def _sequence(self, seq, sync, applied):
+        # applied holds the ids of the updates committed by earlier attempts
+        parts = self._splitSequence(seq, dict(), applied)
+        def apply(clusterId, part):
+            self._onCluster(clusterId, 'sequence', part, sync)
+            applied.update( [ id(update) for update in part._updates ] )
+        calls = []
+        for clusterId, part in parts.iteritems():
+            calls.append( lambda clusterId = clusterId, part = part: apply(clusterId, part) )
+        _fanOut(calls)
@@ -15,7 +15,9 @@ limitations under the License.
 """
 
 
+import copy
 import logging
+from bisect import bisect_right
 
 class RoutingInfo:
     
@@ -33,6 +35,16 @@ class RoutingInfo:
         
     def __init__(self, rootNode):
         self.__root = rootNode
+        self._compile()
+
+    def _compile(self):
+        # The tree flattened into the sorted boundaries and, for each of the
+        # ranges they delimit, the cluster holding it: lookups then take a
+        # single bisect, however unbalanced the tree is.
+        intervals = []
+        self.__root.addIntervals(None, None, intervals)
+        self._boundaries = [lower for lower, upper, clusterId in intervals[1:]]
+        self._clusterIds = [clusterId for lower, upper, clusterId in intervals]
     
     def __str__(self):
         return self.toString(0)
@@ -42,15 +54,92 @@ class RoutingInfo:
     
     def split(self, newBoundary, clusterId):
         self.__root = self.__root.split(newBoundary, clusterId)
+        self._compile()
         
     def serialize(self, serBool, serString):
         return self.__root.serialize(serBool, serString)
     
     def getClusterId(self, key):
-        return self.__root.getClusterId(key)
+        return self._clusterIds[bisect_right(self._boundaries, key)]
+
+    def route_many(self, keys):
+        """
+        Group keys by the cluster holding them
+
+        @type keys: string list
+        @rtype: dict
+        @return: for every cluster holding some of the keys, the list of those keys,
+            in the order they appear in keys
+        """
+        boundaries = self._boundaries
+        clusterIds = self._clusterIds
+        if len(clusterIds) == 1:
+            return { clusterIds[0] : list(keys) }
+        groups = dict()
+        for key in keys:
+            clusterId = clusterIds[bisect_right(boundaries, key)]
+            group = groups.get(clusterId)
+            if group is None:
+                groups[clusterId] = [key]
+            else:
+                group.append(key)
+        return groups
     
     def contains(self, clusterId):
         return self.__root.contains(clusterId)
+
+    def narrowed(self, clusterId, begin, end):
+        """
+        The routing after clusterId has handed the keys outside [begin, end) to its neighbours
+
+        This is what a migration publishes once it is done, so it can be used
+        as soon as a cluster reports it no longer serves those keys.
+
+        @type begin: string option
+        @type end: string option
+        @rtype: L{RoutingInfo}
+        @return: the new routing, or None if clusterId already holds at most [begin, end)
+        """
+        if clusterId not in self._clusterIds:
+            return None
+        i = self._clusterIds.index(clusterId)
+        boundaries = self._boundaries
+        lower = None
+        if i > 0:
+            lower = boundaries[i - 1]
+        upper = None
+        if i < len(boundaries):
+            upper = boundaries[i]
+
+        moves = []
+        if begin is not None and lower is not None and lower < begin:
+            moves.append( (lower, begin) )
+            lower = begin
+        if end is not None and upper is not None and end < upper:
+            moves.append( (upper, end) )
+            upper = end
+        if len(moves) == 0:
+            return None
+        if lower is not None and upper is not None and lower >= upper:
+            # the cluster would be left without keys, wait for the published routing
+            return None
+        root = copy.deepcopy(self.__root)
+        for old, new in moves:
+            root.moveBoundary(old, new)
+        return RoutingInfo(root)
+
+    def getIntervals(self):
+        """
+        The key ranges of the clusters, in key order
+
+        @rtype: list of (string option, string option, string)
+        @return: (lower, upper, clusterId) for every range: the cluster holds the keys
+            from lower (included) up to upper (excluded). None means unbounded.
+        """
+        boundaries = self._boundaries
+        lowers = [None] + boundaries
+        uppers = boundaries + [None]
+        return zip(lowers, uppers, self._clusterIds)
     
 class InternalRoutingNode(RoutingInfo):
     
@@ -88,6 +177,18 @@ class InternalRoutingNode(RoutingInfo):
             + self._left.serialize(serBool, serString) \
             + self._right.serialize(serBool, serString) 
     
+    def moveBoundary(self, old, new):
+        if old == self._boundary:
+            self._boundary = new
+        elif old < self._boundary:
+            self._left.moveBoundary(old, new)
+        else:
+            self._right.moveBoundary(old, new)
+
+    def addIntervals(self, lower, upper, intervals):
+        self._left.addIntervals(lower, self._boundary, intervals)
+        self._right.addIntervals(self._boundary, upper, intervals)
+
     def getClusterId(self, key):
         if key >= self._boundary :
             return self._right.getClusterId(key)
@@ -113,6 +214,12 @@ class LeafRoutingNode(RoutingInfo):
     def serialize(self, serBool, serString):
         return serBool(True) + serString( self._clusterId) 
     
+    def moveBoundary(self, old, new):
+        raise ValueError("Boundary %s is not in the routing table" % old)
+
+    def addIntervals(self, lower, upper, intervals):
+        intervals.append( (lower, upper, self._clusterId) )
+
     def getClusterId(self, key):
         return self._clusterId
     
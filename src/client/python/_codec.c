@@ -0,0 +1,546 @@
+/*
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+*/
+
+/*
+ * Optional compiled version of the hot parts of the wire codec in
+ * ArakoonProtocol.py. ArakoonProtocol falls back to its pure Python
+ * implementation when this module is not built, so both must produce and
+ * accept exactly the same bytes.
+ *
+ * Integers are written in native byte order, like the "I" and "q" formats
+ * of the struct module used by the pure Python codec.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+#define LIST_STRING        0
+#define LIST_STRING_OPTION 1
+#define LIST_STRING_PAIR   2
+
+#define NAMED_FIELD_TYPE_INT    1
+#define NAMED_FIELD_TYPE_INT64  2
+#define NAMED_FIELD_TYPE_FLOAT  3
+#define NAMED_FIELD_TYPE_STRING 4
+#define NAMED_FIELD_TYPE_LIST   5
+
+#define SEQ_SET           1
+#define SEQ_DELETE        2
+#define SEQ_SEQUENCE      5
+#define SEQ_ASSERT        8
+#define SEQ_ASSERT_EXISTS 15
+
+static PyObject *SetType = NULL;
+static PyObject *DeleteType = NULL;
+static PyObject *AssertType = NULL;
+static PyObject *AssertExistsType = NULL;
+static PyObject *SequenceType = NULL;
+
+/* Growable output buffer */
+
+typedef struct {
+    char *data;
+    Py_ssize_t size;
+    Py_ssize_t capacity;
+} Writer;
+
+static int writer_reserve(Writer *w, Py_ssize_t n)
+{
+    Py_ssize_t capacity;
+    char *data;
+
+    if (w->size + n <= w->capacity) {
+        return 0;
+    }
+    capacity = w->capacity * 2;
+    if (capacity < w->size + n) {
+        capacity = w->size + n;
+    }
+    data = PyMem_Realloc(w->data, capacity);
+    if (data == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    w->data = data;
+    w->capacity = capacity;
+    return 0;
+}
+
+static int writer_uint32(Writer *w, uint32_t i)
+{
+    if (writer_reserve(w, 4) < 0) {
+        return -1;
+    }
+    memcpy(w->data + w->size, &i, 4);
+    w->size += 4;
+    return 0;
+}
+
+static int writer_bytes(Writer *w, const char *s, Py_ssize_t n)
+{
+    if (writer_reserve(w, n) < 0) {
+        return -1;
+    }
+    memcpy(w->data + w->size, s, n);
+    w->size += n;
+    return 0;
+}
+
+static int writer_string(Writer *w, PyObject *s)
+{
+    if (!PyString_Check(s)) {
+        PyErr_SetString(PyExc_TypeError, "expected a string");
+        return -1;
+    }
+    if (writer_uint32(w, (uint32_t) PyString_GET_SIZE(s)) < 0) {
+        return -1;
+    }
+    return writer_bytes(w, PyString_AS_STRING(s), PyString_GET_SIZE(s));
+}
+
+static int writer_string_attr(Writer *w, PyObject *o, const char *name)
+{
+    int r;
+    PyObject *s = PyObject_GetAttrString(o, name);
+    if (s == NULL) {
+        return -1;
+    }
+    r = writer_string(w, s);
+    Py_DECREF(s);
+    return r;
+}
+
+static int writer_update(Writer *w, PyObject *u);
+
+static int writer_updates(Writer *w, PyObject *seq)
+{
+    Py_ssize_t i, n;
+    PyObject *updates, *fast;
+    int r = 0;
+
+    updates = PyObject_GetAttrString(seq, "_updates");
+    if (updates == NULL) {
+        return -1;
+    }
+    fast = PySequence_Fast(updates, "_updates must be a sequence");
+    Py_DECREF(updates);
+    if (fast == NULL) {
+        return -1;
+    }
+    n = PySequence_Fast_GET_SIZE(fast);
+    if (writer_uint32(w, SEQ_SEQUENCE) < 0 || writer_uint32(w, (uint32_t) n) < 0) {
+        r = -1;
+    }
+    for (i = 0; r == 0 && i < n; i++) {
+        r = writer_update(w, PySequence_Fast_GET_ITEM(fast, i));
+    }
+    Py_DECREF(fast);
+    return r;
+}
+
+static int writer_update(Writer *w, PyObject *u)
+{
+    PyObject *type = (PyObject *) Py_TYPE(u);
+
+    if (type == SetType) {
+        if (writer_uint32(w, SEQ_SET) < 0 ||
+            writer_string_attr(w, u, "_key") < 0 ||
+            writer_string_attr(w, u, "_value") < 0) {
+            return -1;
+        }
+        return 0;
+    }
+    if (type == DeleteType) {
+        if (writer_uint32(w, SEQ_DELETE) < 0 ||
+            writer_string_attr(w, u, "_key") < 0) {
+            return -1;
+        }
+        return 0;
+    }
+    if (type == AssertType) {
+        PyObject *vo;
+        int r;
+        if (writer_uint32(w, SEQ_ASSERT) < 0 ||
+            writer_string_attr(w, u, "_key") < 0) {
+            return -1;
+        }
+        vo = PyObject_GetAttrString(u, "_vo");
+        if (vo == NULL) {
+            return -1;
+        }
+        if (vo == Py_None) {
+            r = writer_bytes(w, "\x00", 1);
+        } else if ((r = writer_bytes(w, "\x01", 1)) == 0) {
+            r = writer_string(w, vo);
+        }
+        Py_DECREF(vo);
+        return r;
+    }
+    if (type == AssertExistsType) {
+        if (writer_uint32(w, SEQ_ASSERT_EXISTS) < 0 ||
+            writer_string_attr(w, u, "_key") < 0) {
+            return -1;
+        }
+        return 0;
+    }
+    if (type == SequenceType) {
+        return writer_updates(w, u);
+    }
+    PyErr_Format(PyExc_TypeError, "cannot encode update of type %s", Py_TYPE(u)->tp_name);
+    return -1;
+}
+
+PyDoc_STRVAR(register_update_types_doc,
+"register_update_types(Set, Delete, Assert, AssertExists, Sequence)\n\n"
+"Tell encode_sequence which classes the updates of a sequence are.");
+
+static PyObject *register_update_types(PyObject *self, PyObject *args)
+{
+    PyObject *types[5];
+    PyObject **slots[5] = { &SetType, &DeleteType, &AssertType,
+                            &AssertExistsType, &SequenceType };
+    int i;
+
+    if (!PyArg_ParseTuple(args, "OOOOO:register_update_types",
+                          &types[0], &types[1], &types[2], &types[3], &types[4])) {
+        return NULL;
+    }
+    for (i = 0; i < 5; i++) {
+        Py_INCREF(types[i]);
+        Py_XDECREF(*slots[i]);
+        *slots[i] = types[i];
+    }
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(encode_sequence_doc,
+"encode_sequence(seq) -> str\n\n"
+"Encode a Sequence and all its updates. Raises TypeError for updates of\n"
+"any other class than those given to register_update_types.");
+
+static PyObject *encode_sequence(PyObject *self, PyObject *seq)
+{
+    Writer w = { NULL, 0, 0 };
+    PyObject *result = NULL;
+
+    if (SequenceType == NULL) {
+        PyErr_SetString(PyExc_TypeError, "update types are not registered");
+        return NULL;
+    }
+    if (writer_reserve(&w, 1024) == 0 && writer_updates(&w, seq) == 0) {
+        result = PyString_FromStringAndSize(w.data, w.size);
+    }
+    PyMem_Free(w.data);
+    return result;
+}
+
+PyDoc_STRVAR(pack_string_list_doc,
+"pack_string_list(strings) -> str\n\n"
+"Encode a list of strings: the number of strings, then each string\n"
+"preceded by its length.");
+
+static PyObject *pack_string_list(PyObject *self, PyObject *strings)
+{
+    PyObject *fast, *s, *result;
+    Py_ssize_t i, n, total, size;
+    char *out;
+    uint32_t u;
+
+    fast = PySequence_Fast(strings, "expected a sequence of strings");
+    if (fast == NULL) {
+        return NULL;
+    }
+    n = PySequence_Fast_GET_SIZE(fast);
+    total = 4;
+    for (i = 0; i < n; i++) {
+        s = PySequence_Fast_GET_ITEM(fast, i);
+        if (!PyString_Check(s)) {
+            Py_DECREF(fast);
+            PyErr_SetString(PyExc_TypeError, "expected a sequence of strings");
+            return NULL;
+        }
+        total += 4 + PyString_GET_SIZE(s);
+    }
+    result = PyString_FromStringAndSize(NULL, total);
+    if (result == NULL) {
+        Py_DECREF(fast);
+        return NULL;
+    }
+    out = PyString_AS_STRING(result);
+    u = (uint32_t) n;
+    memcpy(out, &u, 4);
+    out += 4;
+    for (i = 0; i < n; i++) {
+        s = PySequence_Fast_GET_ITEM(fast, i);
+        size = PyString_GET_SIZE(s);
+        u = (uint32_t) size;
+        memcpy(out, &u, 4);
+        memcpy(out + 4, PyString_AS_STRING(s), size);
+        out += 4 + size;
+    }
+    Py_DECREF(fast);
+    return result;
+}
+
+/* Decoding */
+
+static uint32_t read_uint32(const char *p)
+{
+    uint32_t u;
+    memcpy(&u, p, 4);
+    return u;
+}
+
+/*
+ * Parse one string at offset. Returns the string and moves *offset past it,
+ * or returns NULL without an exception and sets *needed to the number of
+ * bytes (from offset) the string takes when it is not complete.
+ */
+static PyObject *take_string(const char *buf, Py_ssize_t *offset, Py_ssize_t end,
+                             Py_ssize_t *needed)
+{
+    Py_ssize_t o = *offset;
+    Py_ssize_t size;
+
+    if (end - o < 4) {
+        *needed = 4;
+        return NULL;
+    }
+    size = read_uint32(buf + o);
+    if (end - o - 4 < size) {
+        *needed = 4 + size;
+        return NULL;
+    }
+    *offset = o + 4 + size;
+    return PyString_FromStringAndSize(buf + o + 4, size);
+}
+
+PyDoc_STRVAR(unpack_list_doc,
+"unpack_list(kind, buf, offset, end, count, out) -> (offset, needed)\n\n"
+"Append up to count complete elements found in buf[offset:end] to the list\n"
+"out. kind is 0 for strings, 1 for string options and 2 for pairs of\n"
+"strings. Returns the offset after the last element taken and, when fewer\n"
+"than count elements were complete, the number of bytes from that offset\n"
+"the next element needs at least (0 otherwise).");
+
+static PyObject *unpack_list(PyObject *self, PyObject *args)
+{
+    int kind;
+    Py_buffer view;
+    Py_ssize_t offset, end, count, needed = 0, start, i;
+    PyObject *out, *item, *second;
+    const char *buf;
+
+    if (!PyArg_ParseTuple(args, "is*nnnO!:unpack_list", &kind, &view,
+                          &offset, &end, &count, &PyList_Type, &out)) {
+        return NULL;
+    }
+    if (offset < 0 || end > view.len || offset > end) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "offsets out of range");
+        return NULL;
+    }
+    buf = view.buf;
+
+    for (i = 0; i < count; i++) {
+        start = offset;
+        item = NULL;
+        if (kind == LIST_STRING) {
+            item = take_string(buf, &offset, end, &needed);
+        } else if (kind == LIST_STRING_OPTION) {
+            if (end - offset < 1) {
+                needed = 1;
+            } else if (buf[offset] == 0) {
+                offset += 1;
+                Py_INCREF(Py_None);
+                item = Py_None;
+            } else {
+                offset += 1;
+                item = take_string(buf, &offset, end, &needed);
+                if (item == NULL && !PyErr_Occurred()) {
+                    needed += 1;
+                }
+            }
+        } else if (kind == LIST_STRING_PAIR) {
+            PyObject *first = take_string(buf, &offset, end, &needed);
+            if (first != NULL) {
+                second = take_string(buf, &offset, end, &needed);
+                if (second != NULL) {
+                    item = PyTuple_Pack(2, first, second);
+                    Py_DECREF(second);
+                } else if (!PyErr_Occurred()) {
+                    needed += offset - start;
+                }
+                Py_DECREF(first);
+            }
+        } else {
+            PyErr_SetString(PyExc_ValueError, "unknown list kind");
+        }
+
+        if (item == NULL) {
+            offset = start;
+            if (PyErr_Occurred()) {
+                PyBuffer_Release(&view);
+                return NULL;
+            }
+            break;
+        }
+        if (PyList_Append(out, item) < 0) {
+            Py_DECREF(item);
+            PyBuffer_Release(&view);
+            return NULL;
+        }
+        Py_DECREF(item);
+        needed = 0;
+    }
+    PyBuffer_Release(&view);
+    return Py_BuildValue("nn", offset, needed);
+}
+
+static PyObject *named_field(const char *buf, Py_ssize_t len, Py_ssize_t *offset,
+                             PyObject *into);
+
+#define NEED(n) if (len - *offset < (n)) goto truncated
+
+static PyObject *named_field(const char *buf, Py_ssize_t len, Py_ssize_t *offset,
+                             PyObject *into)
+{
+    uint32_t type, count, i;
+    Py_ssize_t size;
+    PyObject *name = NULL, *value = NULL;
+
+    NEED(4);
+    type = read_uint32(buf + *offset);
+    *offset += 4;
+    NEED(4);
+    size = read_uint32(buf + *offset);
+    *offset += 4;
+    NEED(size);
+    name = PyString_FromStringAndSize(buf + *offset, size);
+    if (name == NULL) {
+        return NULL;
+    }
+    *offset += size;
+
+    switch (type) {
+    case NAMED_FIELD_TYPE_INT:
+        NEED(4);
+        value = PyInt_FromSize_t(read_uint32(buf + *offset));
+        *offset += 4;
+        break;
+    case NAMED_FIELD_TYPE_INT64: {
+        long long q;
+        NEED(8);
+        memcpy(&q, buf + *offset, 8);
+        if (q >= LONG_MIN && q <= LONG_MAX) {
+            value = PyInt_FromLong((long) q);
+        } else {
+            value = PyLong_FromLongLong(q);
+        }
+        *offset += 8;
+        break;
+    }
+    case NAMED_FIELD_TYPE_FLOAT: {
+        double d;
+        NEED(8);
+        memcpy(&d, buf + *offset, 8);
+        value = PyFloat_FromDouble(d);
+        *offset += 8;
+        break;
+    }
+    case NAMED_FIELD_TYPE_STRING:
+        NEED(4);
+        size = read_uint32(buf + *offset);
+        *offset += 4;
+        NEED(size);
+        value = PyString_FromStringAndSize(buf + *offset, size);
+        *offset += size;
+        break;
+    case NAMED_FIELD_TYPE_LIST:
+        NEED(4);
+        count = read_uint32(buf + *offset);
+        *offset += 4;
+        value = PyDict_New();
+        for (i = 0; value != NULL && i < count; i++) {
+            if (named_field(buf, len, offset, value) == NULL) {
+                Py_CLEAR(value);
+            }
+        }
+        break;
+    default:
+        PyErr_Format(PyExc_ValueError, "Cannot decode named field %s. Invalid type: %u",
+                     PyString_AS_STRING(name), type);
+    }
+
+    if (value == NULL || PyDict_SetItem(into, name, value) < 0) {
+        Py_DECREF(name);
+        Py_XDECREF(value);
+        return NULL;
+    }
+    Py_DECREF(name);
+    Py_DECREF(value);
+    return into;
+
+truncated:
+    Py_XDECREF(name);
+    PyErr_SetString(PyExc_ValueError, "Cannot decode named field: buffer too short");
+    return NULL;
+}
+
+PyDoc_STRVAR(unpack_named_field_doc,
+"unpack_named_field(buf) -> dict\n\n"
+"Decode the named field (as used by the statistics) at the start of buf,\n"
+"mapping its name to its value.");
+
+static PyObject *unpack_named_field(PyObject *self, PyObject *args)
+{
+    Py_buffer view;
+    Py_ssize_t offset = 0;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "s*:unpack_named_field", &view)) {
+        return NULL;
+    }
+    result = PyDict_New();
+    if (result != NULL && named_field(view.buf, view.len, &offset, result) == NULL) {
+        Py_CLEAR(result);
+    }
+    PyBuffer_Release(&view);
+    return result;
+}
+
+static PyMethodDef codec_methods[] = {
+    {"register_update_types", register_update_types, METH_VARARGS, register_update_types_doc},
+    {"encode_sequence", encode_sequence, METH_O, encode_sequence_doc},
+    {"pack_string_list", pack_string_list, METH_O, pack_string_list_doc},
+    {"unpack_list", unpack_list, METH_VARARGS, unpack_list_doc},
+    {"unpack_named_field", unpack_named_field, METH_VARARGS, unpack_named_field_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC init_codec(void)
+{
+    PyObject *m = Py_InitModule3("_codec", codec_methods,
+                                 "Compiled wire codec for the Arakoon client");
+    if (m == NULL) {
+        return;
+    }
+    PyModule_AddIntConstant(m, "LIST_STRING", LIST_STRING);
+    PyModule_AddIntConstant(m, "LIST_STRING_OPTION", LIST_STRING_OPTION);
+    PyModule_AddIntConstant(m, "LIST_STRING_PAIR", LIST_STRING_PAIR);
+}
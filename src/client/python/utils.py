@@ -23,10 +23,49 @@ limitations under the License.
 #
 # .. _Pyrakoon: https://github.com/Incubaid/pyrakoon
 
-import __builtin__
-import uuid
+import types
 import functools
-import itertools
+
+# Wrapper code by argument names. Functions taking the same arguments share
+# it, so only one wrapper per distinct argument list is compiled.
+_WRAPPER_CODE = {}
+
+def _wrapper_code(names):
+    '''Compile (once) the code of a wrapper taking the given argument names
+
+    :return: The code, and the global name the wrapped function goes by in it
+    :rtype: (`code`, `str`)
+    '''
+
+    try:
+        return _WRAPPER_CODE[names]
+    except KeyError:
+        pass
+
+    # The name of the wrapped function shouldn't conflict with the arguments
+    orig_name = '_orig'
+    while orig_name in names:
+        orig_name = '_%s' % orig_name
+
+    fun_def = 'def _wrapper(%s):\n    return %s(%s)\n' % (
+        ', '.join(names), orig_name,
+        ', '.join('%s=%s' % (name, name) for name in names))
+
+    env = {}
+    eval(compile(fun_def, '<update_argspec>', 'exec', 0, 1), env, env)
+
+    result = (env['_wrapper'].func_code, orig_name)
+    _WRAPPER_CODE[names] = result
+    return result
+
+def _renamed(code, name):
+    '''Copy of a code object with another name, as shown in errors'''
+
+    return types.CodeType(code.co_argcount, code.co_nlocals,
+        code.co_stacksize, code.co_flags, code.co_code, code.co_consts,
+        code.co_names, code.co_varnames, code.co_filename, name,
+        code.co_firstlineno, code.co_lnotab, code.co_freevars,
+        code.co_cellvars)
 
 def update_argspec(*argnames): #pylint: disable-msg=R0912
     '''Wrap a callable to use real argument names
@@ -42,9 +81,10 @@ def update_argspec(*argnames): #pylint: disable-msg=R0912
     arguments.
 
     The given argnames can be strings (for normal named arguments), or tuples
-    of a string and a value (for arguments with default values). Only a couple
-    of default value types are supported, an exception will be thrown when an
-    unsupported value type is given.
+    of a string and a value (for arguments with default values).
+
+    The wrapper is compiled once for every distinct list of argument names,
+    and shared by all functions taking those arguments.
 
     Example usage::
 
@@ -103,62 +143,10 @@ def update_argspec(*argnames): #pylint: disable-msg=R0912
     :rtype: `callable`
     '''
 
-    argnames_ = tuple(itertools.chain(argnames, ('', )))
-
-    # Standard execution context, contains only what we actually need in the
-    # function template
-    context = {
-        '__builtins__': None,
-        'dict': __builtin__.dict,
-        'zip': __builtin__.zip,
-        'True': True,
-        'False': False,
-    }
-
-    # Template for the function which will be compiled later on
-    def _format(value):
-        '''Format a value for display in a function signature'''
-
-        if isinstance(value, unicode):
-            return 'u\'%s\'' % value
-        elif isinstance(value, str):
-            return '\'%s\'' % value
-        elif isinstance(value, bool):
-            return 'True' if value else 'False'
-        elif isinstance(value, (int, long)):
-            return '%d' % value
-        elif value is None:
-            return 'None'
-        else:
-            raise TypeError
-
-    def _generate_signature(args):
-        '''Format arguments for display in a function signature'''
-
-        for arg in args:
-            if isinstance(arg, str):
-                yield '%s' % arg
-            else:
-                arg, default = arg
-                yield '%s=%s' % (arg, _format(default))
-
-    template_signature = ', '.join(_generate_signature(argnames_))
-    template_args = ', '.join(name if isinstance(name, str) else name[0] \
-        for name in argnames_) if argnames_ else ''
-    template_argnames = ', '.join(
-        '\'%s\'' % (name if isinstance(name, str) else name[0])
-        for name in argnames_) if argnames_ else ''
-
-    fun_def_template = '''
-def %%(name)s(%(signature)s):
-    %%(kwargs_name)s = dict(zip((%(argnames)s), (%(args)s)))
-
-    return %%(orig_name)s(**%%(kwargs_name)s)
-''' % {
-        'signature': template_signature,
-        'args': template_args,
-        'argnames': template_argnames,
-    }
+    names = tuple(name if isinstance(name, str) else name[0]
+                  for name in argnames)
+    defaults = tuple(name[1] for name in argnames
+                     if not isinstance(name, str)) or None
 
     def wrapper(fun):
         '''
@@ -171,38 +159,10 @@ def %%(name)s(%(signature)s):
         :see: `update_argspec`
         '''
 
-        # We need unique names for the variables used in the function template,
-        # they shouldn't conflict with the arguments
-        random_suffix = lambda: str(uuid.uuid4()).replace('-', '')
-
-        orig_function_name = None
-        while (not orig_function_name) or (orig_function_name in argnames_):
-            orig_function_name = '_orig_%s' % random_suffix()
-
-        kwargs_name = None
-        while (not kwargs_name) or (kwargs_name in argnames_):
-            kwargs_name = '_kwargs_%s' % random_suffix()
-
-
-        # Fill in function template
-        fun_def = fun_def_template % {
-            'name': fun.__name__,
-            'orig_name': orig_function_name,
-            'kwargs_name': kwargs_name,
-        }
-
-        # Compile function to a code object
-        code = compile(fun_def, '<update_argspec>', 'exec', 0, 1)
-
-        # Create evaluation context
-        env = context.copy()
-        env[orig_function_name] = fun
-
-        # Evaluate the code object in the evaluation context
-        eval(code, env, env)
-
-        # Retrieve the compiled/evaluated function
-        fun_wrapper = env[fun.__name__]
+        code, orig_name = _wrapper_code(names)
+        fun_wrapper = types.FunctionType(_renamed(code, fun.__name__),
+                                         {orig_name: fun}, fun.__name__,
+                                         defaults)
 
         # Update __*__ attributes
         updated = functools.update_wrapper(fun_wrapper, fun)
@@ -0,0 +1,207 @@
+"""
+Microbenchmarks for the call path of the Python client.
+
+Run from the root of the repository:
+
+    python tools/benchmark/client_call_bench.py
+
+Every public method of ArakoonClient is wrapped by utils.update_argspec,
+retryDuringMasterReelection and SignatureValidator. This times a get that
+does not touch the network through that stack, with the current wrappers and
+with a copy of the ones they replaced (a wrapper compiled per method, binding
+its arguments through a dict, and a validator looking up the argument names
+on every call). For scale, it also times encoding the request of the get.
+
+It also times decorating the methods of ArakoonClient with either version of
+update_argspec, and `import Arakoon` in a fresh interpreter.
+"""
+
+import os
+import new
+import sys
+import uuid
+import inspect
+import timeit
+import functools
+import itertools
+import subprocess
+import __builtin__
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                          'src', 'client', 'python')
+sys.path.insert(0, CLIENT_DIR)
+
+import utils
+import Arakoon
+import ArakoonProtocol
+from functools import wraps
+from ArakoonExceptions import ArakoonInvalidArguments
+from ArakoonValidators import SignatureValidator
+
+def _legacyUpdateArgspec(*argnames):
+    argnames_ = tuple(itertools.chain(argnames, ('', )))
+    context = {
+        '__builtins__': None,
+        'dict': __builtin__.dict,
+        'zip': __builtin__.zip,
+        'True': True,
+        'False': False,
+    }
+
+    def _format(value):
+        if isinstance(value, str):
+            return '\'%s\'' % value
+        elif isinstance(value, bool):
+            return 'True' if value else 'False'
+        elif isinstance(value, (int, long)):
+            return '%d' % value
+        elif value is None:
+            return 'None'
+        else:
+            raise TypeError
+
+    def _generate_signature(args):
+        for arg in args:
+            if isinstance(arg, str):
+                yield '%s' % arg
+            else:
+                arg, default = arg
+                yield '%s=%s' % (arg, _format(default))
+
+    template_signature = ', '.join(_generate_signature(argnames_))
+    template_args = ', '.join(name if isinstance(name, str) else name[0] \
+        for name in argnames_) if argnames_ else ''
+    template_argnames = ', '.join(
+        '\'%s\'' % (name if isinstance(name, str) else name[0])
+        for name in argnames_) if argnames_ else ''
+
+    fun_def_template = '''
+def %%(name)s(%(signature)s):
+    %%(kwargs_name)s = dict(zip((%(argnames)s), (%(args)s)))
+
+    return %%(orig_name)s(**%%(kwargs_name)s)
+''' % {
+        'signature': template_signature,
+        'args': template_args,
+        'argnames': template_argnames,
+    }
+
+    def wrapper(fun):
+        random_suffix = lambda: str(uuid.uuid4()).replace('-', '')
+
+        orig_function_name = None
+        while (not orig_function_name) or (orig_function_name in argnames_):
+            orig_function_name = '_orig_%s' % random_suffix()
+
+        kwargs_name = None
+        while (not kwargs_name) or (kwargs_name in argnames_):
+            kwargs_name = '_kwargs_%s' % random_suffix()
+
+        fun_def = fun_def_template % {
+            'name': fun.__name__,
+            'orig_name': orig_function_name,
+            'kwargs_name': kwargs_name,
+        }
+        code = compile(fun_def, '<update_argspec>', 'exec', 0, 1)
+        env = context.copy()
+        env[orig_function_name] = fun
+        eval(code, env, env)
+        return functools.update_wrapper(env[fun.__name__], fun)
+
+    return wrapper
+
+class _LegacySignatureValidator(SignatureValidator):
+    def __call__ (self, f ):
+        @wraps(f)
+        def my_new_f ( *args, **kwargs ) :
+            new_args = list( args[1:] )
+            missing_args = f.func_code.co_varnames[len(args):]
+            for missing_arg in missing_args:
+                if( len(new_args) == len(self.param_types) ) :
+                    break
+                if( kwargs.has_key(missing_arg) ) :
+                    pos = f.func_code.co_varnames.index( missing_arg )
+                    new_args.insert(pos, kwargs[missing_arg])
+                    del kwargs[missing_arg]
+
+            if len( kwargs ) > 0:
+                raise ArakoonInvalidArguments( f.func_name, list(kwargs.iteritems()) )
+
+            i = 0
+            error_key_values = []
+            for (arg, arg_type) in zip(new_args, self.param_types) :
+                if not self.validate(arg, arg_type):
+                    error_key_values.append( (f.func_code.co_varnames[i+1],new_args[i]) )
+                i += 1
+
+            if len(error_key_values) > 0 :
+                raise ArakoonInvalidArguments( f.func_name, error_key_values )
+
+            return f( args[0], *new_args )
+
+        return my_new_f
+
+def _get(self, key):
+    return self._value
+
+def _client(argspec, validator):
+    # a client whose get returns at once, wrapped like ArakoonClient.get
+    get = argspec('self', 'key', ('timeout', None))(
+        Arakoon.retryDuringMasterReelection(is_read_only=True)(
+            validator('string')(_get)))
+    cls = new.classobj('BenchClient', (Arakoon.ArakoonClient, ), {'get': get})
+    client = new.instance(cls)
+    client._value = 'value'
+    return client
+
+def _argspecs():
+    # the argument lists update_argspec is used with in ArakoonClient
+    result = []
+    for name, method in inspect.getmembers(Arakoon.ArakoonClient, inspect.ismethod):
+        code = method.im_func.func_code
+        if code.co_filename != '<update_argspec>':
+            continue
+        args, varargs, varkw, defaults = inspect.getargspec(method)
+        defaults = defaults or ()
+        first = len(args) - len(defaults)
+        result.append(tuple(args[:first]) + tuple(zip(args[first:], defaults)))
+    return result
+
+def bench(name, legacy, current, number):
+    t_legacy = min(timeit.repeat(legacy, number = number, repeat = 3)) / number
+    t_current = min(timeit.repeat(current, number = number, repeat = 3)) / number
+    print "%-44s legacy %9.2f us   current %9.2f us   speedup %5.1fx" % \
+        (name, t_legacy * 1e6, t_current * 1e6, t_legacy / t_current)
+
+def main():
+    legacy = _client(_legacyUpdateArgspec, _LegacySignatureValidator)
+    current = _client(utils.update_argspec, SignatureValidator)
+    assert legacy.get('key') == current.get('key') == 'value'
+    bench("get('key')", lambda: legacy.get('key'), lambda: current.get('key'), 100000)
+    bench("get(key = 'key', timeout = 1.0)",
+          lambda: legacy.get(key = 'key', timeout = 1.0),
+          lambda: current.get(key = 'key', timeout = 1.0), 100000)
+
+    consistency = ArakoonProtocol.Consistent()
+    t_encode = min(timeit.repeat(lambda: ArakoonProtocol.ArakoonProtocol.encodeGet('key', consistency),
+                                 number = 100000, repeat = 3)) / 100000
+    print "%-44s %9.2f us" % ("encodeGet('key')", t_encode * 1e6)
+
+    argspecs = _argspecs()
+    def decorate(argspec):
+        for names in argspecs:
+            argspec(*names)(_get)
+    bench("decorating %d methods" % len(argspecs),
+          lambda: decorate(_legacyUpdateArgspec),
+          lambda: decorate(utils.update_argspec), 10)
+
+    command = [sys.executable, '-c',
+               'import time; start = time.time(); import Arakoon; print time.time() - start']
+    times = []
+    for i in range(5):
+        output = subprocess.check_output(command, cwd = CLIENT_DIR)
+        times.append(float(output))
+    print "%-44s %9.2f ms" % ("import Arakoon", min(times) * 1000)
+
+if __name__ == '__main__':
+    main()
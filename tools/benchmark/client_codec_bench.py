@@ -0,0 +1,144 @@
+"""
+Microbenchmarks for the wire codec of the Python client.
+
+Run from the root of the repository:
+
+    python tools/benchmark/client_codec_bench.py
+
+Each benchmark times the current implementation in
+src/client/python/ArakoonProtocol.py against a copy of the encoding it
+replaced (one struct format string per field, string concatenation per key),
+or of the decoding it replaced (inserting each element at the head of the
+result). Decoding is timed both with the pure python codec and, if it is
+built, with the compiled one.
+"""
+
+import os
+import new
+import sys
+import struct
+import timeit
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'src', 'client', 'python'))
+
+import ArakoonProtocol
+from ArakoonProtocol import ArakoonProtocol as P, Consistent
+from ArakoonProtocol import _recvString
+from ArakoonClientConnection import ArakoonClientConnection
+
+def _legacyPackString(s):
+    return struct.pack("I%ds" % len(s), len(s), s)
+
+def _legacyEncodeMultiGet(keys, consistency):
+    retVal = struct.pack("I", ArakoonProtocol.ARA_CMD_MULTI_GET) + consistency.encode()
+    retVal += struct.pack("I", len(keys))
+    for key in keys:
+        retVal += _legacyPackString(key)
+    return retVal
+
+def _legacyEncodeSequence(seq):
+    fob = cStringIO.StringIO()
+    fob.write(struct.pack("I", 5))
+    fob.write(struct.pack("I", len(seq._updates)))
+    for u in seq._updates:
+        fob.write(struct.pack("I", 1))
+        fob.write(_legacyPackString(u._key))
+        fob.write(_legacyPackString(u._value))
+    flattened = fob.getvalue()
+    fob.close()
+    return struct.pack("I", ArakoonProtocol.ARA_CMD_SEQ) + _legacyPackString(flattened)
+
+def _legacyDecodeStringListResult(con):
+    ArakoonProtocol.ArakoonProtocol._evaluateErrorCode(con)
+    retVal = []
+    arraySize = ArakoonProtocol._recvInt(con)
+    for i in xrange(arraySize):
+        retVal[:0] = [_recvString(con)]
+    return retVal
+
+def _legacyDecodeStringPairListResult(con):
+    ArakoonProtocol.ArakoonProtocol._evaluateErrorCode(con)
+    result = []
+    size = ArakoonProtocol._recvInt(con)
+    for i in range(size):
+        k = _recvString(con)
+        v = _recvString(con)
+        result[:0] = [(k, v)]
+    return result
+
+def _response(strings):
+    return struct.pack("II", 0, len(strings)) + \
+        ''.join([struct.pack("I", len(s)) + s for s in strings])
+
+def _connection(response):
+    # a connection that has the complete response in its receive buffer
+    con = new.instance(ArakoonClientConnection)
+    con._rbuf = bytearray(response)
+    con._rview = memoryview(con._rbuf)
+    con._rstart = 0
+    con._rend = len(response)
+    con._connected = True
+    return con
+
+def _sequence(kvs):
+    seq = ArakoonProtocol.Sequence()
+    for k, v in kvs:
+        seq.addUpdate(ArakoonProtocol.Set(k, v))
+    return seq
+
+def bench(name, legacy, current, number):
+    t_legacy = min(timeit.repeat(legacy, number = number, repeat = 3)) / number
+    t_current = min(timeit.repeat(current, number = number, repeat = 3)) / number
+    print "%-44s legacy %9.3f ms   current %9.3f ms   speedup %5.1fx" % \
+        (name, t_legacy * 1000, t_current * 1000, t_legacy / t_current)
+
+def main():
+    consistency = Consistent()
+    for n in (100, 10000, 50000):
+        keys = ['key_%010d' % i for i in xrange(n)]
+        assert _legacyEncodeMultiGet(keys, consistency) == P.encodeMultiGet(keys, consistency)
+        bench("encodeMultiGet(%d keys)" % n,
+              lambda: _legacyEncodeMultiGet(keys, consistency),
+              lambda: P.encodeMultiGet(keys, consistency),
+              max(1, 100000 / n))
+
+    for n in (100, 10000):
+        seq = _sequence([('key_%010d' % i, 'value_%d' % i) for i in xrange(n)])
+        assert _legacyEncodeSequence(seq) == P.encodeSequence(seq, False)
+        bench("encodeSequence(%d sets)" % n,
+              lambda: _legacyEncodeSequence(seq),
+              lambda: P.encodeSequence(seq, False),
+              max(1, 100000 / n))
+
+    codecs = [('python', None)]
+    if ArakoonProtocol._codec is not None:
+        codecs.append(('compiled', ArakoonProtocol._codec))
+    compiled = ArakoonProtocol._codec
+    try:
+        for codecName, codec in codecs:
+            ArakoonProtocol._codec = codec
+            for n in (1000, 10000, 100000):
+                keys = ['key_%010d' % i for i in xrange(n)]
+                response = _response(keys)
+                assert _legacyDecodeStringListResult(_connection(response)) == \
+                    P.decodeStringListResult(_connection(response))
+                bench("decodeStringListResult(%d, %s)" % (n, codecName),
+                      lambda: _legacyDecodeStringListResult(_connection(response)),
+                      lambda: P.decodeStringListResult(_connection(response)),
+                      max(1, 10000 / n))
+
+                response = _response([s for key in keys for s in (key, 'value')])
+                response = struct.pack("II", 0, n) + response[8:]
+                assert _legacyDecodeStringPairListResult(_connection(response)) == \
+                    P.decodeStringPairListResult(_connection(response))
+                bench("decodeStringPairListResult(%d, %s)" % (n, codecName),
+                      lambda: _legacyDecodeStringPairListResult(_connection(response)),
+                      lambda: P.decodeStringPairListResult(_connection(response)),
+                      max(1, 10000 / n))
+    finally:
+        ArakoonProtocol._codec = compiled
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Reconnect latency of TLS connections made by the Python client.
+
+Starts a local TLS server and times complete TCP connect + TLS handshake
+rounds, once the way connections used to be made (ssl.wrap_socket, which
+builds a new SSL context and reads the certificate files for every
+connection) and once with the SSL context shared by all connections of an
+ArakoonClientConfig.
+
+Run from the root of the repository with a CA certificate and a certificate
+and key signed by it (used by both the server and the client):
+
+    python tools/benchmark/tls_reconnect_bench.py ca.pem cert.pem key.pem
+"""
+
+import os
+import sys
+import ssl
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'src', 'client', 'python'))
+
+from ArakoonProtocol import ArakoonClientConfig
+
+def serve(listener, context):
+    while True:
+        conn, _ = listener.accept()
+        try:
+            tls = context.wrap_socket(conn, server_side = True)
+            tls.close()
+        except Exception:
+            conn.close()
+
+def legacyConnect(address, caCert, cert, key):
+    sock = socket.create_connection(address, 5)
+    return ssl.wrap_socket(sock, ssl_version = ssl.PROTOCOL_SSLv23,
+                           cert_reqs = ssl.CERT_REQUIRED, ca_certs = caCert,
+                           certfile = cert, keyfile = key)
+
+def sharedConnect(address, config):
+    sock = socket.create_connection(address, 5)
+    return config.getTLSContext().wrap_socket(sock)
+
+def bench(name, connect, rounds):
+    samples = []
+    for i in xrange(rounds):
+        start = time.time()
+        connect().close()
+        samples.append(time.time() - start)
+    samples.sort()
+    print "%-28s mean %7.3f ms   p50 %7.3f ms   p99 %7.3f ms" % \
+        (name, 1000 * sum(samples) / rounds, 1000 * samples[rounds / 2],
+         1000 * samples[int(rounds * 0.99)])
+
+def main(caCert, cert, key, rounds = 500):
+    serverContext = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    serverContext.load_cert_chain(cert, key)
+    serverContext.load_verify_locations(caCert)
+    serverContext.verify_mode = ssl.CERT_REQUIRED
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    address = listener.getsockname()
+    server = threading.Thread(target = serve, args = (listener, serverContext))
+    server.setDaemon(True)
+    server.start()
+
+    config = ArakoonClientConfig('bench', {'node': ([address[0]], address[1])},
+                                 tls = True, tls_ca_cert = caCert,
+                                 tls_cert = (cert, key))
+    bench("wrap_socket per connection", lambda: legacyConnect(address, caCert, cert, key), rounds)
+    bench("shared SSL context", lambda: sharedConnect(address, config), rounds)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print __doc__
+        sys.exit(1)
+    main(*sys.argv[1:])